@@ -1,133 +1,179 @@
-
 import os
-import subprocess
-import chardet
+import time
+import shutil
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "code_atlas"))
+import database
+import encoding_detect
+import magic_detect
+
 SOURCE_DIR = Path("source-code")
 DOCS_DIR = Path("documents")
 REPORT_FILE = DOCS_DIR / "analysis_report.md"
 
+# Streaming pipeline: the walk feeds chunks of paths to a process pool, with at
+# most IN_FLIGHT_PER_WORKER chunks per worker queued at a time, and each result
+# is written to the index and the report as it comes back (in walk order).
+# Nothing is kept per file, so memory stays flat however big the tree is. Each
+# file costs one bounded read (see encoding_detect), or none if the index knows it.
+CHUNK_SIZE = 64
+IN_FLIGHT_PER_WORKER = 4
+COMMIT_EVERY = 2000         # Result rows per index transaction
+PROGRESS_EVERY = 1000
+
 def get_file_type(file_path):
+    # Signature table first; `file` only for what it can't name
+    return magic_detect.file_type(file_path)
+
+def check_encoding(file_path, index):
+    # The index's answer if the file hasn't changed since the scan, else the shared detector's
+    encoding = encoding_detect.indexed_encoding(index, file_path)
+    if encoding is None:
+        sample, complete = encoding_detect.read_sample(file_path)
+        encoding = encoding_detect.detect_bytes(sample, complete)
+    return encoding
+
+def walk_files(directory):
+    """Every file below directory, lazily, in a stable (sorted) order."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            yield os.path.join(root, file)
+
+def chunked(paths, size):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# --- Worker processes ---
+
+_index = None
+
+def init_worker():
+    global _index
+    _index = encoding_detect.open_index()
+
+def analyze_file(file_path):
+    """(path, is_rcs, encoding, file_type, error, size, mtime_ns) for one file."""
+    # RCS files are text, though a checked-in binary can make one look binary: reported as found
+    is_rcs = file_path.endswith(",v")
     try:
-        # Run file command only on things we suspect to be binary or matching specific criteria
-        result = subprocess.run(["file", "-b", str(file_path)], capture_output=True, text=True)
-        return result.stdout.strip()
+        st = os.stat(file_path)  # Before reading: a later change must not match the index row
+        encoding = check_encoding(file_path, _index)
     except Exception as e:
-        return f"Error running file command: {e}"
+        return (file_path, is_rcs, None, None, str(e), None, None)
+    # Only binaries are worth identifying
+    file_type = get_file_type(file_path) if encoding == "binary" else "Text"
+    return (file_path, is_rcs, encoding, file_type, None, st.st_size, st.st_mtime_ns)
 
-def is_binary_content(content):
-    if b'\0' in content:
-        return True
-    return False
+def analyze_chunk(paths):
+    return [analyze_file(path) for path in paths]
 
-def check_encoding(rawdata):
-    # specific check for shift_jis
-    try:
-        rawdata.decode('shift_jis')
-        # If it decodes successfully, it MIGHT be shift_jis. 
-        # But ASCII is also valid shift_jis.
-        try:
-            rawdata.decode('ascii')
-            return "ASCII"
-        except UnicodeDecodeError:
-            return "Shift-JIS"
-    except UnicodeDecodeError:
-        pass
-
-    # Detect other
-    # Limit chardet to first 10KB for speed
-    result = chardet.detect(rawdata[:10000])
-    return result['encoding']
-
-def analyze_directory(directory):
-    results = []
-    file_count = 0
-    
-    # Pre-count for progress
-    total_files = sum([len(files) for r, d, files in os.walk(directory)])
-    print(f"Found {total_files} files to analyze.")
-
-    for root, _, files in os.walk(directory):
-        for file in files:
-            file_path = Path(root) / file
-            file_count += 1
-            if file_count % 100 == 0:
-                print(f"Processing {file_count}/{total_files}: {file_path}", end='\r')
-
-            is_rcs = file.endswith(",v")
-            
-            # Read first chunk to detect binary
-            try:
-                with open(file_path, 'rb') as f:
-                    rawdata = f.read() # Read all for encoding detection, or chunk?
-                    # Reading all might be memory heavy for huge files, but source code is usually small.
-                    # Let's read up to 1MB.
-                    if len(rawdata) > 1000000:
-                        rawdata = rawdata[:1000000]
-            except Exception as e:
-                results.append({"path": str(file_path), "error": str(e)})
-                continue
-
-            if is_binary_content(rawdata):
-                # Run 'file' command
-                file_type_str = get_file_type(file_path)
-                encoding = "Binary"
-            else:
-                file_type_str = "Text" # Placeholder, or maybe don't run `file` for text
-                encoding = check_encoding(rawdata)
-            
-            # If RCS, it might look like binary or text depending on content (often text but with weird chars maybe?)
-            # Actually RCS files are text, ensuring they are treated as such.
-            if is_rcs and encoding == "Binary":
-                 # RCS files are technically text but might contain binary keywords or just be large
-                 # Let's assume text for RCS unless it's really weird.
-                 # But 'is_binary_content' checks for NUL. RCS shouldn't have NUL unless the checked-in file was binary.
-                 pass
-
-            results.append({
-                "path": str(file_path),
-                "is_rcs": is_rcs,
-                "file_type": file_type_str,
-                "encoding": encoding
-            })
-    print(f"\nFinished processing {file_count} files.")
-    return results
+# --- Output ---
 
-def main():
-    if not SOURCE_DIR.exists():
-        print(f"Directory {SOURCE_DIR} not found.")
-        return
+def index_updates(rows):
+    """
+    (encoding, magic, path, size, mtime) for the files.encoding / files.magic
+    columns of the CodeAtlas index. Only rows the scanner already has, with the
+    same size and mtime, are touched: the scanner owns the rows, and file_type
+    stays the content indexer's (its NULL is what queues a file).
+    """
+    return [(encoding, file_type if encoding == "binary" else None, os.path.relpath(path), size, mtime)
+            for path, _, encoding, file_type, error, size, mtime in rows if error is None]
 
-    print("Analyzing files...")
-    results = analyze_directory(SOURCE_DIR)
-    
-    print(f"Generating report at {REPORT_FILE}...")
-    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+def report_row(row):
+    path_str, is_rcs, encoding, file_type, error = row[:5]
+    rel_path = os.path.relpath(path_str, start=SOURCE_DIR)
+    cells = (rel_path, is_rcs, encoding_detect.label(encoding) if error is None else 'N/A',
+             file_type or 'N/A', error or '')
+    return "| " + " | ".join(str(cell).replace("|", "\\|") for cell in cells) + " |\n"
+
+def write_report(report_path, details_path, counts):
+    """The final report: summary on top, then the streamed details (copied, not loaded)."""
+    tmp_path = f"{report_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         f.write("# Source Code Analysis Report\n\n")
-        f.write(f"Total files analyzed: {len(results)}\n\n")
-        
-        # Summary statistics
-        rcs_count = sum(1 for r in results if r.get('is_rcs'))
-        shift_jis_count = sum(1 for r in results if r.get('encoding') == "Shift-JIS")
-        binary_count = sum(1 for r in results if r.get('encoding') == "Binary")
-        
-        f.write(f"- RCS Files: {rcs_count}\n")
-        f.write(f"- Shift-JIS Files: {shift_jis_count}\n")
-        f.write(f"- Binary Files: {binary_count}\n\n")
-        
+        f.write(f"Total files analyzed: {counts['total']}\n\n")
+        f.write(f"- RCS Files: {counts['rcs']}\n")
+        f.write(f"- Shift-JIS Files: {counts['shift_jis']}\n")
+        f.write(f"- Binary Files: {counts['binary']}\n")
+        f.write(f"- Errors: {counts['error']}\n\n")
         f.write("## File Details\n")
         f.write("| File Path | RCS | Encoding | File Type | Error |\n")
         f.write("| --- | --- | --- | --- | --- |\n")
-        for res in results:
-            path_str = res.get('path', '')
-            # Truncate path for table if too long? Or just relative
-            rel_path = path_str
-            if str(SOURCE_DIR) in path_str:
-                rel_path = os.path.relpath(path_str, start=SOURCE_DIR)
-            
-            f.write(f"| {rel_path} | {res.get('is_rcs', False)} | {res.get('encoding', 'N/A')} | {res.get('file_type', 'N/A')} | {res.get('error', '')} |\n")
+        with open(details_path, encoding="utf-8") as details:
+            shutil.copyfileobj(details, f)
+    os.replace(tmp_path, report_path)
+    os.remove(details_path)
+
+def analyze_directory(directory, report_path=REPORT_FILE, workers=None):
+    workers = workers or os.cpu_count()
+    max_in_flight = workers * IN_FLIGHT_PER_WORKER
+    counts = {'total': 0, 'rcs': 0, 'shift_jis': 0, 'binary': 0, 'error': 0}
+    details_path = f"{report_path}.details"
+    database.init_db()
+    conn = database.get_db()
+    started = time.perf_counter()
+
+    def consume(rows):
+        conn.executemany(
+            "UPDATE files SET encoding = ?, magic = ? WHERE path = ? AND removed = 0 AND size = ? AND mtime = ?",
+            index_updates(rows)
+        )
+        for row in rows:
+            details.write(report_row(row))
+            counts['total'] += 1
+            counts['rcs'] += row[1]
+            counts['shift_jis'] += encoding_detect.label(row[2]) == "Shift-JIS"
+            counts['binary'] += row[2] == "binary"
+            counts['error'] += row[4] is not None
+            if counts['total'] % COMMIT_EVERY == 0:
+                conn.commit()
+            if counts['total'] % PROGRESS_EVERY == 0:
+                rate = counts['total'] / (time.perf_counter() - started)
+                print(f"Processed {counts['total']} files ({rate:.0f}/s): {row[0]}", end='\r')
+
+    print(f"Analyzing files with {workers} workers...")
+    with open(details_path, "w", encoding="utf-8") as details, \
+         ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        pending = deque()
+        for chunk in chunked(walk_files(directory), CHUNK_SIZE):
+            pending.append(executor.submit(analyze_chunk, chunk))
+            # Bounded: wait for the oldest chunk before walking further
+            if len(pending) >= max_in_flight:
+                consume(pending.popleft().result())
+        while pending:
+            consume(pending.popleft().result())
+    conn.commit()
+    database.close_db()
+    print(f"\nFinished processing {counts['total']} files in {time.perf_counter() - started:.1f}s.")
+
+    print(f"Generating report at {report_path}...")
+    write_report(report_path, details_path, counts)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the encoding and type of every file in source-code")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    if not SOURCE_DIR.exists():
+        print(f"Directory {SOURCE_DIR} not found.")
+        return
+    DOCS_DIR.mkdir(exist_ok=True)
+    analyze_directory(SOURCE_DIR, workers=args.workers)
+    print(f"Encodings and binary types are also in {database.DB_PATH} (files.encoding, files.magic).")
 
 if __name__ == "__main__":
     main()
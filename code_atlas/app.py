@@ -5,12 +5,28 @@ import subprocess
 import markdown
 import re
 import json
+import time
 
-from pygments import highlight
-from pygments.lexers import get_lexer_for_filename, TextLexer
-from pygments.formatters import HtmlFormatter
-from flask import Flask, render_template, request, jsonify, abort
-from database import init_db, add_file, get_db
+from flask import Flask, render_template, request, jsonify, abort, Response, stream_with_context
+from database import (init_db, add_file, get_db, close_db, get_query_stats,
+                      parse_file_annotations_raw, reconstruct_markdown,
+                      get_line_notes, set_line_note, replace_file_notes, merge_line_notes,
+                      search_line_notes)
+import tool_plugins
+
+# Shared with the translation tools (and the encoding detector, with the scripts)
+sys.path.append(tool_plugins.TOOLS_DIR)
+import render_cache
+import code_search
+import c_symbols
+import tree_index
+import watcher
+import jobs
+import batch_tools
+import binary_strings
+import encoding_detect
+import fuzzy_memory
+import translate_tree
 
 # Adjust path to import custom tools if needed
 sys.path.append(os.getcwd())
@@ -18,31 +34,45 @@ sys.path.append(os.getcwd())
 app = Flask(__name__)
 SOURCE_ROOT = os.path.abspath("source-code")
 
+# Huge files are sent to the viewer in windows, the rest is fetched from /api/lines on scroll
+INITIAL_LINES = 2000
+MAX_LINE_WINDOW = 5000
+
 # --- Toolbelt Registration ---
+# "plugin": (module in tools/, function) runs in the warm worker pool (see tool_plugins.py)
+# and returns a result dict; "command" is an external program run per file.
 TOOLS = {
     "extract_sjis": {
         "name": "Extract Shift-JIS Text",
         "description": "Extracts Japanese string literals from binary files.",
-        "command": ["python3", "tools/extract_sjis.py"],
+        "plugin": ("extract_sjis", "extract_sjis"),
         "extensions": []
     },
     "file_info": {
         "name": "File Info",
-        "description": "Run the 'file' command to detect type.",
-        "command": ["file"],
+        "description": "Identifies the file type from its signature (falls back to the 'file' command).",
+        "plugin": ("magic_detect", "file_info"),
         "extensions": []
     },
     "auto_translate_sentence": {
         "name": "Translate (Global/Sentence)",
         "description": "Detects Japanese (SJIS/UTF8) and translates grouped sentences.",
-        "command": ["python3", "tools/auto_translate_file.py", "--strategy", "sentence"],
-        "extensions": []
+        "plugin": ("auto_translate_file", "parse_and_process"),
+        "options": {"strategy": "sentence"},
+        "note_kind": "auto_translate",
+        "extensions": [],
+        "max_concurrent": 1,  # One translation at a time per tool, the API rate-limits us
+        "max_parallel": 2     # Files translated at once by a subtree run, same reason
     },
     "auto_translate_line": {
         "name": "Translate (Line-by-Line)",
         "description": "Translates every specific line individually, no grouping.",
-        "command": ["python3", "tools/auto_translate_file.py", "--strategy", "line"],
-        "extensions": []
+        "plugin": ("auto_translate_file", "parse_and_process"),
+        "options": {"strategy": "line"},
+        "note_kind": "auto_translate",
+        "extensions": [],
+        "max_concurrent": 1,  # One translation at a time per tool, the API rate-limits us
+        "max_parallel": 2     # Files translated at once by a subtree run, same reason
     },
     "format_code": {
         "name": "Format C Code",
@@ -53,118 +83,238 @@ TOOLS = {
     "open_vscode": {
         "name": "Open Folder in VS Code",
         "description": "Opens the parent directory of this file in VS Code.",
-        "command": ["python3", "tools/open_vscode.py"],
-        "extensions": []
+        "plugin": ("open_vscode", "open_vscode"),
+        "extensions": [],
+        "subtree": False
     }
 }
+tool_plugins.preload(t['plugin'][0] for t in TOOLS.values() if 'plugin' in t)
 
 @app.before_request
 def startup_check():
     if not getattr(app, 'db_initialized', False):
         init_db()
+        jobs.init_jobs()
         app.db_initialized = True
 
-def scan_files():
-    print("Scanning source-code directory...")
-    count = 0
-    with get_db() as conn:
-        for root, dirs, files in os.walk(SOURCE_ROOT):
-            for file in files:
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(full_path, start=os.getcwd())
-                
-                # Sanitize for DB (remove surrogates)
-                try:
-                    rel_path.encode('utf-8')
-                    file.encode('utf-8')
-                except UnicodeEncodeError:
-                    # Replace bad chars
-                    rel_path = rel_path.encode('utf-8', 'replace').decode('utf-8')
-                    file = file.encode('utf-8', 'replace').decode('utf-8')
-
-                # Check if exists
-                cur = conn.execute("SELECT id FROM files WHERE path = ?", (rel_path,))
-                if not cur.fetchone():
-                    conn.execute("INSERT INTO files (path, filename) VALUES (?, ?)", (rel_path, file))
-                    count += 1
-        conn.commit()
-    print(f"Scanned {count} new files.")
+@app.teardown_appcontext
+def teardown_db(exc):
+    # One connection per request thread, released when the request ends
+    close_db(exc)
+
+# Rows are written in chunks so a multi-million file scan never holds one giant transaction
+SCAN_BATCH_SIZE = 5000
 
-def parse_file_annotations(md_blob):
+def walk_source_tree(root, on_dir=None):
     """
-    Parses a combined markdown blob into a global note and a dictionary of line notes.
-    Format:
-    [Global Markdown]
-    @lines
-    # [number]
-    [Line Markdown]
+    Yields (full_path, filename, stat_result) for every file below root.
+    Uses scandir directly so each entry is stat'ed exactly once.
+    on_dir(full_path) is called for each directory (root included) before
+    any of its files are yielded, parents before children.
     """
-    if not md_blob:
-        return "", {}, ""
-        
-    global_md = md_blob
-    lines_dict = {}
-    
-    if "@lines" in md_blob:
-        parts = md_blob.split("@lines", 1)
-        global_md = parts[0].strip()
-        lines_part = parts[1].strip()
-        
-        # Split by "# [number]" pattern at START of line
-        import re
-        # This matches "# 123" at the start of a line, then captures the rest of the content until the next match
-        line_splits = re.split(r'^#\s*(\d+)\s*', lines_part, flags=re.MULTILINE)
-        
-        # re.split with groups returns [before, group1, content1, group2, content2...]
-        for i in range(1, len(line_splits), 2):
-            line_num = int(line_splits[i])
-            content = line_splits[i+1].strip()
-            if content:
-                lines_dict[line_num] = markdown.markdown(content)
+    pending = [root]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as it:
+                if on_dir:
+                    on_dir(current)
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.is_file():
+                            yield entry.path, entry.name, entry.stat()
+                    except OSError:
+                        # Broken links, permission errors, files vanishing mid-scan
+                        continue
+        except OSError:
+            continue
+
+def db_safe(text):
+    """Replaces surrogate escapes (undecodable file names) so SQLite accepts the text."""
+    try:
+        text.encode('utf-8')
+        return text
+    except UnicodeEncodeError:
+        return text.encode('utf-8', 'replace').decode('utf-8')
 
-    global_html = markdown.markdown(global_md) if global_md else ""
-    return global_html, lines_dict, md_blob, lines_dict # Return raw dict as 4th element (temporary hack or just use lines_dict? lines_dict IS raw)
+def _walk_root(root, on_dir):
+    """walk_source_tree for a directory root; a file root yields just itself."""
+    if os.path.isdir(root) and not os.path.islink(root):
+        yield from walk_source_tree(root, on_dir)
+    elif os.path.isfile(root):
+        try:
+            st = os.stat(root)
+        except OSError:
+            return
+        on_dir(os.path.dirname(root))
+        yield root, os.path.basename(root), st
 
-def parse_file_annotations_raw(md_blob):
+def scan_files(roots=None):
     """
-    Returns global_raw, lines_raw_dict
+    Incrementally syncs the files and dirs tables with SOURCE_ROOT, or only
+    with the given absolute paths below it (files or directories, which may
+    have disappeared) as the live watcher does.
+    Only rows whose size/mtime/inode differ are touched, and files that
+    disappeared are flagged as removed (their annotations are kept).
+    Directories whose listing changed get their aggregates and version refreshed.
+    Returns a dict of 'added', 'changed' and 'removed' path lists.
     """
-    if not md_blob:
-        return "", {}
-        
-    global_md = md_blob
-    lines_dict = {}
-    
-    if "@lines" in md_blob:
-        parts = md_blob.split("@lines", 1)
-        global_md = parts[0].strip()
-        lines_part = parts[1].strip()
-        
-        # Split by "# [number]" pattern at START of line
-        import re
-        line_splits = re.split(r'^#\s*(\d+)\s*', lines_part, flags=re.MULTILINE)
-        
-        for i in range(1, len(line_splits), 2):
-            line_num = int(line_splits[i])
-            content = line_splits[i+1].strip()
-            if content:
-                lines_dict[line_num] = content
-                
-    return global_md, lines_dict
-
-def reconstruct_markdown(global_md, lines_dict):
+    if roots is None:
+        print("Scanning source-code directory...")
+        roots = [SOURCE_ROOT]
+    else:
+        # Nested roots are covered by their ancestor
+        roots = sorted(set(roots))
+        roots = [r for i, r in enumerate(roots)
+                 if not any(r.startswith(other + os.sep) for other in roots[:i])]
+    # Paths are stored relative to the working directory (e.g. 'source-code/foo.c')
+    rel_root = os.path.relpath(SOURCE_ROOT, start=os.getcwd())
+    prefix = rel_root + os.sep
+
+    def to_rel(full_path):
+        return rel_root if full_path == SOURCE_ROOT else db_safe(prefix + full_path[len(SOURCE_ROOT) + 1:])
+
+    added, changed, removed = [], [], []
+    inserts, updates, relinks = [], [], []
+    touched_dirs = set()
+
+    with get_db() as conn:
+        # Snapshot of everything we indexed last time below the roots, keyed by path.
+        # Range queries instead of LIKE so the UNIQUE(path) indexes are used.
+        known = {}
+        known_dirs = {}
+        for root in roots:
+            rel = to_rel(root)
+            bounds = (rel, rel + os.sep, rel + chr(ord(os.sep) + 1))
+            cur = conn.execute(
+                "SELECT id, path, size, mtime, inode, removed, file_type, dir_id FROM files "
+                "WHERE path = ? OR (path >= ? AND path < ?)",
+                bounds
+            )
+            for row in cur:
+                known[row['path']] = row
+            cur = conn.execute(
+                "SELECT id, path, parent_id FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", bounds
+            )
+            for row in cur:
+                known_dirs[row['path']] = row
+        dir_ids = {}
+
+        def ensure_dir(rel_dir):
+            if rel_dir in dir_ids:
+                return dir_ids[rel_dir]
+            row = known_dirs.pop(rel_dir, None)
+            if row is None:
+                # Ancestor of a partial scan root
+                row = conn.execute("SELECT id FROM dirs WHERE path = ?", (rel_dir,)).fetchone()
+            if row is not None:
+                dir_ids[rel_dir] = row['id']
+                return row['id']
+            parent_id = None if rel_dir == rel_root else ensure_dir(os.path.dirname(rel_dir))
+            new_id = conn.execute(
+                "INSERT INTO dirs (path, name, parent_id) VALUES (?, ?, ?)",
+                (rel_dir, os.path.basename(rel_dir), parent_id)
+            ).lastrowid
+            dir_ids[rel_dir] = new_id
+            touched_dirs.update((new_id, parent_id))
+            return new_id
+
+        def on_dir(full_path):
+            ensure_dir(to_rel(full_path))
+
+        def flush():
+            if inserts:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO files (path, filename, size, mtime, inode, dir_id) VALUES (?, ?, ?, ?, ?, ?)",
+                    inserts
+                )
+                inserts.clear()
+            if updates:
+                conn.executemany(
+                    # file_type goes back to NULL so the content indexer picks the file up again
+                    "UPDATE files SET size = ?, mtime = ?, inode = ?, dir_id = ?, removed = 0, file_type = NULL, encoding = NULL, magic = NULL WHERE id = ?",
+                    updates
+                )
+                updates.clear()
+            if relinks:
+                # Rows indexed before the dirs table existed
+                conn.executemany("UPDATE files SET dir_id = ? WHERE id = ?", relinks)
+                relinks.clear()
+            conn.commit()
+
+        for root in roots:
+            for full_path, file, st in _walk_root(root, on_dir):
+                rel_path = to_rel(full_path)
+                file = db_safe(file)
+                dir_id = dir_ids[os.path.dirname(rel_path)]
+
+                row = known.pop(rel_path, None)
+                if row is None:
+                    inserts.append((rel_path, file, st.st_size, st.st_mtime_ns, st.st_ino, dir_id))
+                    added.append(rel_path)
+                elif row['removed']:
+                    updates.append((st.st_size, st.st_mtime_ns, st.st_ino, dir_id, row['id']))
+                    added.append(rel_path)
+                elif (row['size'], row['mtime'], row['inode']) != (st.st_size, st.st_mtime_ns, st.st_ino):
+                    updates.append((st.st_size, st.st_mtime_ns, st.st_ino, dir_id, row['id']))
+                    changed.append(rel_path)
+                elif row['dir_id'] != dir_id:
+                    relinks.append((dir_id, row['id']))
+                else:
+                    continue
+                touched_dirs.add(dir_id)
+
+                if len(inserts) + len(updates) + len(relinks) >= SCAN_BATCH_SIZE:
+                    flush()
+
+        # Whatever is left in the snapshot was not seen on disk
+        gone = [row for row in known.values() if not row['removed'] and row['file_type'] != 'dir']
+        removed = [row['path'] for row in gone]
+        touched_dirs.update(row['dir_id'] for row in gone)
+        gone = [(row['id'],) for row in gone]
+        for i in range(0, len(gone), SCAN_BATCH_SIZE):
+            conn.executemany("UPDATE files SET removed = 1 WHERE id = ?", gone[i:i + SCAN_BATCH_SIZE])
+            conn.commit()
+        flush()
+
+        gone_dirs = list(known_dirs.values())
+        conn.executemany("DELETE FROM dirs WHERE id = ?", [(row['id'],) for row in gone_dirs])
+        touched_dirs.difference_update(row['id'] for row in gone_dirs)
+        touched_dirs.update(row['parent_id'] for row in gone_dirs)
+        tree_index.refresh_dirs(conn, touched_dirs)
+        conn.commit()
+
+    print(f"Scan complete: {len(added)} added, {len(changed)} changed, {len(removed)} removed.")
+    return {"added": added, "changed": changed, "removed": removed}
+
+def update_derived_indexes(changes):
     """
-    Rebuilds the master blob from components.
+    Brings the indexes built from file contents in line with a scan result.
+    New/changed files are found through their NULL file_type, so this also
+    finishes work left over by an interrupted run.
     """
-    blob = global_md.strip() + "\n\n"
-    if lines_dict:
-        blob += "@lines\n"
-        # Sort by line number
-        for lnum in sorted(lines_dict.keys()):
-            content = lines_dict[lnum].strip()
-            if content:
-                blob += f"# {lnum}\n{content}\n"
-    return blob.strip()
+    rel_root = os.path.relpath(SOURCE_ROOT, start=os.getcwd())
+    code_search.remove_from_index(changes['removed'])
+    c_symbols.remove_files(changes['removed'])
+    pending = code_search.pending_files(rel_root)
+    # Changed binaries get re-extracted by the next string table run
+    binary_strings.remove_files(changes['removed'] + [row['path'] for row in pending])
+    c_symbols.index_files(pending)
+    # Last: it clears the NULL file_type marker the others rely on. Re-read, for
+    # the encodings the symbol pass recorded
+    code_search.index_pending_files(rel_root)
+
+def apply_live_changes(paths):
+    """Watcher callback: re-syncs the touched paths and everything derived from them."""
+    try:
+        changes = scan_files(paths)
+        update_derived_indexes(changes)
+    finally:
+        close_db()  # The watcher thread's connection, so its query stats are kept
+    for rel_path in changes['changed'] + changes['removed']:
+        render_cache.invalidate(os.path.abspath(rel_path))
 
 @app.route('/')
 def index():
@@ -186,27 +336,49 @@ def api_tree():
     # Security: prevent breakout
     if '..' in req_path or req_path.startswith('/'):
          return jsonify([]), 400
-         
+
+    rel_root = os.path.relpath(SOURCE_ROOT, start=os.getcwd())
+    dir_row = tree_index.get_dir(rel_root, req_path)
+    if dir_row:
+        etag = tree_index.etag_for(dir_row)
+        if request.if_none_match.contains(etag):
+            return '', 304, {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+        resp = jsonify(tree_index.list_dir(dir_row, req_path))
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+
+    # Not scanned yet: read the disk
     abs_path = os.path.join(SOURCE_ROOT, req_path)
     if not os.path.exists(abs_path) or not os.path.isdir(abs_path):
         return jsonify([]), 404
-        
-    entries = []
-    try:
-        with os.scandir(abs_path) as it:
-            for entry in it:
-                # Type
-                is_dir = entry.is_dir()
-                entries.append({
-                    "name": entry.name,
-                    "path": os.path.join(req_path, entry.name),
-                    "type": "dir" if is_dir else "file"
-                })
-    except PermissionError:
-        pass
-        
-    entries.sort(key=lambda x: (0 if x['type']=='dir' else 1, x['name'].lower()))
-    return jsonify(entries)
+    return jsonify(tree_index.scandir_listing(abs_path, req_path))
+
+@app.route('/api/tree/levels')
+def api_tree_levels():
+    """
+    Listings of every directory from the root down to path (path itself if it
+    is a directory) in one response, for revealing deep links in the tree.
+    """
+    req_path = request.args.get('path', '').strip('/')
+    if '..' in req_path:
+        return jsonify({"error": "Invalid path"}), 400
+
+    rel_root = os.path.relpath(SOURCE_ROOT, start=os.getcwd())
+    parts = req_path.split('/') if req_path else []
+    levels = []
+    for depth in range(len(parts) + 1):
+        level_path = '/'.join(parts[:depth])
+        dir_row = tree_index.get_dir(rel_root, level_path)
+        if dir_row:
+            entries = tree_index.list_dir(dir_row, level_path)
+        else:
+            abs_path = os.path.join(SOURCE_ROOT, level_path)
+            if not os.path.isdir(abs_path):
+                break
+            entries = tree_index.scandir_listing(abs_path, level_path)
+        levels.append({"path": level_path, "entries": entries})
+    return jsonify({"path": req_path, "levels": levels})
 
 @app.route('/api/folder_details')
 def api_folder_details():
@@ -230,10 +402,8 @@ def api_folder_details():
     notes_html = ""
     notes_raw = ""
     if file_rec:
-        cur = conn.execute("SELECT content FROM annotations WHERE file_id = ? AND type = 'manual' ORDER BY id DESC LIMIT 1", (file_rec['id'],))
-        row = cur.fetchone()
-        if row:
-            notes_raw = row['content']
+        notes_raw = get_line_notes(file_rec['id'], 0, 0).get(0, "")
+        if notes_raw:
             notes_html = markdown.markdown(notes_raw)
             
     # Children
@@ -292,9 +462,10 @@ def view_file(file_path):
              
          file_id = file_rec['id']
          
-         # Fetch annotations
-         cur = conn.execute("SELECT * FROM annotations WHERE file_id = ?", (file_id,))
-         annotations = [dict(row) for row in cur.fetchall()]
+         # Current notes (the annotations table is the edit history)
+         lines_raw = get_line_notes(file_id)
+         annotations = [{"line_number": lnum, "content": lines_raw[lnum]} for lnum in sorted(lines_raw)]
+         global_raw = lines_raw.pop(0, "")
          
          # List children
          entries = []
@@ -317,16 +488,19 @@ def view_file(file_path):
                                 tree_path=tree_path,
                                 name=os.path.basename(abs_path),
                                 annotations=annotations,
+                                global_raw=global_raw,
+                                lines_raw=reconstruct_markdown("", lines_raw),
                                 children=entries,
-                                tools=folder_tools)
+                                tools=folder_tools,
+                                subtree_tools={k: t for k, t in TOOLS.items() if t.get('subtree', True)})
 
-    # Handle File
+    # Handle File (highlighted lines come from the render cache, lexing only on a miss)
     try:
-        with open(abs_path, 'r', encoding='utf-8', errors='replace') as f:
-            content = f.read()
-            is_binary = False
+        highlighted_lines, total_lines = render_cache.render_window(abs_path, 0, INITIAL_LINES,
+                                                                    encoding=file_encoding(abs_path))
+        is_binary = False
     except:
-        content = "[Binary File]"
+        highlighted_lines, total_lines = [], 0
         is_binary = True
 
     # Fetch annotations
@@ -348,37 +522,16 @@ def view_file(file_path):
     notes_raw = ""
 
     if file_rec:
-        # Fetch the master annotation (line 0)
-        cur = conn.execute("SELECT content FROM annotations WHERE file_id = ? AND line_number = 0 ORDER BY created_at DESC LIMIT 1", (file_rec['id'],))
-        row = cur.fetchone()
-        if row:
-            # We need both HTML for display and RAW for editing
-            global_raw, lines_raw = parse_file_annotations_raw(row['content'])
-            
-            # HTML for display
-            global_notes_html = markdown.markdown(global_raw) if global_raw else ""
-            line_annotations = {k: markdown.markdown(v) for k, v in lines_raw.items()}
-            notes_raw = row['content']
+        # We need both HTML for display and RAW for editing
+        lines_raw = get_line_notes(file_rec['id'])
+        global_raw = lines_raw.pop(0, "")
 
-    # Syntax Highlighting
-    from pygments.lexers.c_cpp import CLexer
-    
-    if tree_path.lower().endswith(('.c', '.h')):
-        lexer = CLexer(stripnl=False, stripall=False)
-    else:
-        try:
-            lexer = get_lexer_for_filename(tree_path, stripnl=False, stripall=False)
-        except:
-            lexer = TextLexer(stripnl=False, stripall=False)
-    
-    style_name = 'tango'
-    formatter = HtmlFormatter(nowrap=True, style=style_name)
-    # Highlight the whole content, then split into lines
-    # This ensures multiline comments/tokens are handled correctly
-    full_highlighted = highlight(content, lexer, formatter)
-    highlighted_lines = full_highlighted.splitlines()
+        # HTML for display
+        global_notes_html = markdown.markdown(global_raw) if global_raw else ""
+        line_annotations = {k: markdown.markdown(v) for k, v in lines_raw.items()}
+        notes_raw = reconstruct_markdown(global_raw, lines_raw)
 
-    pygments_css = HtmlFormatter(style=style_name).get_style_defs('.highlight')
+    pygments_css = render_cache.get_style_css()
 
     # Filter tools based on extensions
     available_tools = {}
@@ -389,8 +542,8 @@ def view_file(file_path):
     return render_template('view_file.html', 
                            file_path=tree_path, 
                            tree_path=tree_path,
-                           content=content,
                            highlighted_lines=highlighted_lines,
+                           total_lines=total_lines,
                            pygments_css=pygments_css,
                            is_binary=is_binary,
                            global_notes_html=global_notes_html,
@@ -399,6 +552,94 @@ def view_file(file_path):
                            notes_raw=notes_raw,
                            tools=available_tools)
 
+def file_encoding(abs_path):
+    """
+    Encoding of a source file from the index. Detected again if the file
+    changed since it was indexed, and stored if the scan hasn't got to it yet.
+    """
+    conn = get_db()
+    row = conn.execute("SELECT id, size, mtime, encoding FROM files WHERE path = ?",
+                       (os.path.relpath(abs_path),)).fetchone()
+    if row is None:
+        return encoding_detect.detect_file(abs_path)
+    unchanged = encoding_detect.unchanged(row['size'], row['mtime'], abs_path)
+    if unchanged and row['encoding']:
+        return row['encoding']
+    encoding = encoding_detect.detect_file(abs_path)
+    if unchanged and encoding:
+        # A changed file keeps its stale row until the next scan re-indexes it
+        conn.execute("UPDATE files SET encoding = ? WHERE id = ?", (encoding, row['id']))
+        conn.commit()
+    return encoding
+
+def resolve_source_path(file_path):
+    """
+    Same resolution as view_file: relative to the project root, else to
+    source-code. None if the result (symlinks followed) is outside source-code.
+    """
+    abs_path = os.path.abspath(file_path)
+    if not os.path.exists(abs_path):
+        alt_path = os.path.join("source-code", file_path)
+        if os.path.exists(os.path.abspath(alt_path)):
+            abs_path = os.path.abspath(alt_path)
+    root = os.path.realpath(SOURCE_ROOT)
+    if os.path.commonpath([os.path.realpath(abs_path), root]) != root:
+        return None
+    return abs_path
+
+@app.route('/api/lines')
+def api_lines():
+    """
+    Highlighted lines [start, start + count) of a file (1-based), plus their notes.
+    """
+    req_path = request.args.get('path', '')
+    start = max(1, request.args.get('start', 1, type=int))
+    count = min(max(1, request.args.get('count', INITIAL_LINES, type=int)), MAX_LINE_WINDOW)
+
+    abs_path = resolve_source_path(req_path)
+    if abs_path is None or not os.path.isfile(abs_path):
+        return jsonify({"error": "File not found"}), 404
+
+    lines, total = render_cache.render_window(abs_path, start - 1, count, encoding=file_encoding(abs_path))
+
+    tree_path = os.path.relpath(abs_path, SOURCE_ROOT)
+    notes = {}
+    file_rec = get_db().execute("SELECT id FROM files WHERE path = ?", (tree_path,)).fetchone()
+    if file_rec and lines:
+        notes = get_line_notes(file_rec['id'], start, start + len(lines) - 1)
+
+    result = []
+    for i, html in enumerate(lines):
+        lnum = start + i
+        entry = {"number": lnum, "html": html}
+        if lnum in notes:
+            entry["note_raw"] = notes[lnum]
+            entry["note_html"] = markdown.markdown(notes[lnum])
+        result.append(entry)
+
+    return jsonify({"path": tree_path, "start": start, "total": total, "lines": result})
+
+def run_plugin_tool(job, tool_def, abs_path):
+    """Job task for plugin tools: one call on the warm pool, notes merged from its result."""
+    result = tool_plugins.call(tool_def, abs_path)
+    job.result = result
+    if result.get('error'):
+        raise jobs.ToolError(result['error'])
+    output = result.get('output', '')
+
+    notes = tool_plugins.note_lines(result)
+    if notes:
+        # We rely on the request passing the correct tree path
+        file_rec = get_db().execute("SELECT id FROM files WHERE path = ?", (job.file_path,)).fetchone()
+        if not file_rec:
+            raise jobs.ToolError("File not found in DB for annotation update.")
+        count = merge_line_notes(file_rec['id'], notes, tool_def.get('note_kind', 'tool'))
+        output = f"Added {count} annotations.\n{output}"
+    elif 'annotations' in result and not output:
+        output = "Nothing to annotate.\n"
+    job.append(output)
+    return output
+
 @app.route('/api/run_tool', methods=['POST'])
 def run_tool():
     data = request.json
@@ -417,78 +658,115 @@ def run_tool():
         if os.path.exists(os.path.abspath(alt_path)):
             abs_path = os.path.abspath(alt_path)
     
-    cmd = tool_def['command'] + [abs_path]
-    print(f"Running tool: {cmd}")
-    
-    try:
-        res = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        output = res.stdout + "\n" + res.stderr
-        
-        # Check if output is JSON with annotations
-        if tool_key.startswith('auto_translate'):
-            try:
-                # Find the JSON part if there is mixed output
-                json_start = output.find('{')
-                if json_start != -1:
-                    json_str = output[json_start:]
-                    result = json.loads(json_str)
-                    
-                    if "annotations" in result:
-                         count = 0
-                         conn = get_db()
-                         # Get file_id
-                         # file_path might be relative or absolute, need exact match
-                         # We rely on the request passing the correct tree path
-                         rel_path = data.get('file_path') 
-                         
-                         file_rec = conn.execute("SELECT id FROM files WHERE path = ?", (rel_path,)).fetchone()
-                         if file_rec:
-                             file_id = file_rec['id']
-                             # Get master
-                             cur = conn.execute("SELECT content FROM annotations WHERE file_id = ? AND line_number = 0 ORDER BY created_at DESC LIMIT 1", (file_id,))
-                             row = cur.fetchone()
-                             current_blob = row['content'] if row else ""
-                             global_raw, lines_raw = parse_file_annotations_raw(current_blob)
-                             
-                             # Merge
-                             for lnum_str, note in result['annotations'].items():
-                                 lnum = int(lnum_str)
-                                 # Append if exists?
-                                 if lnum in lines_raw:
-                                     if note not in lines_raw[lnum]:
-                                         lines_raw[lnum] += f"\n\n{note}"
-                                 else:
-                                     lines_raw[lnum] = note
-                                 count += 1
-                                 
-                             # Reconstruct and save
-                             if count > 0:
-                                 new_blob = reconstruct_markdown(global_raw, lines_raw)
-                                 conn.execute(
-                                    "INSERT INTO annotations (file_id, line_number, content, type) VALUES (?, ?, ?, ?)",
-                                    (file_id, 0, new_blob, 'auto_translate')
-                                 )
-                                 conn.commit()
-                                 output = f"Successfully translated and added {count} annotations.\nRaw Output:\n{output}"
-                         else:
-                             output = "Error: File not found in DB for annotation update.\n" + output
-                         conn.close()
-            except Exception as e:
-                output = f"Error processing translation results: {e}\nRaw Output:\n{output}"
-
-        return jsonify({"output": output})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    if 'plugin' in tool_def:
+        job_id = jobs.submit(
+            tool_key, file_path, None,
+            limit=tool_def.get('max_concurrent'),
+            task=lambda job: run_plugin_tool(job, tool_def, abs_path),
+            description=f"{'.'.join(tool_def['plugin'])}({abs_path})"
+        )
+    else:
+        job_id = jobs.submit(
+            tool_key, file_path, tool_def['command'] + [abs_path],
+            limit=tool_def.get('max_concurrent'),
+            timeout=tool_def.get('timeout')
+        )
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
 
-    return jsonify({"status": "success"})
+@app.route('/api/run_tool_tree', methods=['POST'])
+def run_tool_tree():
+    """Runs a tool on every matching file below a folder, as one background job."""
+    data = request.json
+    tool_key = data.get('tool')
+    tree_dir = (data.get('path') or '').strip('/')
 
+    if tool_key not in TOOLS or not TOOLS[tool_key].get('subtree', True):
+        return jsonify({"error": "Unknown tool"}), 400
+    if '..' in tree_dir.split('/'):
+        return jsonify({"error": "Invalid path"}), 400
+
+    tool_def = TOOLS[tool_key]
+    targets = batch_tools.collect_targets(SOURCE_ROOT, tree_dir, tool_def['extensions'])
+    if not targets:
+        return jsonify({"error": "No matching files below this folder (has it been scanned?)"}), 404
+
+    workers = min(os.cpu_count(), tool_def.get('max_parallel', os.cpu_count()))
+    job_id = jobs.submit(
+        tool_key, tree_dir, None,
+        limit=tool_def.get('max_concurrent'),
+        task=lambda job: batch_tools.run_on_subtree(job, tool_def, tree_dir, targets, workers),
+        description=f"{tool_def['name']} on {len(targets)} files under /{tree_dir}"
+    )
+    return jsonify({"job_id": job_id, "status": "queued", "files": len(targets)}), 202
 
+@app.route('/api/jobs')
+def api_jobs():
+    file_path = request.args.get('file_path')
+    limit = min(max(1, request.args.get('limit', 20, type=int)), 200)
+    return jsonify(jobs.list_jobs(file_path, limit))
+
+@app.route('/api/jobs/<int:job_id>')
+def api_job(job_id):
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+    live = jobs.get_live(job_id)
+    if live:
+        job['output'] = ''.join(live.lines)
+    return jsonify(job)
+
+def _sse(event, data, event_id=None):
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/jobs/<int:job_id>/stream')
+def api_job_stream(job_id):
+    """
+    Server-Sent Events: 'status' on every state change, one 'output' event per
+    line (its id is the line count, so reconnects resume via Last-Event-ID) and
+    a final 'done' with the stored job record.
+    """
+    if not jobs.get_job(job_id):
+        return jsonify({"error": "Unknown job"}), 404
+    sent = request.headers.get('Last-Event-ID', type=int) or 0
+
+    def generate():
+        nonlocal sent
+        job = jobs.get_live(job_id)
+        if job:
+            status = None
+            while True:
+                with job.changed:
+                    new_lines = job.lines[sent:]
+                    current = job.status
+                for line in new_lines:
+                    sent += 1
+                    yield _sse('output', line, sent)
+                if current != status:
+                    status = current
+                    yield _sse('status', status)
+                if status in ('done', 'failed'):
+                    break
+                job.wait_for_update(sent, status, timeout=15)
+                with job.changed:
+                    idle = len(job.lines) == sent and job.status == status
+                if idle:
+                    yield ": keepalive\n\n"
+
+        record = jobs.get_job(job_id)
+        if not job:
+            # Finished before we connected: replay the stored output
+            for line in (record['output'] or '').splitlines(keepends=True)[sent:]:
+                sent += 1
+                yield _sse('output', line, sent)
+        yield _sse('done', record)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/file_annotations')
 def api_file_annotations():
     req_path = request.args.get('path', '')
-    print(f"DEBUG: api_file_annotations called with path='{req_path}'")
-    
     conn = get_db()
     
     # Strategy 1: Exact Match (assuming req_path is relative to scan root)
@@ -496,46 +774,18 @@ def api_file_annotations():
     
     # Strategy 2: Filename Match (Optimized with Index)
     if not file_rec:
-        # Extract filename (basename) from req_path
-        # Use substring after last / (or full string if no /)
-        # Note: req_path might use \ on Windows client, but we normalized it in client??
-        # We should handle separators robustly here just in case.
-        import os
+        # The client may send \ separators (Windows)
         base_name = req_path.replace('\\', '/').split('/')[-1]
-        
-        # print(f"DEBUG: Exact match failed. Searching for filename='{base_name}'")
-        
-        # Query index
         cur = conn.execute("SELECT id, path FROM files WHERE filename = ?", (base_name,))
         candidates = cur.fetchall()
         
         # Filter in Python (fast since usually few files have same name)
         # We want path ending with req_path (normalized)
         search_suffix = req_path.replace('\\', '/')
-        
-        matches = []
-        for c in candidates:
-             # Normalize DB path for comparison
-             result_path = c['path'].replace('\\', '/')
-             if result_path.endswith(search_suffix):
-                 matches.append(c)
-        
-        if len(matches) == 1:
-            file_rec = matches[0]
-            # print(f"DEBUG: Found single suffix match via index: {file_rec['path']}")
-        elif len(matches) > 1:
-            # print(f"DEBUG: Found {len(matches)} matches via index. Picking first.")
-            file_rec = matches[0]
-        
-        if len(matches) == 1:
+        matches = [c for c in candidates if c['path'].replace('\\', '/').endswith(search_suffix)]
+        if matches:
+            # Ambiguous suffixes: the first one wins
             file_rec = matches[0]
-            print(f"DEBUG: Found single suffix match: {file_rec['path']}")
-        elif len(matches) > 1:
-            # Ambiguous. Try to pick the shortest one? Or one that matches mostly?
-            print(f"DEBUG: Found {len(matches)} matches. Picking first.")
-            file_rec = matches[0]
-        else:
-             print("DEBUG: No matches found.")
 
     global_md = ""
     lines_dict = {}
@@ -543,13 +793,9 @@ def api_file_annotations():
     
     if file_rec:
         db_path = file_rec['path']
-        cur = conn.execute("SELECT content FROM annotations WHERE file_id = ? AND line_number = 0 ORDER BY created_at DESC LIMIT 1", (file_rec['id'],))
-        row = cur.fetchone()
-        if row:
-            global_md, lines_dict = parse_file_annotations_raw(row['content'])
+        lines_dict = get_line_notes(file_rec['id'])
+        global_md = lines_dict.pop(0, "")
     else:
-        # 404 if not found? Or just return empty?
-        # User saw 404 in logs, so let's stick to 404 if truly not found to help debug
         return jsonify({"error": "File not found in DB"}), 404
 
     return jsonify({
@@ -561,7 +807,6 @@ def api_file_annotations():
 @app.route('/api/annotate', methods=['POST'])
 def add_annotation():
     data = request.json
-    print(f"DEBUG: add_annotation called with data={data}")
     
     path = data.get('file_path')
     line = int(data.get('line', 0))
@@ -590,51 +835,215 @@ def add_annotation():
              file_rec = matches[0]
     
     if not file_rec:
-        print("DEBUG: File not indexed for annotation.")
         return jsonify({"error": "File not indexed"}), 404
         
     file_id = file_rec['id']
     
-    # Fetch current master blob
-    cur = conn.execute("SELECT content FROM annotations WHERE file_id = ? AND line_number = 0 ORDER BY created_at DESC LIMIT 1", (file_id,))
-    row = cur.fetchone()
-    current_blob = row['content'] if row else ""
-    
-    # Parse existing
-    global_raw, lines_raw = parse_file_annotations_raw(current_blob)
-    
-    # Update logic
     if line == 0:
-        new_blob = content
+        # Full editor save: the content is a whole master blob
+        global_raw, lines_raw = parse_file_annotations_raw(content)
+        replace_file_notes(file_id, global_raw, lines_raw, kind)
     else:
-        if content.strip() == "":
-            if line in lines_raw: del lines_raw[line]
-        else:
-            lines_raw[line] = content
-        new_blob = reconstruct_markdown(global_raw, lines_raw)
-    
-    conn.execute(
-        "INSERT INTO annotations (file_id, line_number, content, type) VALUES (?, ?, ?, ?)",
-        (file_id, 0, new_blob, kind)
-    )
-    conn.commit()
-    conn.close()
+        set_line_note(file_id, line, content, kind)
     
     return jsonify({"status": "success"})
 
+@app.route('/api/search')
+def api_search():
+    query = request.args.get('q', '')
+    sub_path = request.args.get('path', '')
+    path_prefix = None
+    if sub_path:
+        path_prefix = os.path.join(os.path.relpath(SOURCE_ROOT, start=os.getcwd()), sub_path.strip('/'))
+    try:
+        result = code_search.search(
+            query,
+            use_regex=request.args.get('regex') == '1',
+            case_sensitive=request.args.get('case') == '1',
+            path_prefix=path_prefix,
+            page=max(1, request.args.get('page', 1, type=int)),
+            per_page=min(max(1, request.args.get('per_page', 50, type=int)), 200)
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+@app.route('/api/annotations/search')
+def api_annotations_search():
+    query = request.args.get('q', '')
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(max(1, request.args.get('per_page', 50, type=int)), 200)
+    try:
+        results = search_line_notes(query, limit=per_page + 1, offset=(page - 1) * per_page)
+    except sqlite3.OperationalError as e:
+        return jsonify({"error": f"Bad query: {e}"}), 400
+    return jsonify({
+        "query": query,
+        "page": page,
+        "has_more": len(results) > per_page,
+        "results": results[:per_page]
+    })
+
+@app.route('/api/symbols')
+def api_symbols():
+    name = request.args.get('name', '').strip()
+    if not name:
+        return jsonify({"error": "Missing name"}), 400
+    prefix = request.args.get('prefix') == '1'
+    return jsonify({"name": name, "definitions": c_symbols.find_definitions(name, prefix=prefix)})
+
+@app.route('/api/symbols/resolve', methods=['POST'])
+def api_symbols_resolve():
+    """Batch lookup used by the viewer to link identifiers to their definitions."""
+    names = request.json.get('names', [])[:5000]
+    return jsonify(c_symbols.resolve_names(set(names)))
+
+@app.route('/api/xref')
+def api_xref():
+    name = request.args.get('name', '').strip()
+    if not name:
+        return jsonify({"error": "Missing name"}), 400
+    started = time.perf_counter()
+    files, total_files, total_lines = c_symbols.find_references(name)
+    return jsonify({
+        "name": name,
+        "total_files": total_files,
+        "total_lines": total_lines,
+        "files": files,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    })
+
+@app.route('/api/binary_strings')
+def api_binary_strings():
+    query = request.args.get('q', '')
+    if not query:
+        return jsonify(binary_strings.stats())
+    limit = min(max(1, request.args.get('limit', 100, type=int)), 1000)
+    started = time.perf_counter()
+    results = binary_strings.search(query, limit)
+    return jsonify({
+        "query": query,
+        "results": results,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    })
+
+@app.route('/api/binary_strings/files')
+def api_binary_string_files():
+    """Binaries containing exactly the given string, with the offsets."""
+    text = request.args.get('text', '')
+    if not text:
+        return jsonify({"error": "Missing text"}), 400
+    started = time.perf_counter()
+    files, total = binary_strings.files_containing(text)
+    return jsonify({
+        "text": text,
+        "total_files": total,
+        "files": files,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    })
+
+@app.route('/api/binary_strings/index', methods=['POST'])
+def api_binary_strings_index():
+    """Starts a job extracting the strings of every binary not in the table yet."""
+    data = request.json or {}
+    min_length = max(2, int(data.get('min_length', binary_strings.MIN_LENGTH)))
+    pending = binary_strings.pending_binaries()
+    if not pending:
+        return jsonify({"error": "No unindexed binaries (has the tree been scanned?)"}), 404
+    job_id = jobs.submit(
+        'binary_strings', '', None,
+        limit=1,
+        task=lambda job: binary_strings.index_binaries(job, pending, min_length),
+        description=f"String table for {len(pending)} binaries"
+    )
+    return jsonify({"job_id": job_id, "status": "queued", "files": len(pending)}), 202
+
+@app.route('/api/translation_memory')
+def api_translation_memory():
+    """
+    Size and hit rates (exact and fuzzy) of the translation memory, or the
+    translation ?text= would get, with the near match it came from if any.
+    """
+    memory = fuzzy_memory.get_memory()
+    text = request.args.get('text')
+    if text:
+        exact = memory.exact_lookup(text)
+        if exact is not None:
+            return jsonify({"text": text, "translation": exact})
+        match = memory.fuzzy_lookup(text, near=True)
+        if match is None:
+            return jsonify({"text": text, "translation": None})
+        translation, similarity, source = match
+        used = similarity == 1.0   # Same skeleton; a nearer miss is only reported
+        return jsonify({
+            "text": text,
+            "translation": translation if used else None,
+            "fuzzy": {"source": source, "similarity": round(similarity, 3), "used": used}
+        })
+    return jsonify(memory.stats())
+
+@app.route('/api/db_stats')
+def api_db_stats():
+    return jsonify(get_query_stats())
+
+
+def warm_render_cache(sub_path=''):
+    """
+    Pre-renders every file below source-code/<sub_path> into the on-disk
+    render cache, spread across all cores.
+    """
+    from multiprocessing import Pool
+    root = os.path.join(SOURCE_ROOT, sub_path)
+    # Indexed encodings, used for the files that haven't changed since the scan
+    known = {
+        row['path']: (row['size'], row['mtime'], row['encoding'])
+        for row in get_db().execute("SELECT path, size, mtime, encoding FROM files WHERE encoding IS NOT NULL AND removed = 0")
+    }
+    entries = []
+    for full_path, _, st in walk_source_tree(root):
+        entry = known.get(os.path.relpath(full_path))
+        valid = entry is not None and (entry[0], entry[1]) == (st.st_size, st.st_mtime_ns)
+        entries.append((full_path, entry[2] if valid else None))
+    del known
+    print(f"Warming render cache for {len(entries)} files under {root}...")
+
+    rendered = 0
+    with Pool(os.cpu_count()) as pool:
+        for i, did_render in enumerate(pool.imap_unordered(render_cache.warm_entry, entries, chunksize=16)):
+            rendered += did_render
+            if i % 100 == 0:
+                sys.stdout.write(f"Processed {i}/{len(entries)}...\r")
+                sys.stdout.flush()
+    print(f"\nRendered {rendered} files ({len(entries) - rendered} already cached or skipped).")
+
 
 # CLI command to scan
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description='CodeAtlas Server')
-    parser.add_argument('command', nargs='?', help='Command to run (e.g., scan)')
+    parser.add_argument('command', nargs='?', help='Command to run (e.g., scan, warm, translate-tree)')
+    parser.add_argument('path', nargs='?', default='', help='Subtree of source-code for warm / translate-tree')
     parser.add_argument('--port', type=int, default=5000, help='Port to run the server on')
+    parser.add_argument('--watch', action='store_true', help='Keep the index up to date with inotify (Linux)')
     
     args = parser.parse_args()
     
     if args.command == 'scan':
         init_db()
-        scan_files()
+        changes = scan_files()
+        update_derived_indexes(changes)
+        close_db()
+    elif args.command == 'warm':
+        init_db()
+        warm_render_cache(args.path)
+        close_db()
+    elif args.command == 'translate-tree':
+        init_db()
+        translate_tree.run(SOURCE_ROOT, args.path)
+        close_db()
     else:
         print(f"Starting CodeAtlas on port {args.port}...")
+        # With debug=True the reloader runs the app in a child process; only that one watches
+        if args.watch and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            watcher.start_watching(SOURCE_ROOT, apply_live_changes)
         app.run(host='0.0.0.0', port=args.port, debug=True)
@@ -0,0 +1,171 @@
+import os
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from database import get_db, merge_line_notes
+import jobs
+import tool_plugins
+
+# "Run on subtree": fans one toolbelt tool out over every matching file below a
+# directory. Plugin tools run on the shared warm worker pool (tool_plugins),
+# external commands on threads of their own (each waits on its subprocess, so
+# nothing is forked from the server); either way at most `workers`
+# files are in flight. Results come back to the job's thread, which reports
+# progress, writes any annotations in batched transactions and finishes with a
+# summary report.
+
+COMMAND_TIMEOUT = 300
+NOTE_BATCH_SIZE = 100       # Files per annotation transaction
+MAX_LISTED_FAILURES = 50
+
+def run_command(cmd):
+    """Worker thread: one external tool invocation, as a plugin-style result dict."""
+    try:
+        res = subprocess.run(cmd, capture_output=True, text=True, errors='replace', timeout=COMMAND_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return {"error": f"Timed out after {COMMAND_TIMEOUT}s"}
+    except OSError as e:
+        return {"error": str(e)}
+    output = res.stdout + "\n" + res.stderr
+    if res.returncode != 0:
+        return {"error": _last_line(output) or f"exit code {res.returncode}"}
+    return {"output": output}
+
+def collect_targets(source_root, tree_dir, extensions):
+    """
+    (tree_path, abs_path) for every indexed, live file below tree_dir whose
+    name ends with one of extensions (all files if the list is empty).
+    """
+    rel_root = os.path.relpath(source_root, start=os.getcwd())
+    prefix = os.path.join(rel_root, tree_dir) if tree_dir else rel_root
+    cur = get_db().execute(
+        "SELECT path FROM files WHERE removed = 0 AND path >= ? AND path < ?",
+        (prefix + os.sep, prefix + chr(ord(os.sep) + 1))
+    )
+    extensions = tuple(ext.lower() for ext in extensions)
+    targets = []
+    for row in cur:
+        if extensions and not row['path'].lower().endswith(extensions):
+            continue
+        targets.append((row['path'][len(rel_root) + 1:], os.path.abspath(row['path'])))
+    targets.sort()
+    return targets
+
+def note_file_id(conn, tree_path):
+    # Notes hang off the tree-path rows the viewer uses (created lazily, like view_file does)
+    row = conn.execute("SELECT id FROM files WHERE path = ?", (tree_path,)).fetchone()
+    if row:
+        return row['id']
+    return conn.execute(
+        "INSERT INTO files (path, filename, file_type) VALUES (?, ?, ?)",
+        (tree_path, os.path.basename(tree_path), 'file')
+    ).lastrowid
+
+def _last_line(text):
+    text = text.strip()
+    return text.splitlines()[-1][:200] if text else ''
+
+def run_on_subtree(job, tool_def, tree_dir, targets, workers=None):
+    """
+    Job task: runs tool_def on every target. Annotations in a result are merged
+    into that file's notes (as tool_def's note_kind). Returns the job output,
+    ending with the summary.
+    """
+    workers = workers or os.cpu_count()
+    total = len(targets)
+    started = time.perf_counter()
+    job.append(f"Running {tool_def['name']} on {total} files under /{tree_dir} with {workers} workers\n")
+
+    conn = get_db()
+    note_kind = tool_def.get('note_kind', 'tool')
+    ok = 0
+    failures = []
+    annotated_files = 0
+    annotated_lines = 0
+    pending_notes = []
+
+    def flush_notes():
+        nonlocal annotated_files, annotated_lines
+        for tree_path, notes in pending_notes:
+            annotated_lines += merge_line_notes(note_file_id(conn, tree_path), notes, note_kind, commit=False)
+            annotated_files += 1
+        conn.commit()
+        pending_notes.clear()
+
+    command_pool = None
+    if 'plugin' in tool_def:
+        submit = lambda abs_path: tool_plugins.submit(tool_def, abs_path)
+    else:
+        command_pool = ThreadPoolExecutor(max_workers=workers)
+        submit = lambda abs_path: command_pool.submit(run_command, tool_def['command'] + [abs_path])
+
+    step = max(1, total // 100)
+    queue = iter(targets)
+    in_flight = {}
+    wait_timeout = tool_plugins.timeout_of(tool_def) if 'plugin' in tool_def else None
+    done = 0
+    try:
+        while True:
+            # Keep the pool fed without queueing the whole tree up front
+            for tree_path, abs_path in queue:
+                in_flight[submit(abs_path)] = tree_path
+                if len(in_flight) >= workers:
+                    break
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            if not finished:
+                # Every file in flight is stuck: their futures fail once the workers are gone
+                job.append(f"No result in {wait_timeout}s, restarting the plugin workers\n")
+                tool_plugins.recycle()
+                continue
+            for future in finished:
+                tree_path = in_flight.pop(future)
+                done += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"error": f"{type(e).__name__}: {e}"}
+
+                if result.get('error'):
+                    reason = _last_line(str(result['error']))
+                    failures.append((tree_path, reason))
+                    job.append(f"FAILED {tree_path}: {reason}\n")
+                else:
+                    ok += 1
+                    notes = tool_plugins.note_lines(result)
+                    if notes:
+                        pending_notes.append((tree_path, notes))
+                        if len(pending_notes) >= NOTE_BATCH_SIZE:
+                            flush_notes()
+                    elif 'annotations' not in result:
+                        # Tools without notes (file_info, ...) report their result inline
+                        job.append(f"{tree_path}: {_last_line(result.get('output', ''))}\n")
+
+                if done % step == 0 or done == total:
+                    job.append(f"[{done}/{total}] {ok} ok, {len(failures)} failed\n")
+                    jobs.save_progress(job)
+    finally:
+        if command_pool:
+            command_pool.shutdown(cancel_futures=True)
+    flush_notes()
+
+    elapsed = time.perf_counter() - started
+    summary = [
+        "",
+        "=== Summary ===",
+        f"Tool:      {tool_def['name']}",
+        f"Folder:    /{tree_dir}",
+        f"Files:     {total} ({ok} ok, {len(failures)} failed)",
+        f"Time:      {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} files/s, {workers} workers)",
+    ]
+    if annotated_files or 'note_kind' in tool_def:
+        summary.append(f"Notes:     {annotated_lines} lines annotated in {annotated_files} files")
+    if failures:
+        summary.append("Failures:")
+        summary.extend(f"  {path}: {reason}" for path, reason in failures[:MAX_LISTED_FAILURES])
+        if len(failures) > MAX_LISTED_FAILURES:
+            summary.append(f"  ... and {len(failures) - MAX_LISTED_FAILURES} more")
+    job.append("\n".join(summary) + "\n")
+    return ''.join(job.lines)
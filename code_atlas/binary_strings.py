@@ -0,0 +1,176 @@
+import os
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from database import get_db
+from c_symbols import encode_lines as encode_offsets, decode_lines as decode_offsets
+import jobs
+import tool_plugins
+
+# Corpus-wide Shift-JIS string table. A background job runs the extract_sjis
+# plugin over every file the scanner classified as binary (on the warm plugin
+# pool) and stores each distinct string once, with the files and offsets it
+# occurs at. "Which executables contain this message?" is then an index lookup.
+# Files that change or disappear are dropped from the table by the scan and
+# picked up again by the next indexing run (binary_string_scans tracks which
+# files are done).
+
+# Longer than the interactive tool's default: 4-byte runs are mostly noise in
+# machine code and would make up most of the table
+MIN_LENGTH = 6
+COMMIT_EVERY = 50           # Files per transaction
+MAX_FILE_LIST = 1000
+
+EXTRACT_TOOL = {"plugin": ("extract_sjis", "string_offsets")}
+
+def pending_binaries():
+    """Live binaries not in the string table yet."""
+    return get_db().execute("""
+        SELECT id, path FROM files
+        WHERE file_type = 'binary' AND removed = 0
+          AND id NOT IN (SELECT file_id FROM binary_string_scans)
+        ORDER BY path
+    """).fetchall()
+
+def _store(conn, file_id, offsets):
+    conn.executemany("INSERT OR IGNORE INTO binary_strings (text) VALUES (?)", ((text,) for text in offsets))
+    conn.executemany(
+        "INSERT OR REPLACE INTO binary_string_files (string_id, file_id, offsets) "
+        "SELECT id, ?, ? FROM binary_strings WHERE text = ?",
+        ((file_id, encode_offsets(positions), text) for text, positions in offsets.items())
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO binary_string_scans (file_id, string_count, scanned_at) VALUES (?, ?, ?)",
+        (file_id, len(offsets), time.time())
+    )
+
+def _drop_file(conn, file_id):
+    string_ids = [row[0] for row in conn.execute(
+        "SELECT string_id FROM binary_string_files WHERE file_id = ?", (file_id,)
+    )]
+    conn.execute("DELETE FROM binary_string_files WHERE file_id = ?", (file_id,))
+    conn.execute("DELETE FROM binary_string_scans WHERE file_id = ?", (file_id,))
+    # Strings no other binary contains go too
+    conn.executemany(
+        "DELETE FROM binary_strings WHERE id = ? AND NOT EXISTS "
+        "(SELECT 1 FROM binary_string_files WHERE string_id = ?)",
+        ((sid, sid) for sid in string_ids)
+    )
+
+def remove_files(paths):
+    """Forgets the strings of new/changed/removed files (no-op for files never indexed)."""
+    conn = get_db()
+    paths = list(paths)
+    indexed = set()
+    for i in range(0, len(paths), 500):
+        chunk = paths[i:i + 500]
+        cur = conn.execute(f"""
+            SELECT s.file_id FROM binary_string_scans s JOIN files f ON f.id = s.file_id
+            WHERE f.path IN ({','.join('?' * len(chunk))})
+        """, chunk)
+        indexed.update(row[0] for row in cur)
+    for file_id in indexed:
+        _drop_file(conn, file_id)
+    conn.commit()
+
+def index_binaries(job, pending, min_length=MIN_LENGTH, workers=None):
+    """Job task: extracts and stores the strings of every pending binary."""
+    workers = workers or os.cpu_count()
+    total = len(pending)
+    tool_def = dict(EXTRACT_TOOL, options={"min_length": min_length})
+    started = time.perf_counter()
+    job.append(f"Extracting strings from {total} binaries with {workers} workers\n")
+
+    conn = get_db()
+    queue = iter(pending)
+    in_flight = {}
+    wait_timeout = tool_plugins.timeout_of(tool_def)
+    done = found = 0
+    failures = []
+    step = max(1, total // 100)
+    while True:
+        for row in queue:
+            in_flight[tool_plugins.submit(tool_def, os.path.abspath(row['path']))] = row
+            if len(in_flight) >= workers:
+                break
+        if not in_flight:
+            break
+        finished, _ = wait(in_flight, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+        if not finished:
+            # Every file in flight is stuck: their futures fail once the workers are gone
+            job.append(f"No result in {wait_timeout}s, restarting the plugin workers\n")
+            tool_plugins.recycle()
+            continue
+        for future in finished:
+            row = in_flight.pop(future)
+            done += 1
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            if result.get('error'):
+                failures.append(row['path'])
+                job.append(f"FAILED {row['path']}: {result['error']}\n")
+            else:
+                offsets = result['data']['offsets']
+                _store(conn, row['id'], offsets)
+                found += len(offsets)
+            if done % COMMIT_EVERY == 0:
+                conn.commit()
+            if done % step == 0 or done == total:
+                job.append(f"[{done}/{total}] {found} strings\n")
+                jobs.save_progress(job)
+    conn.commit()
+
+    unique = conn.execute("SELECT count(*) FROM binary_strings").fetchone()[0]
+    elapsed = time.perf_counter() - started
+    summary = [
+        "",
+        "=== Summary ===",
+        f"Binaries:  {total} ({total - len(failures)} ok, {len(failures)} failed)",
+        f"Strings:   {found} found, {unique} distinct in the table",
+        f"Time:      {elapsed:.1f}s",
+    ]
+    job.append("\n".join(summary) + "\n")
+    return ''.join(job.lines)
+
+# --- Queries ---
+
+def search(query, limit=100):
+    """Distinct strings containing query, with the number of binaries each is in."""
+    conn = get_db()
+    if len(query) >= 3:
+        cur = conn.execute("""
+            SELECT s.id, s.text,
+                   (SELECT count(*) FROM binary_string_files WHERE string_id = s.id) AS files
+            FROM binary_strings_fts JOIN binary_strings s ON s.id = binary_strings_fts.rowid
+            WHERE binary_strings_fts MATCH ? LIMIT ?
+        """, ('"' + query.replace('"', '""') + '"', limit))
+    else:
+        # Too short for the trigram index
+        cur = conn.execute("""
+            SELECT s.id, s.text,
+                   (SELECT count(*) FROM binary_string_files WHERE string_id = s.id) AS files
+            FROM binary_strings s WHERE instr(s.text, ?) > 0 LIMIT ?
+        """, (query, limit))
+    return [dict(row) for row in cur]
+
+def files_containing(text, limit=MAX_FILE_LIST):
+    """([{path, offsets}], total_files) for the binaries containing exactly this string."""
+    cur = get_db().execute("""
+        SELECT f.path, bf.offsets FROM binary_strings s
+        JOIN binary_string_files bf ON bf.string_id = s.id
+        JOIN files f ON f.id = bf.file_id
+        WHERE s.text = ? AND f.removed = 0
+        ORDER BY f.path
+    """, (text,))
+    files = [{"path": row['path'], "offsets": decode_offsets(row['offsets'])} for row in cur]
+    return files[:limit], len(files)
+
+def stats():
+    conn = get_db()
+    return {
+        "indexed_binaries": conn.execute("SELECT count(*) FROM binary_string_scans").fetchone()[0],
+        "pending_binaries": len(pending_binaries()),
+        "strings": conn.execute("SELECT count(*) FROM binary_strings").fetchone()[0],
+    }
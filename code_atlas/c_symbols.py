@@ -0,0 +1,402 @@
+import os
+import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from database import get_db
+import encoding_detect
+
+# Definition and cross-reference indexes for C sources (the symbols and xref tables).
+# Extraction is a light-weight, brace-aware scan rather than a real parser:
+# comments, literals and preprocessor lines are blanked out first, then
+# top-level statements are classified as functions, aggregates, typedefs
+# or globals. It is tuned for old K&R-era code, so K&R parameter lists work.
+# The same pass collects every identifier occurrence for the xref postings.
+
+C_EXTENSIONS = ('.c', '.h')
+SYMBOL_BATCH_SIZE = 200
+# Fewer files than this are parsed in-process: a watcher flush of a few saved
+# files shouldn't wait for worker processes to start
+INPROCESS_MAX = 64
+
+_pool = None
+
+C_KEYWORDS = frozenset("""
+    auto break case char const continue default do double else enum extern float for goto if
+    inline int long register restrict return short signed sizeof static struct switch typedef
+    union unsigned void volatile while _Bool _Complex _Imaginary asm __asm __asm__ __inline
+    __inline__ __attribute__ __volatile__ __const __restrict __extension__
+""".split())
+
+# Comments and literals, blanked so braces/semicolons inside them don't count
+NOISE_RE = re.compile(r'''
+      /\*.*?(?:\*/|\Z)
+    | //[^\n]*
+    | "(?:[^"\\\n]|\\.)*"?
+    | '(?:[^'\\\n]|\\.)*'?
+''', re.S | re.X)
+PREPROC_RE = re.compile(r'^[ \t]*#(?:[^\n]*\\\n)*[^\n]*', re.M)
+DEFINE_RE = re.compile(r'^[ \t]*#[ \t]*define[ \t]+([A-Za-z_]\w*)', re.M)
+TOKEN_RE = re.compile(r'\b[A-Za-z_]\w*|[{}()\[\];,=*]|\n')
+# Identifiers for the xref, including those in macro bodies; the directive word
+# and #include targets are skipped
+REF_RE = re.compile(r'^[ \t]*#[ \t]*(?:include|import)\b[^\n]*|^[ \t]*#[ \t]*\w*|\b[A-Za-z_]\w*|\n', re.M)
+
+def _blank(m):
+    # Keep newlines so line numbers survive
+    return re.sub(r'[^\n]', ' ', m.group())
+
+def strip_noise(text):
+    return NOISE_RE.sub(_blank, text)
+
+def tokenize(text):
+    """Yields (token, line) over comment/literal-free text, skipping preprocessor lines."""
+    text = PREPROC_RE.sub(_blank, text)
+    line = 1
+    for m in TOKEN_RE.finditer(text):
+        tok = m.group()
+        if tok == '\n':
+            line += 1
+        else:
+            yield tok, line
+
+def _declarator_names(stmt):
+    """
+    Names declared by a top-level statement such as
+    'static int a = 1, *b[4], (*fp)(int)', as (name, line, kind) where kind is
+    'object', 'pointer' or 'function' (a prototype, or a function typedef).
+    """
+    names = []
+    parts, current, depth = [], [], 0
+    for tok, line in stmt:
+        if tok in '([':
+            depth += 1
+        elif tok in ')]':
+            depth -= 1
+        if depth == 0 and tok == ',':
+            parts.append(current)
+            current = []
+        else:
+            current.append((tok, line))
+    parts.append(current)
+
+    for part in parts:
+        # Drop initializers
+        for i, (tok, _) in enumerate(part):
+            if tok == '=':
+                part = part[:i]
+                break
+        toks = [t for t, _ in part]
+        # Function pointer: ( * name ) ( ... )
+        for i in range(len(toks) - 2):
+            if toks[i] == '(' and toks[i + 1] == '*' and _is_ident(toks[i + 2]):
+                names.append((toks[i + 2], part[i + 2][1], 'pointer'))
+                break
+        else:
+            if '(' in toks:
+                i = toks.index('(')
+                if i > 0 and _is_ident(toks[i - 1]):
+                    names.append((toks[i - 1], part[i - 1][1], 'function'))
+                continue
+            # Last identifier outside [...] is the declared name
+            depth = 0
+            candidate = None
+            for tok, line in part:
+                if tok == '[':
+                    depth += 1
+                elif tok == ']':
+                    depth -= 1
+                elif depth == 0 and _is_ident(tok):
+                    candidate = (tok, line, 'object')
+            if candidate:
+                names.append(candidate)
+    return names
+
+def _is_ident(tok):
+    return (tok[0].isalpha() or tok[0] == '_') and tok not in C_KEYWORDS
+
+def _function_name(stmt):
+    """Identifier right before the first top-level '(' of a statement."""
+    for i, (tok, _) in enumerate(stmt):
+        if tok == '(':
+            if i > 0 and _is_ident(stmt[i - 1][0]):
+                return stmt[i - 1]
+            return None
+    return None
+
+def _is_knr_header(stmt):
+    """'int f(a, b) int a;' - an identifier list followed by parameter declarations."""
+    toks = [t for t, _ in stmt]
+    if '(' not in toks or ')' not in toks:
+        return False
+    start, end = toks.index('('), toks.index(')')
+    params = toks[start + 1:end]
+    if not params or any(t != ',' and not _is_ident(t) for t in params):
+        return False
+    following = toks[end + 1:end + 2]
+    return bool(following) and following[0] not in ('__attribute__', 'asm', '__asm', '__asm__')
+
+def extract_symbols_from_text(text):
+    """Returns a list of (name, kind, line) definitions found in C source text."""
+    return _definitions(strip_noise(text))
+
+def _definitions(text):
+    symbols = []
+
+    # Matches come in order: count newlines from the previous one, not from the top
+    line, pos = 1, 0
+    for m in DEFINE_RE.finditer(text):
+        line += text.count('\n', pos, m.start())
+        pos = m.start()
+        symbols.append((m.group(1), 'macro', line))
+
+    stmt = []           # Tokens of the current top-level statement
+    depth = 0
+    body_kind = None    # What the current top-level { } belongs to
+    enum_expect = False
+
+    for tok, line in tokenize(text):
+        if depth > 0:
+            if tok == '{':
+                depth += 1
+            elif tok == '}':
+                depth -= 1
+                if depth == 0:
+                    if body_kind == 'function':
+                        stmt = []
+                    elif body_kind != 'initializer':
+                        stmt.append(('{}', line))
+            elif body_kind == 'enum' and depth == 1:
+                if enum_expect and _is_ident(tok):
+                    symbols.append((tok, 'enumerator', line))
+                    enum_expect = False
+                elif tok == ',':
+                    enum_expect = True
+            continue
+
+        if tok == '{':
+            depth = 1
+            toks = [t for t, _ in stmt]
+            aggregate = next((t for t in toks if t in ('struct', 'union', 'enum')), None)
+            if '=' in toks:
+                body_kind = 'initializer'
+            elif aggregate and '(' not in toks:
+                body_kind = aggregate
+                i = len(toks) - 1
+                if stmt and _is_ident(toks[-1]) and i > 0 and toks[i - 1] == aggregate:
+                    symbols.append((toks[-1], aggregate, stmt[-1][1]))
+                enum_expect = True
+            elif '(' in toks:
+                body_kind = 'function'
+                name = _function_name(stmt)
+                if name:
+                    symbols.append((name[0], 'function', name[1]))
+            else:
+                body_kind = 'initializer'
+        elif tok == ';':
+            if _is_knr_header(stmt) and stmt[0][0] != 'typedef':
+                stmt.append((tok, line))
+                continue
+            toks = [t for t, _ in stmt]
+            if toks and toks[0] == 'typedef':
+                body = _after_body(stmt[1:])
+                for name, nline, kind in _declarator_names(body):
+                    symbols.append((name, 'typedef', nline))
+            elif toks and 'extern' not in toks:
+                body = _after_body(stmt)
+                if body is not stmt or not _is_forward_decl(toks):
+                    for name, nline, kind in _declarator_names(body):
+                        if kind != 'function':
+                            symbols.append((name, 'global', nline))
+            stmt = []
+        else:
+            stmt.append((tok, line))
+
+    return symbols
+
+def _after_body(stmt):
+    """For 'struct x { ... } a, b' keep only the declarators after the body."""
+    for i, (tok, _) in enumerate(stmt):
+        if tok == '{}':
+            return stmt[i + 1:]
+    return stmt
+
+def _is_forward_decl(toks):
+    # 'struct foo;' declares nothing but the tag
+    return len(toks) == 2 and toks[0] in ('struct', 'union', 'enum')
+
+def extract_references_from_text(text):
+    """{identifier: sorted unique line numbers} for comment/literal-free C text."""
+    refs = {}
+    line = 1
+    for m in REF_RE.finditer(text):
+        tok = m.group()
+        if tok == '\n':
+            line += 1
+        elif tok[0] != '#' and not tok[0].isspace() and tok not in C_KEYWORDS:
+            lines = refs.get(tok)
+            if lines is None:
+                refs[tok] = [line]
+            elif lines[-1] != line:
+                lines.append(line)
+    return refs
+
+def encode_lines(lines):
+    """Delta + LEB128 varint encoding of ascending line numbers."""
+    out = bytearray()
+    prev = 0
+    for line in lines:
+        delta = line - prev
+        prev = line
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+def decode_lines(blob):
+    lines = []
+    prev = value = shift = 0
+    for byte in blob:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            prev += value
+            lines.append(prev)
+            value = shift = 0
+    return lines
+
+def analyze_file(item):
+    """
+    Worker entry point: (path, symbols, postings, encoding) for one (path,
+    indexed encoding or None), where postings maps identifier -> encoded lines
+    and encoding is the one the file was decoded with. (path, None, None, None) on error.
+    """
+    path, encoding = item
+    try:
+        # Decoded properly: a Shift-JIS trail byte read as UTF-8 can come out as a backslash
+        # that swallows the newline ending a comment or string
+        with open(path, 'rb') as f:
+            text, encoding = encoding_detect.decode_detected(f.read(), encoding)
+    except OSError:
+        return path, None, None, None
+    text = strip_noise(text)
+    refs = extract_references_from_text(text)
+    postings = {name: encode_lines(lines) for name, lines in refs.items()}
+    return path, _definitions(text), postings, encoding
+
+# --- Index maintenance ---
+
+def get_pool():
+    """The parser worker pool, started on first use and kept for later scans."""
+    global _pool
+    if _pool is None:
+        # spawn: workers must not inherit the server's threads or DB connections
+        _pool = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                    mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def index_files(pending):
+    """
+    (Re)extracts definitions and references for the pending (id, path) rows
+    that are C sources, spread across all cores (in-process for a few files).
+    """
+    c_files = [(row['id'], row['path'], row['encoding']) for row in pending
+               if row['path'].lower().endswith(C_EXTENSIONS)]
+    if not c_files:
+        return 0
+
+    print(f"Extracting symbols from {len(c_files)} C files...")
+    ids_by_path = {path: file_id for file_id, path, _ in c_files}
+    items = [(path, encoding) for _, path, encoding in c_files]
+    if len(c_files) < INPROCESS_MAX:
+        results = map(analyze_file, items)
+    else:
+        results = get_pool().map(analyze_file, items, chunksize=32)
+    conn = get_db()
+    done = 0
+    batch = []
+    for path, symbols, postings, encoding in results:
+        batch.append((ids_by_path[path], symbols, postings, encoding))
+        if len(batch) >= SYMBOL_BATCH_SIZE:
+            done += _store(conn, batch)
+            batch = []
+            print(f"Symbols: {done}/{len(c_files)} files...", end='\r')
+    done += _store(conn, batch)
+    print()
+    return done
+
+def _store(conn, batch):
+    file_ids = [(file_id,) for file_id, _, _, _ in batch]
+    conn.executemany("DELETE FROM symbols WHERE file_id = ?", file_ids)
+    conn.executemany("DELETE FROM xref WHERE file_id = ?", file_ids)
+    rows = []
+    xref_rows = []
+    for file_id, symbols, postings, _ in batch:
+        for name, kind, line in symbols or ():
+            rows.append((name, kind, file_id, line))
+        for name, blob in (postings or {}).items():
+            xref_rows.append((name, file_id, blob))
+    conn.executemany("INSERT INTO symbols (name, kind, file_id, line) VALUES (?, ?, ?, ?)", rows)
+    conn.executemany("INSERT INTO xref (name, file_id, lines) VALUES (?, ?, ?)", xref_rows)
+    # Detected here first: the content indexer (code_search) reuses it
+    conn.executemany("UPDATE files SET encoding = ? WHERE id = ? AND encoding IS NULL",
+                     [(encoding, file_id) for file_id, _, _, encoding in batch if encoding])
+    conn.commit()
+    return len(batch)
+
+def remove_files(paths):
+    conn = get_db()
+    for table in ('symbols', 'xref'):
+        conn.executemany(
+            f"DELETE FROM {table} WHERE file_id = (SELECT id FROM files WHERE path = ?)",
+            [(p,) for p in paths]
+        )
+    conn.commit()
+
+# --- Queries ---
+
+def find_definitions(name, prefix=False, limit=100):
+    conn = get_db()
+    sql = """
+        SELECT s.name, s.kind, s.line, f.path FROM symbols s JOIN files f ON f.id = s.file_id
+        WHERE {} AND f.removed = 0 ORDER BY s.name, f.path LIMIT ?
+    """
+    if prefix:
+        # Range scan on idx_symbols_name instead of LIKE
+        cur = conn.execute(sql.format("s.name >= ? AND s.name < ?"), (name, name + '\uffff', limit))
+    else:
+        cur = conn.execute(sql.format("s.name = ?"), (name, limit))
+    return [dict(row) for row in cur]
+
+def resolve_names(names, per_name=5):
+    """{name: [definitions]} for the names that have any, used to link identifiers."""
+    result = {}
+    conn = get_db()
+    names = list(names)
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        cur = conn.execute(f"""
+            SELECT s.name, s.kind, s.line, f.path FROM symbols s JOIN files f ON f.id = s.file_id
+            WHERE s.name IN ({','.join('?' * len(chunk))}) AND f.removed = 0
+        """, chunk)
+        for row in cur:
+            defs = result.setdefault(row['name'], [])
+            if len(defs) < per_name:
+                defs.append({"kind": row['kind'], "line": row['line'], "path": row['path']})
+    return result
+
+def find_references(name, limit_files=500):
+    """
+    Usages of an identifier grouped by file, most used files first:
+    ([{path, lines}], total_files, total_lines).
+    """
+    conn = get_db()
+    cur = conn.execute("""
+        SELECT f.path, x.lines FROM xref x JOIN files f ON f.id = x.file_id
+        WHERE x.name = ? AND f.removed = 0
+    """, (name,))
+    files = [{"path": row['path'], "lines": decode_lines(row['lines'])} for row in cur]
+    files.sort(key=lambda f: (-len(f['lines']), f['path']))
+    return files[:limit_files], len(files), sum(len(f['lines']) for f in files)
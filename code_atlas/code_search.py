@@ -0,0 +1,210 @@
+import os
+import re
+import bisect
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from database import get_db
+import encoding_detect
+
+# Trigram full-text index over file contents (the file_content FTS5 table).
+# Filled by the scanner: every row it adds or changes gets file_type reset to
+# NULL, and index_pending_files() picks those up, classifies them as
+# text/binary, records their encoding and (re)indexes the text ones.
+
+MAX_INDEXED_BYTES = 4 * 1024 * 1024     # Generated monsters are not worth indexing
+INDEX_BATCH_SIZE = 500
+MAX_HITS_PER_FILE = 20
+MAX_LINE_LENGTH = 300
+# Regexes without a 3+ character literal can't use the index: they are only run
+# over a folder, and only if it has no more indexed files than this
+MAX_SCAN_FILES = 2000
+
+def _read_for_index(item):
+    file_id, path, encoding = item
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(MAX_INDEXED_BYTES + 1)
+    except OSError:
+        return file_id, None, None, None
+    # Already known if an earlier pass (c_symbols) decoded the file
+    encoding = encoding or encoding_detect.detect_bytes(data, complete=len(data) <= MAX_INDEXED_BYTES)
+    if encoding == 'binary':
+        return file_id, 'binary', None, encoding
+    if len(data) > MAX_INDEXED_BYTES:
+        return file_id, 'text', None, encoding
+    # The sample's guess is checked against the whole file here (and corrected if it was wrong)
+    text, encoding = encoding_detect.decode_detected(data, encoding)
+    return file_id, 'text', text, encoding
+
+def pending_files(path_prefix):
+    """Live files below path_prefix that are new or changed since the last index run."""
+    return get_db().execute(
+        "SELECT id, path, encoding FROM files WHERE file_type IS NULL AND removed = 0 AND path >= ? AND path < ?",
+        (path_prefix + os.sep, path_prefix + chr(ord(os.sep) + 1))
+    ).fetchall()
+
+def index_pending_files(path_prefix, pending=None):
+    """
+    Classifies and indexes every live file below path_prefix whose file_type
+    is still NULL (new or changed since the last scan). Resumable: an
+    interrupted run just leaves the rest NULL for next time. Since this is what
+    clears the NULL marker, other per-file indexes must run before it.
+    """
+    conn = get_db()
+    if pending is None:
+        pending = pending_files(path_prefix)
+    if not pending:
+        return 0
+
+    print(f"Indexing contents of {len(pending)} files...")
+    done = 0
+    # Reading is I/O bound, so a few threads keep the single FTS writer busy
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for i in range(0, len(pending), INDEX_BATCH_SIZE):
+            batch = [(row['id'], row['path'], row['encoding']) for row in pending[i:i + INDEX_BATCH_SIZE]]
+            results = list(executor.map(_read_for_index, batch))
+
+            conn.executemany("DELETE FROM file_content WHERE rowid = ?", [(r[0],) for r in results])
+            conn.executemany(
+                "INSERT INTO file_content (rowid, content) VALUES (?, ?)",
+                [(file_id, text) for file_id, _, text, _ in results if text is not None]
+            )
+            conn.executemany(
+                "UPDATE files SET file_type = ?, encoding = ? WHERE id = ?",
+                [(kind, encoding, file_id) for file_id, kind, _, encoding in results if kind is not None]
+            )
+            conn.commit()
+            done += len(batch)
+            print(f"Indexed {done}/{len(pending)}...", end='\r')
+    print()
+    return done
+
+def remove_from_index(paths):
+    conn = get_db()
+    for i in range(0, len(paths), INDEX_BATCH_SIZE):
+        conn.executemany(
+            "DELETE FROM file_content WHERE rowid = (SELECT id FROM files WHERE path = ?)",
+            [(p,) for p in paths[i:i + INDEX_BATCH_SIZE]]
+        )
+        conn.commit()
+
+# --- Queries ---
+
+def _required_literals(pattern, flags):
+    """
+    Literal runs every match of the regex must contain, taken from the
+    top-level sequence. Used to pre-filter candidates with the trigram index.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return []
+    runs, current = [], []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(chr(av))
+        else:
+            runs.append(''.join(current))
+            current = []
+    runs.append(''.join(current))
+    return [r for r in runs if len(r) >= 3]
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+def _line_hits(content, regex):
+    """Returns (hits, match_count) with 1-based line numbers."""
+    line_starts = [0]
+    line_starts.extend(m.end() for m in re.finditer('\n', content))
+    hits = []
+    seen_lines = set()
+    count = 0
+    for m in regex.finditer(content):
+        count += 1
+        lnum = bisect.bisect_right(line_starts, m.start())
+        if lnum in seen_lines or len(hits) >= MAX_HITS_PER_FILE:
+            continue
+        seen_lines.add(lnum)
+        end = content.find('\n', line_starts[lnum - 1])
+        line = content[line_starts[lnum - 1]:end if end != -1 else len(content)]
+        hits.append({"line": lnum, "text": line[:MAX_LINE_LENGTH]})
+    return hits, count
+
+def _check_scan_budget(path_prefix):
+    """Raises ValueError unless path_prefix is a folder small enough to scan file by file."""
+    hint = "Regex has no literal run of 3+ characters to look up"
+    if not path_prefix:
+        raise ValueError(f"{hint}; add one, or search within a folder")
+    count = get_db().execute(
+        "SELECT count(*) FROM file_content c JOIN files f ON f.id = c.rowid WHERE f.path >= ? AND f.path < ?",
+        (path_prefix + os.sep, path_prefix + chr(ord(os.sep) + 1))
+    ).fetchone()[0]
+    if count > MAX_SCAN_FILES:
+        raise ValueError(f"{hint}; the folder has {count} files (at most {MAX_SCAN_FILES} are scanned)")
+
+def search(query, use_regex=False, case_sensitive=False, path_prefix=None, page=1, per_page=50):
+    """
+    Literal or regex search. Candidates come from the trigram index ranked by
+    bm25, then each one is verified with the real pattern to get line hits.
+    Raises ValueError for queries that cannot be served (including regexes
+    with no literal to look up outside a small enough folder).
+    """
+    flags = 0 if case_sensitive else re.IGNORECASE
+    if use_regex:
+        try:
+            regex = re.compile(query, flags | re.MULTILINE)
+        except re.error as e:
+            raise ValueError(f"Invalid regex: {e}")
+        literals = _required_literals(query, flags)
+        if not literals:
+            _check_scan_budget(path_prefix)
+    else:
+        if len(query) < 3:
+            raise ValueError("Literal queries need at least 3 characters")
+        regex = re.compile(re.escape(query), flags)
+        literals = [query]
+
+    sql = "SELECT f.id, f.path, c.content FROM file_content c JOIN files f ON f.id = c.rowid"
+    where, params = [], []
+    if literals:
+        where.append("file_content MATCH ?")
+        params.append(" AND ".join(_fts_phrase(lit) for lit in literals))
+    if path_prefix:
+        where.append("f.path >= ? AND f.path < ?")
+        params.extend([path_prefix + os.sep, path_prefix + chr(ord(os.sep) + 1)])
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if literals:
+        sql += " ORDER BY rank"
+
+    started = time.perf_counter()
+    skip = (page - 1) * per_page
+    results = []
+    has_more = False
+    for row in get_db().execute(sql, params):
+        hits, count = _line_hits(row['content'], regex)
+        if not count:
+            continue  # Trigram match but not a real one (case, regex structure)
+        if skip:
+            skip -= 1
+            continue
+        if len(results) == per_page:
+            has_more = True
+            break
+        results.append({"file_id": row['id'], "path": row['path'], "match_count": count, "hits": hits})
+
+    return {
+        "query": query,
+        "regex": use_regex,
+        "page": page,
+        "per_page": per_page,
+        "has_more": has_more,
+        "results": results,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
@@ -1,14 +1,123 @@
 
 import sqlite3
 import os
+import re
+import html
+import threading
+import time
 
 DB_PATH = "code_atlas.db"
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+# Applied to every new connection. WAL lets readers (browser tabs, the VS Code
+# extension) keep going while annotations are being written.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",     # Safe with WAL, avoids an fsync per commit
+    "PRAGMA cache_size=-65536",      # 64 MB page cache
+    "PRAGMA mmap_size=268435456",    # 256 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+)
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection
+BUSY_TIMEOUT = 10.0         # Seconds to wait on a locked database
+
+_local = threading.local()
+
+# Query statistics of connections that have already been closed
+_stats_lock = threading.Lock()
+_closed_stats = {}
+
+# IN (?,?,...) lists built per call: one stats entry whatever their length
+PLACEHOLDER_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)', re.I)
+
+class TrackedConnection(sqlite3.Connection):
+    """
+    Connection that records count and wall time per SQL statement.
+    Only covers conn.execute/executemany, which is all this codebase uses.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {}
+
+    def _record(self, sql, started):
+        sql = PLACEHOLDER_LIST_RE.sub('IN (?, ...)', sql)
+        entry = self.stats.get(sql)
+        if entry is None:
+            entry = self.stats[sql] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += time.perf_counter() - started
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(sql, started)
+
+def connect():
+    """Opens a new tuned connection. Most callers want get_db() instead."""
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, factory=TrackedConnection,
+                           cached_statements=STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_db():
+    """
+    Returns the connection for the current thread, opening it on first use.
+    The server closes it at the end of each request via close_db().
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
     return conn
 
+def close_db(exc=None):
+    """Closes the current thread's connection (if any) and keeps its query stats."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    with _stats_lock:
+        for sql, (count, elapsed) in conn.stats.items():
+            entry = _closed_stats.setdefault(sql, [0, 0.0])
+            entry[0] += count
+            entry[1] += elapsed
+    conn.close()
+
+def get_query_stats():
+    """
+    Aggregated statistics of closed connections plus the current thread's one,
+    slowest statements first.
+    """
+    with _stats_lock:
+        merged = {sql: list(v) for sql, v in _closed_stats.items()}
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        for sql, (count, elapsed) in conn.stats.items():
+            entry = merged.setdefault(sql, [0, 0.0])
+            entry[0] += count
+            entry[1] += elapsed
+
+    stats = []
+    for sql, (count, elapsed) in merged.items():
+        stats.append({
+            "sql": " ".join(sql.split()),
+            "count": count,
+            "total_ms": round(elapsed * 1000, 3),
+            "avg_ms": round(elapsed * 1000 / count, 3) if count else 0
+        })
+    stats.sort(key=lambda x: x['total_ms'], reverse=True)
+    return stats
+
 def init_db():
     with get_db() as conn:
         # Files table: Index of all files
@@ -18,9 +127,40 @@ def init_db():
                 path TEXT UNIQUE NOT NULL,
                 filename TEXT NOT NULL,
                 file_type TEXT,
-                encoding TEXT
+                encoding TEXT,
+                magic TEXT, -- what a binary is, filled in by analyze_files.py
+                size INTEGER,
+                mtime INTEGER, -- st_mtime_ns
+                inode INTEGER,
+                removed INTEGER NOT NULL DEFAULT 0,
+                dir_id INTEGER -- dirs.id, set by the scanner
+            )
+        """)
+
+        # Directory index behind /api/tree (see tree_index.py)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT UNIQUE NOT NULL,
+                name TEXT NOT NULL,
+                parent_id INTEGER,
+                version INTEGER NOT NULL DEFAULT 1,
+                dir_count INTEGER NOT NULL DEFAULT 0,
+                file_count INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL DEFAULT 0
             )
         """)
+
+        # Older databases predate the stat columns used by the incremental scan (and magic)
+        existing_cols = {row['name'] for row in conn.execute("PRAGMA table_info(files)")}
+        for col, decl in (("size", "INTEGER"),
+                          ("mtime", "INTEGER"),
+                          ("inode", "INTEGER"),
+                          ("removed", "INTEGER NOT NULL DEFAULT 0"),
+                          ("dir_id", "INTEGER"),
+                          ("magic", "TEXT")):
+            if col not in existing_cols:
+                conn.execute(f"ALTER TABLE files ADD COLUMN {col} {decl}")
         
         # Annotations table
         conn.execute("""
@@ -36,12 +176,228 @@ def init_db():
             )
         """)
         
+        # Current notes: one row per (file, line). Line 0 holds the global/folder note.
+        # The annotations table above is kept as an append-only history log.
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS line_notes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id INTEGER NOT NULL,
+                line_number INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                type TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(file_id, line_number),
+                FOREIGN KEY(file_id) REFERENCES files(id)
+            )
+        """)
+        
+        # Full-text index over the current notes only (not the history log).
+        # External content table, kept in sync by triggers on every write path.
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS line_notes_fts USING fts5(
+                content,
+                content = 'line_notes',
+                content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS line_notes_ai AFTER INSERT ON line_notes BEGIN
+                INSERT INTO line_notes_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS line_notes_ad AFTER DELETE ON line_notes BEGIN
+                INSERT INTO line_notes_fts (line_notes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS line_notes_au AFTER UPDATE OF content ON line_notes BEGIN
+                INSERT INTO line_notes_fts (line_notes_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO line_notes_fts (rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+
+        # Trigram full-text index of file contents, rowid = files.id (see code_search.py)
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS file_content USING fts5(
+                content,
+                tokenize = 'trigram'
+            )
+        """)
+        
+        # C definitions extracted by the scanner (see c_symbols.py)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS symbols (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                file_id INTEGER NOT NULL,
+                line INTEGER NOT NULL,
+                FOREIGN KEY(file_id) REFERENCES files(id)
+            )
+        """)
+        
+        # Identifier postings: one row per (name, file), lines are delta varints (see c_symbols.py)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS xref (
+                name TEXT NOT NULL,
+                file_id INTEGER NOT NULL,
+                lines BLOB NOT NULL,
+                PRIMARY KEY (name, file_id)
+            ) WITHOUT ROWID
+        """)
+        
+        # Corpus-wide Shift-JIS string table of the binaries (see binary_strings.py).
+        # Strings are stored once; offsets per (string, file) are delta varints.
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS binary_strings (
+                id INTEGER PRIMARY KEY,
+                text TEXT NOT NULL UNIQUE
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS binary_string_files (
+                string_id INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                offsets BLOB NOT NULL,
+                PRIMARY KEY (string_id, file_id)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS binary_string_scans (
+                file_id INTEGER PRIMARY KEY,
+                string_count INTEGER NOT NULL,
+                scanned_at REAL
+            )
+        """)
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS binary_strings_fts USING fts5(
+                text,
+                content = 'binary_strings',
+                content_rowid = 'id',
+                tokenize = 'trigram'
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS binary_strings_ai AFTER INSERT ON binary_strings BEGIN
+                INSERT INTO binary_strings_fts (rowid, text) VALUES (new.id, new.text);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS binary_strings_ad AFTER DELETE ON binary_strings BEGIN
+                INSERT INTO binary_strings_fts (binary_strings_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END
+        """)
+        
+        # Whole-tree translation state (see translate_tree.py): each distinct
+        # Japanese comment/string once, where it occurs, and per-file progress
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tree_translation_texts (
+                id INTEGER PRIMARY KEY,
+                text TEXT UNIQUE NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tree_translation_segments (
+                file_id INTEGER NOT NULL,
+                line_number INTEGER NOT NULL,
+                text_id INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tree_translation_files (
+                file_id INTEGER PRIMARY KEY,
+                mtime INTEGER, -- files.mtime when collected
+                segment_count INTEGER NOT NULL,
+                collected_at REAL,
+                annotated_at REAL -- NULL until every segment's note is written
+            )
+        """)
+        
+        # Background tool runs (see jobs.py)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tool TEXT NOT NULL,
+                file_path TEXT,
+                command TEXT,
+                status TEXT NOT NULL, -- queued, running, done, failed
+                exit_code INTEGER,
+                output TEXT,
+                error TEXT,
+                result TEXT, -- JSON result of plugin tools
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        
+        if 'result' not in {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN result TEXT")
+        
         # Performance Index
         conn.execute("CREATE INDEX IF NOT EXISTS idx_filename ON files(filename)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_dir ON files(dir_id)")
+        # Keeps the derived-index work queue cheap to find on big trees (live updates poll it)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_pending ON files(path) WHERE file_type IS NULL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_dirs_parent ON dirs(parent_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_symbols_name ON symbols(name)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_symbols_file ON symbols(file_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_xref_file ON xref(file_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_binary_string_files_file ON binary_string_files(file_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tree_translation_segments_file ON tree_translation_segments(file_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tree_translation_segments_text ON tree_translation_segments(text_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_path ON jobs(file_path, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations_file ON annotations(file_id, line_number)")
+
+        schema_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version < 1:
+            migrate_annotation_blobs(conn)
+            conn.execute("PRAGMA user_version = 1")
+        if schema_version < 2:
+            # Notes written before the FTS triggers existed
+            conn.execute("INSERT INTO line_notes_fts (line_notes_fts) VALUES ('rebuild')")
+            conn.execute("PRAGMA user_version = 2")
+        if schema_version < 4:
+            # C files indexed before the symbols (3) / xref (4) tables existed: queue them for the next scan
+            conn.execute("""
+                UPDATE files SET file_type = NULL
+                WHERE file_type = 'text' AND (path LIKE '%.c' OR path LIKE '%.h')
+            """)
+            conn.execute("PRAGMA user_version = 4")
+        if schema_version < 5:
+            # Text files indexed before their encoding was detected (binaries keep their strings)
+            conn.execute("UPDATE files SET file_type = NULL WHERE file_type = 'text' AND encoding IS NULL")
+            conn.execute("PRAGMA user_version = 5")
         
         conn.commit()
     print("Database initialized.")
 
+def migrate_annotation_blobs(conn):
+    """
+    One-time split of the latest '@lines' master blob of every file into line_notes rows.
+    """
+    cur = conn.execute("""
+        SELECT a.file_id, a.content, a.type FROM annotations a
+        WHERE a.id = (SELECT b.id FROM annotations b
+                      WHERE b.file_id = a.file_id AND b.line_number = 0
+                      ORDER BY b.created_at DESC, b.id DESC LIMIT 1)
+    """)
+    rows = []
+    for row in cur.fetchall():
+        global_md, lines_dict = parse_file_annotations_raw(row['content'])
+        if global_md:
+            rows.append((row['file_id'], 0, global_md, row['type']))
+        for lnum, content in lines_dict.items():
+            rows.append((row['file_id'], lnum, content, row['type']))
+    conn.executemany(
+        "INSERT OR IGNORE INTO line_notes (file_id, line_number, content, type) VALUES (?, ?, ?, ?)",
+        rows
+    )
+    if rows:
+        print(f"Migrated {len(rows)} notes to per-line storage.")
+
 def get_file_id(path):
     with get_db() as conn:
         cur = conn.execute("SELECT id FROM files WHERE path = ?", (path,))
@@ -60,3 +416,163 @@ def add_file(path, filename, file_type=None, encoding=None):
             return cur.lastrowid
         except sqlite3.IntegrityError:
             return get_file_id(path)
+
+# --- Annotation storage ---
+
+def parse_file_annotations_raw(md_blob):
+    """
+    Splits a master blob into global_raw, lines_raw_dict.
+    Format:
+    [Global Markdown]
+    @lines
+    # [number]
+    [Line Markdown]
+    """
+    if not md_blob:
+        return "", {}
+        
+    global_md = md_blob
+    lines_dict = {}
+    
+    if "@lines" in md_blob:
+        parts = md_blob.split("@lines", 1)
+        global_md = parts[0].strip()
+        lines_part = parts[1].strip()
+        
+        # Split by "# [number]" pattern at START of line
+        line_splits = re.split(r'^#\s*(\d+)\s*', lines_part, flags=re.MULTILINE)
+        
+        for i in range(1, len(line_splits), 2):
+            line_num = int(line_splits[i])
+            content = line_splits[i+1].strip()
+            if content:
+                lines_dict[line_num] = content
+                
+    return global_md, lines_dict
+
+def reconstruct_markdown(global_md, lines_dict):
+    """
+    Rebuilds the master blob from components (used to fill the full editor).
+    """
+    parts = [global_md.strip()]
+    if lines_dict:
+        parts.append("\n@lines")
+        for lnum in sorted(lines_dict.keys()):
+            content = lines_dict[lnum].strip()
+            if content:
+                parts.append(f"# {lnum}\n{content}")
+    return "\n".join(parts).strip()
+
+UPSERT_NOTE_SQL = """
+    INSERT INTO line_notes (file_id, line_number, content, type) VALUES (?, ?, ?, ?)
+    ON CONFLICT(file_id, line_number) DO UPDATE SET
+        content = excluded.content, type = excluded.type, updated_at = CURRENT_TIMESTAMP
+"""
+HISTORY_SQL = "INSERT INTO annotations (file_id, line_number, content, type) VALUES (?, ?, ?, ?)"
+
+def get_line_notes(file_id, start=None, end=None):
+    """
+    Returns {line_number: raw_markdown} for one file. Line 0 is the global note.
+    start/end (inclusive) restrict the read to a window of lines.
+    """
+    conn = get_db()
+    if start is None:
+        cur = conn.execute("SELECT line_number, content FROM line_notes WHERE file_id = ?", (file_id,))
+    else:
+        cur = conn.execute(
+            "SELECT line_number, content FROM line_notes WHERE file_id = ? AND line_number BETWEEN ? AND ?",
+            (file_id, start, end)
+        )
+    return {row['line_number']: row['content'] for row in cur}
+
+def set_line_note(file_id, line_number, content, kind='manual'):
+    """Upserts (or deletes, if content is blank) a single note."""
+    conn = get_db()
+    if content.strip():
+        conn.execute(UPSERT_NOTE_SQL, (file_id, line_number, content, kind))
+    else:
+        conn.execute("DELETE FROM line_notes WHERE file_id = ? AND line_number = ?", (file_id, line_number))
+    conn.execute(HISTORY_SQL, (file_id, line_number, content, kind))
+    conn.commit()
+
+def replace_file_notes(file_id, global_md, lines_dict, kind='manual'):
+    """
+    Makes the file's notes exactly global_md + lines_dict (full editor save).
+    Only lines that actually differ are written.
+    """
+    conn = get_db()
+    wanted = dict(lines_dict)
+    if global_md.strip():
+        wanted[0] = global_md
+    current = get_line_notes(file_id)
+
+    stale = [(file_id, lnum) for lnum in current if lnum not in wanted]
+    upserts = [(file_id, lnum, content, kind) for lnum, content in wanted.items()
+               if current.get(lnum) != content]
+
+    conn.executemany("DELETE FROM line_notes WHERE file_id = ? AND line_number = ?", stale)
+    conn.executemany(UPSERT_NOTE_SQL, upserts)
+    conn.executemany(HISTORY_SQL, [(f, lnum, "", kind) for f, lnum in stale] + upserts)
+    conn.commit()
+
+def merge_line_notes(file_id, notes, kind, commit=True):
+    """
+    Appends tool-generated notes ({line: text}) to the existing ones,
+    skipping text a line already contains. Returns the number of lines written
+    (notes a line already has are not counted).
+    Batch writers pass commit=False and commit once per batch.
+    """
+    if not notes:
+        return 0
+    conn = get_db()
+    lines = sorted(notes)
+    current = get_line_notes(file_id, lines[0], lines[-1])
+
+    upserts = []
+    for lnum in lines:
+        note = notes[lnum]
+        existing = current.get(lnum)
+        if existing is None:
+            upserts.append((file_id, lnum, note, kind))
+        elif note not in existing:
+            upserts.append((file_id, lnum, f"{existing}\n\n{note}", kind))
+
+    conn.executemany(UPSERT_NOTE_SQL, upserts)
+    conn.executemany(HISTORY_SQL, upserts)
+    if commit:
+        conn.commit()
+    return len(upserts)
+
+def search_line_notes(query, limit=50, offset=0):
+    """
+    Full-text search over the current notes. Every word must match (the last
+    one as a prefix). Returns path, line number and an HTML-safe snippet.
+    """
+    terms = query.split()
+    if not terms:
+        return []
+    match = " ".join('"' + t.replace('"', '""') + '"' for t in terms) + "*"
+
+    cur = get_db().execute("""
+        SELECT f.path, n.line_number, n.type, n.updated_at,
+               snippet(line_notes_fts, 0, char(2), char(3), '...', 16) AS snippet
+        FROM line_notes_fts
+        JOIN line_notes n ON n.id = line_notes_fts.rowid
+        JOIN files f ON f.id = n.file_id
+        WHERE line_notes_fts MATCH ?
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    """, (match, limit, offset))
+
+    results = []
+    for row in cur:
+        # Escape the note text, then turn the match markers into <mark>
+        snippet = html.escape(row['snippet']).replace('\x02', '<mark>').replace('\x03', '</mark>')
+        results.append({
+            "path": row['path'],
+            "line_number": row['line_number'],
+            "type": row['type'],
+            "updated_at": row['updated_at'],
+            "snippet": snippet
+        })
+    return results
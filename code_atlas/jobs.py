@@ -0,0 +1,240 @@
+import json
+import time
+import threading
+import subprocess
+from collections import deque
+
+from database import get_db, close_db
+
+# Background jobs for the toolbelt (the jobs table).
+# A fixed set of worker threads takes queued jobs in order, skipping jobs whose
+# tool is already at its concurrency limit (e.g. one translation at a time so
+# we don't trip the translation API's rate limits). Output is kept in memory
+# while a job runs so SSE clients can follow it, and written to the DB when the
+# job finishes, so results survive closing the page.
+
+MAX_WORKERS = 4
+DEFAULT_TOOL_LIMIT = 2
+DEFAULT_TIMEOUT = 3600
+SNAPSHOT_INTERVAL = 2.0     # Seconds between output snapshots to the DB while running
+
+class ToolError(Exception):
+    """Raised by a task to fail its job with just this message."""
+
+class Job:
+    def __init__(self, job_id, tool_key, file_path, cmd, limit, timeout, on_finish, task=None):
+        self.id = job_id
+        self.tool_key = tool_key
+        self.file_path = file_path
+        self.cmd = cmd
+        self.task = task
+        self.limit = limit
+        self.timeout = timeout
+        self.on_finish = on_finish
+        self.status = 'queued'
+        self.lines = []
+        self.exit_code = None
+        self.result = None      # Structured result of plugin tools, stored as JSON
+        self.changed = threading.Condition()
+
+    def append(self, line):
+        with self.changed:
+            self.lines.append(line)
+            self.changed.notify_all()
+
+    def set_status(self, status):
+        with self.changed:
+            self.status = status
+            self.changed.notify_all()
+
+    def wait_for_update(self, seen_lines, seen_status, timeout):
+        """Blocks until there is output past seen_lines or the status changed."""
+        with self.changed:
+            self.changed.wait_for(
+                lambda: len(self.lines) > seen_lines or self.status != seen_status,
+                timeout=timeout
+            )
+
+_queue = deque()
+_running = {}           # tool_key -> number of running jobs
+_live = {}              # job id -> Job, until its final state is in the DB
+_lock = threading.Condition()
+_workers = []
+
+def init_jobs():
+    """Jobs left queued/running by a previous server process will never finish."""
+    conn = get_db()
+    conn.execute(
+        "UPDATE jobs SET status = 'failed', error = 'Interrupted by server restart', finished_at = ? "
+        "WHERE status IN ('queued', 'running')",
+        (time.time(),)
+    )
+    conn.commit()
+
+def _ensure_workers():
+    _workers[:] = [worker for worker in _workers if worker.is_alive()]
+    while len(_workers) < MAX_WORKERS:
+        worker = threading.Thread(target=_worker_loop, name=f'job-worker-{len(_workers)}', daemon=True)
+        _workers.append(worker)
+        worker.start()
+
+def submit(tool_key, file_path, cmd, limit=None, timeout=None, on_finish=None, task=None, description=None):
+    """
+    Queues cmd and returns the job id. on_finish(job, output) runs on the worker
+    after the process exits and may return a replacement output text.
+    Instead of a command, task(job) can do the work in-process: it reports
+    progress with job.append(), may set job.result and returns the final output text.
+    """
+    conn = get_db()
+    job_id = conn.execute(
+        "INSERT INTO jobs (tool, file_path, command, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+        (tool_key, file_path, description or subprocess.list2cmdline(cmd), time.time())
+    ).lastrowid
+    conn.commit()
+
+    job = Job(job_id, tool_key, file_path, cmd, limit or DEFAULT_TOOL_LIMIT, timeout or DEFAULT_TIMEOUT,
+              on_finish, task)
+    with _lock:
+        _live[job_id] = job
+        _queue.append(job)
+        _ensure_workers()
+        _lock.notify_all()
+    return job_id
+
+def _next_job():
+    # First queued job whose tool still has a free slot
+    for job in _queue:
+        if _running.get(job.tool_key, 0) < job.limit:
+            _queue.remove(job)
+            _running[job.tool_key] = _running.get(job.tool_key, 0) + 1
+            return job
+    return None
+
+def _worker_loop():
+    while True:
+        with _lock:
+            job = _next_job()
+            while job is None:
+                _lock.wait()
+                job = _next_job()
+        try:
+            _run(job)
+        except Exception as e:
+            # A DB or bookkeeping error: fail the job, keep the worker
+            _fail(job, f"{type(e).__name__}: {e}")
+        finally:
+            # One connection per job, so its query stats reach /api/db_stats
+            close_db()
+            with _lock:
+                _running[job.tool_key] -= 1
+                _lock.notify_all()
+
+def _run(job):
+    conn = get_db()
+    conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job.id))
+    conn.commit()
+    job.set_status('running')
+    print(f"Job {job.id}: running {job.cmd or job.tool_key}")
+
+    if job.task:
+        error, output = _run_task(job)
+    else:
+        error, output = _run_command(job, conn)
+
+    if job.on_finish and error is None:
+        try:
+            output = job.on_finish(job, output) or output
+        except Exception as e:
+            error = f"Error processing results: {e}"
+
+    status = 'failed' if error else 'done'
+    conn.execute(
+        "UPDATE jobs SET status = ?, exit_code = ?, output = ?, error = ?, result = ?, finished_at = ? WHERE id = ?",
+        (status, job.exit_code, output, error,
+         json.dumps(job.result) if job.result is not None else None, time.time(), job.id)
+    )
+    conn.commit()
+    job.set_status(status)
+    with _lock:
+        _live.pop(job.id, None)
+    print(f"Job {job.id}: {status}")
+
+def _fail(job, error):
+    """Marks a job whose run raised as failed, in memory and (if it can) in the DB."""
+    print(f"Job {job.id}: failed: {error}")
+    job.set_status('failed')
+    try:
+        conn = get_db()
+        conn.rollback()  # Whatever the failed run left half-done
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', output = ?, error = ?, finished_at = ? WHERE id = ?",
+            (''.join(job.lines), error, time.time(), job.id)
+        )
+        conn.commit()
+    except Exception as e:
+        # Still live, so the job's page shows the failure; a restart fixes the row
+        print(f"Job {job.id}: could not record the failure: {e}")
+        return
+    with _lock:
+        _live.pop(job.id, None)
+
+def save_progress(job):
+    """Snapshots a running job's output so far to the DB (for long in-process tasks)."""
+    conn = get_db()
+    conn.execute("UPDATE jobs SET output = ? WHERE id = ?", (''.join(job.lines), job.id))
+    conn.commit()
+
+def _run_task(job):
+    try:
+        return None, job.task(job)
+    except ToolError as e:
+        return str(e), ''.join(job.lines)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}", ''.join(job.lines)
+
+def _run_command(job, conn):
+    error = None
+    try:
+        proc = subprocess.Popen(job.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, errors='replace', bufsize=1)
+        killer = threading.Timer(job.timeout, proc.kill)
+        killer.start()
+        last_snapshot = time.monotonic()
+        try:
+            for line in proc.stdout:
+                job.append(line)
+                if time.monotonic() - last_snapshot > SNAPSHOT_INTERVAL:
+                    conn.execute("UPDATE jobs SET output = ? WHERE id = ?", (''.join(job.lines), job.id))
+                    conn.commit()
+                    last_snapshot = time.monotonic()
+            job.exit_code = proc.wait()
+        finally:
+            killer.cancel()
+        if job.exit_code < 0:
+            error = f"Killed after {job.timeout}s" if job.exit_code == -9 else f"Exited with signal {-job.exit_code}"
+    except OSError as e:
+        error = str(e)
+    return error, ''.join(job.lines)
+
+# --- Queries ---
+
+def get_live(job_id):
+    with _lock:
+        return _live.get(job_id)
+
+def get_job(job_id):
+    row = get_db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+def list_jobs(file_path=None, limit=20):
+    conn = get_db()
+    cols = "id, tool, file_path, status, exit_code, error, created_at, started_at, finished_at"
+    if file_path:
+        cur = conn.execute(f"SELECT {cols} FROM jobs WHERE file_path = ? ORDER BY id DESC LIMIT ?", (file_path, limit))
+    else:
+        cur = conn.execute(f"SELECT {cols} FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+    return [dict(row) for row in cur]
@@ -0,0 +1,424 @@
+import io
+import os
+import json
+import zlib
+import bisect
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import pygments
+from pygments import highlight
+from pygments.lexer import RegexLexer, ExtendedRegexLexer
+from pygments.lexers import get_lexer_for_filename, TextLexer
+from pygments.lexers.c_cpp import CLexer
+from pygments.formatters import HtmlFormatter
+
+import encoding_detect
+
+# Highlighted source, split into per-line HTML, cached in two tiers:
+#   1. An in-memory LRU bounded by (approximate) bytes
+#   2. zlib-compressed JSON files on disk, which survive restarts
+# Entries remember the size/mtime they were rendered from, so an edited file just misses.
+
+CACHE_DIR = "render_cache"
+MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes of highlighted HTML kept in memory
+LINE_OVERHEAD = 64                 # Rough per-line cost of a Python str in the list
+STYLE_NAME = 'tango'
+CACHE_FORMAT = 3                   # Bump when the stored line format changes
+
+# Windowed rendering (see render_window)
+CHECKPOINT_INTERVAL = 1000         # Lines between saved lexer-state checkpoints
+WINDOW_MIN_BYTES = 512 * 1024      # Smaller files are simply rendered whole
+MAX_CHECKPOINTED_FILES = 512
+TEXT_BUDGET = 64 * 1024 * 1024     # Chars of decoded source kept for windowed files
+# _track_states mirrors RegexLexer internals: only trusted on the Pygments
+# releases it was checked against (bump after _self_check passes on a new one)
+PYGMENTS_TESTED = ((2, 19), (2, 20))   # [from, to)
+
+def get_lexer(path):
+    if path.lower().endswith(('.c', '.h')):
+        return CLexer(stripnl=False, stripall=False)
+    try:
+        return get_lexer_for_filename(path, stripnl=False, stripall=False)
+    except:
+        return TextLexer(stripnl=False, stripall=False)
+
+@lru_cache(maxsize=None)
+def get_style_css():
+    return HtmlFormatter(style=STYLE_NAME).get_style_defs('.highlight')
+
+def split_html_lines(html):
+    # Split on '\n' only: splitlines() would also break on form feeds and
+    # other separators that appear in old sources, shifting line numbers
+    lines = html.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    return lines
+
+def highlight_lines(content, lexer):
+    """Highlights the whole content, then splits it into lines.
+    This ensures multiline comments/tokens are handled correctly."""
+    formatter = HtmlFormatter(nowrap=True, style=STYLE_NAME)
+    return split_html_lines(highlight(content, lexer, formatter))
+
+def read_source(abs_path, encoding=None):
+    """Decoded text of a file; encoding is the indexed one, if known (detected otherwise)."""
+    with open(abs_path, 'rb') as f:
+        return encoding_detect.decode(f.read(), encoding)
+
+class LineCache:
+    """Thread-safe LRU of {key: (size, mtime, lines)} with a byte budget."""
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cost(lines):
+        return sum(len(line) for line in lines) + LINE_OVERHEAD * len(lines)
+
+    def get(self, key, size, mtime):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != size or entry[1] != mtime:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, size, mtime, lines):
+        cost = self.cost(lines)
+        if cost > self.budget:
+            return
+        with self.lock:
+            self._discard(key)
+            self.entries[key] = (size, mtime, lines, cost)
+            self.used += cost
+            while self.used > self.budget:
+                _, old = self.entries.popitem(last=False)
+                self.used -= old[3]
+
+    def _discard(self, key):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.used -= old[3]
+
+    def invalidate(self, abs_path):
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == abs_path]:
+                self._discard(key)
+
+memory_cache = LineCache(MEMORY_BUDGET)
+
+def _disk_path(abs_path, lexer_name):
+    digest = hashlib.sha1(f"{abs_path}\0{lexer_name}\0{STYLE_NAME}\0{CACHE_FORMAT}".encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(CACHE_DIR, digest[:2], digest + ".json.z")
+
+def _load_disk(abs_path, lexer_name, size, mtime):
+    try:
+        with open(_disk_path(abs_path, lexer_name), 'rb') as f:
+            entry = json.loads(zlib.decompress(f.read()))
+    except (OSError, ValueError, zlib.error):
+        return None
+    if entry.get('size') != size or entry.get('mtime') != mtime:
+        return None
+    return entry['lines']
+
+def _save_disk(abs_path, lexer_name, size, mtime, lines):
+    path = _disk_path(abs_path, lexer_name)
+    payload = zlib.compress(json.dumps({"size": size, "mtime": mtime, "lines": lines}).encode('utf-8'), 1)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so concurrent readers never see half a file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Render cache write failed for {abs_path}: {e}")
+
+def render_lines(abs_path, encoding=None):
+    """
+    Returns the highlighted lines for a file, lexing only on a cache miss.
+    """
+    abs_path = os.path.abspath(abs_path)
+    st = os.stat(abs_path)
+    lexer = get_lexer(abs_path)
+    lexer_name = type(lexer).__name__
+    key = (abs_path, lexer_name)
+
+    lines = memory_cache.get(key, st.st_size, st.st_mtime_ns)
+    if lines is not None:
+        return lines
+
+    lines = _load_disk(abs_path, lexer_name, st.st_size, st.st_mtime_ns)
+    if lines is None:
+        lines = highlight_lines(read_source(abs_path, encoding), lexer)
+        _save_disk(abs_path, lexer_name, st.st_size, st.st_mtime_ns, lines)
+
+    memory_cache.put(key, st.st_size, st.st_mtime_ns, lines)
+    return lines
+
+def invalidate(abs_path):
+    """Drops a file from both tiers (e.g. after a tool rewrote it in place)."""
+    abs_path = os.path.abspath(abs_path)
+    memory_cache.invalidate(abs_path)
+    try:
+        os.remove(_disk_path(abs_path, type(get_lexer(abs_path)).__name__))
+    except OSError:
+        pass
+
+def warm_file(abs_path, encoding=None):
+    """
+    Renders one file into the disk tier. Runs in worker processes, so it
+    bypasses the (per-process) memory tier. encoding is the indexed one, if
+    known. Returns True if it rendered.
+    """
+    try:
+        st = os.stat(abs_path)
+        with open(abs_path, 'rb') as f:
+            if b'\0' in f.read(8192):
+                return False  # Binary, the viewer won't highlight it usefully
+        lexer = get_lexer(abs_path)
+        lexer_name = type(lexer).__name__
+        if _load_disk(abs_path, lexer_name, st.st_size, st.st_mtime_ns) is not None:
+            return False
+        _save_disk(abs_path, lexer_name, st.st_size, st.st_mtime_ns,
+                   highlight_lines(read_source(abs_path, encoding), lexer))
+        return True
+    except Exception as e:
+        print(f"Failed to render {abs_path}: {e}")
+        return False
+
+def warm_entry(entry):
+    """warm_file() for an (abs_path, encoding) pair, for Pool.imap."""
+    return warm_file(*entry)
+
+
+# --- Windowed rendering with lexer-state checkpoints ---
+#
+# For huge files the viewer asks for a window of lines at a time. Rendering a
+# window correctly needs the lexer state at its first line (we may be inside a
+# multi-line comment or string), so we remember the state stack every
+# CHECKPOINT_INTERVAL lines and lex from the nearest checkpoint. Checkpoints are
+# only placed on line starts that are also token boundaries, so the HTML from
+# there on is identical to what a full render produces.
+
+class _Checkpoints:
+    def __init__(self, size, mtime, interval=CHECKPOINT_INTERVAL):
+        self.size = size
+        self.mtime = mtime
+        self.interval = interval            # Lines between checkpoints
+        self.points = [(0, 0, ('root',))]  # (line index, char offset, state stack)
+        self.scanned_to = 0                 # Char offset the state tracker reached
+        self.stack = ('root',)              # Tracker state at scanned_to
+        self.done = False
+        self.text = None                    # Decoded, preprocessed source (dropped over TEXT_BUDGET)
+        self.total = 0                      # Its line count
+        self.lock = threading.Lock()
+
+_checkpoints = OrderedDict()
+_checkpoints_lock = threading.Lock()
+
+def _pygments_tested():
+    version = tuple(int(part) for part in pygments.__version__.split('.')[:2])
+    return PYGMENTS_TESTED[0] <= version < PYGMENTS_TESTED[1]
+
+@lru_cache(maxsize=None)
+def _supports_checkpoints(lexer_cls):
+    if not issubclass(lexer_cls, RegexLexer) or issubclass(lexer_cls, ExtendedRegexLexer):
+        return False
+    if not _pygments_tested():
+        return False
+    try:
+        if 'stack' not in inspect.signature(lexer_cls.get_tokens_unprocessed).parameters:
+            return False
+    except (TypeError, ValueError):
+        return False
+    if not _self_check(lexer_cls):
+        print(f"Windowed rendering disabled for {lexer_cls.__name__}: it does not match a full render")
+        return False
+    return True
+
+SELF_CHECK_INTERVAL = 20
+
+def _self_check(lexer_cls):
+    """
+    Windowed output == full render for a sample whose checkpoints fall inside
+    a continued macro and a continued string, followed by a multi-line comment.
+    """
+    # A comment is one token, so its checkpoint slips past it; keep it last
+    spanning = [["#define MACRO(a) \\", "    ((a) + \\", "     1)"],
+                ['char *s = "a string \\', 'continued";'],
+                ["/* a comment", " * that spans", " * a checkpoint", " */"]]
+    interval = SELF_CHECK_INTERVAL
+    lines = []
+    # Checkpoint boundaries fall on the second line of each construct
+    for boundary, block in zip(range(interval, 4 * interval, interval), spanning):
+        lines += [f"int v{i} = {i}; /* line {i} */" for i in range(len(lines), boundary - 1)]
+        lines += block
+    lines += [f"int v{i} = {i};" for i in range(len(lines), len(lines) + interval)]
+    lexer = lexer_cls(stripnl=False, stripall=False)
+    text = lexer._preprocess_lexer_input("\n".join(lines) + "\n")
+    full = highlight_lines(text, lexer)
+    total = text.count('\n')
+    cps = _Checkpoints(0, 0, interval)
+    for first in range(total):
+        if _window(lexer, text, total, cps, first, 5) != full[first:first + 5]:
+            return False
+    return True
+
+def _get_checkpoints(key, size, mtime):
+    with _checkpoints_lock:
+        cps = _checkpoints.get(key)
+        if cps is None or cps.size != size or cps.mtime != mtime:
+            cps = _checkpoints[key] = _Checkpoints(size, mtime)
+        _checkpoints.move_to_end(key)
+        while len(_checkpoints) > MAX_CHECKPOINTED_FILES:
+            _checkpoints.popitem(last=False)
+        return cps
+
+def _trim_texts():
+    """Drops the decoded text of the least recently viewed files over TEXT_BUDGET."""
+    with _checkpoints_lock:
+        kept = 0
+        for cps in reversed(_checkpoints.values()):
+            text = cps.text
+            if text is None:
+                continue
+            kept += len(text)
+            if kept > TEXT_BUDGET:
+                cps.text = None     # Readers hold their own reference
+
+def _track_states(lexer, text, cps, target_line):
+    """
+    Advances the state tracker until a checkpoint at or after target_line exists.
+    Mirrors RegexLexer.get_tokens_unprocessed, but only follows state
+    transitions and never runs token callbacks, so it is much cheaper than lexing.
+    """
+    tokendefs = lexer._tokens
+    pos = cps.scanned_to
+    statestack = list(cps.stack)
+    statetokens = tokendefs[statestack[-1]]
+    last_line = cps.points[-1][0]
+    next_line = last_line + cps.interval
+    next_offset = _line_offset(text, cps.points[-1][1], cps.interval)
+    length = len(text)
+
+    while pos < length:
+        if next_offset is not None and pos >= next_offset and text[pos - 1] == '\n':
+            if pos > next_offset:
+                next_line += text.count('\n', next_offset, pos)
+            cps.points.append((next_line, pos, tuple(statestack)))
+            if next_line >= target_line:
+                cps.scanned_to = pos
+                cps.stack = tuple(statestack)
+                return
+            next_offset = _line_offset(text, pos, cps.interval)
+            next_line += cps.interval
+
+        for rexmatch, action, new_state in statetokens:
+            m = rexmatch(text, pos)
+            if m:
+                pos = m.end()
+                if new_state is not None:
+                    if isinstance(new_state, tuple):
+                        for state in new_state:
+                            if state == '#pop':
+                                if len(statestack) > 1:
+                                    statestack.pop()
+                            elif state == '#push':
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(state)
+                    elif isinstance(new_state, int):
+                        if abs(new_state) >= len(statestack):
+                            del statestack[1:]
+                        else:
+                            del statestack[new_state:]
+                    elif new_state == '#push':
+                        statestack.append(statestack[-1])
+                    statetokens = tokendefs[statestack[-1]]
+                break
+        else:
+            if text[pos] == '\n':
+                statestack = ['root']
+                statetokens = tokendefs['root']
+            pos += 1
+
+    cps.scanned_to = pos
+    cps.stack = tuple(statestack)
+    cps.done = True
+
+def _line_offset(text, offset, lines_ahead):
+    """Char offset of the line start lines_ahead lines after offset, or None past the end."""
+    for _ in range(lines_ahead):
+        offset = text.find('\n', offset)
+        if offset == -1:
+            return None
+        offset += 1
+    return offset if offset < len(text) else None
+
+def _render_from_checkpoint(lexer, text, checkpoint, first, count):
+    line, offset, stack = checkpoint
+    skip = first - line
+    needed = skip + count
+    tokens = []
+    newlines = 0
+    for _, ttype, value in lexer.get_tokens_unprocessed(text[offset:], stack):
+        tokens.append((ttype, value))
+        newlines += value.count('\n')
+        if newlines >= needed:
+            break
+    out = io.StringIO()
+    HtmlFormatter(nowrap=True, style=STYLE_NAME).format(iter(tokens), out)
+    return split_html_lines(out.getvalue())[skip:needed]
+
+def render_window(abs_path, first, count, encoding=None):
+    """
+    Returns (lines, total_lines) for lines [first, first + count) (0-based).
+    Served from the full render cache when present; otherwise large files
+    are lexed only from the nearest checkpoint to the end of the window.
+    """
+    abs_path = os.path.abspath(abs_path)
+    st = os.stat(abs_path)
+    lexer = get_lexer(abs_path)
+    lexer_name = type(lexer).__name__
+    key = (abs_path, lexer_name)
+
+    lines = memory_cache.get(key, st.st_size, st.st_mtime_ns)
+    if lines is None and (st.st_size < WINDOW_MIN_BYTES or not _supports_checkpoints(type(lexer))):
+        lines = render_lines(abs_path, encoding)
+    if lines is not None:
+        return lines[first:first + count], len(lines)
+
+    cps = _get_checkpoints(key, st.st_size, st.st_mtime_ns)
+    with cps.lock:
+        # Decoded once per file version, not on every scroll
+        text = cps.text
+        if text is None:
+            text = cps.text = lexer._preprocess_lexer_input(read_source(abs_path, encoding))
+            cps.total = text.count('\n')
+            _trim_texts()
+        total = cps.total
+    return _window(lexer, text, total, cps, first, count), total
+
+def _window(lexer, text, total, cps, first, count):
+    """Highlighted lines [first, first + count) of text, lexed from the nearest checkpoint."""
+    first = max(0, min(first, total))
+    count = min(count, total - first)
+    if count <= 0:
+        return []
+    with cps.lock:
+        if not cps.done and cps.points[-1][0] < first:
+            _track_states(lexer, text, cps, first)
+        idx = bisect.bisect_right(cps.points, first, key=lambda p: p[0]) - 1
+        checkpoint = cps.points[idx]
+    return _render_from_checkpoint(lexer, text, checkpoint, first, count)
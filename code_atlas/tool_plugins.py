@@ -0,0 +1,103 @@
+import os
+import sys
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# In-process tool plugins. A plugin is a plain function in tools/ that takes the
+# file path (plus fixed keyword options from the TOOLS entry) and returns a dict:
+#   {"output": text to show, "annotations": {line: note}, "data": anything JSON-able}
+# or {"error": message}. They run in a pool of long-lived worker processes that
+# import every plugin module up front, so a click no longer pays for a fresh
+# interpreter plus imports (deep_translator alone costs hundreds of ms).
+# External binaries (file, clang-format) still go through subprocess.
+# A plugin that hangs past its timeout can't be interrupted inside its worker,
+# so the whole pool is killed and a fresh one starts on the next call.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS_DIR = os.path.join(PROJECT_ROOT, 'tools')
+DEFAULT_TIMEOUT = 600
+
+_pool = None
+_preload = []
+_modules = {}       # Worker side: module name -> imported module
+
+def _warm_worker(module_names):
+    sys.path.insert(0, TOOLS_DIR)
+    for name in module_names:
+        try:
+            _modules[name] = importlib.import_module(name)
+        except Exception as e:
+            # Reported on use; other plugins keep working
+            print(f"Plugin worker: could not import {name}: {e}")
+
+def _call(module_name, func_name, path, options):
+    """Runs in a worker process."""
+    module = _modules.get(module_name)
+    if module is None:
+        if TOOLS_DIR not in sys.path:
+            sys.path.insert(0, TOOLS_DIR)
+        module = _modules[module_name] = importlib.import_module(module_name)
+    result = getattr(module, func_name)(path, **options)
+    if not isinstance(result, dict):
+        return {"error": f"{module_name}.{func_name} returned {type(result).__name__}, expected a dict"}
+    return result
+
+def preload(module_names):
+    """Modules every worker imports when it starts (set before the first call)."""
+    _preload[:] = sorted(set(module_names))
+
+def get_pool():
+    """The shared worker pool, started on first use."""
+    global _pool
+    if _pool is None:
+        # spawn: workers must not inherit the server's threads or DB connections
+        _pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_worker,
+            initargs=(tuple(_preload),)
+        )
+    return _pool
+
+def recycle(pool=None):
+    """
+    Kills the workers of pool (default: the current one), which are stuck in
+    a plugin that timed out. Calls still running on it fail with
+    BrokenProcessPool; the next call starts a new pool.
+    """
+    global _pool
+    pool = pool or _pool
+    if pool is None:
+        return
+    if _pool is pool:
+        _pool = None
+    print("Plugin workers timed out, restarting them")
+    if hasattr(pool, 'kill_workers'):
+        pool.kill_workers()     # Python 3.14+
+    else:
+        for process in list(pool._processes.values()):
+            process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def timeout_of(tool_def):
+    return tool_def.get('timeout', DEFAULT_TIMEOUT)
+
+def submit(tool_def, path):
+    """Queues one plugin call; returns a Future resolving to the result dict."""
+    module_name, func_name = tool_def['plugin']
+    return get_pool().submit(_call, module_name, func_name, path, tool_def.get('options', {}))
+
+def call(tool_def, path):
+    """Runs one plugin call and waits for its result dict."""
+    pool = get_pool()
+    future = submit(tool_def, path)
+    try:
+        return future.result(timeout=timeout_of(tool_def))
+    except TimeoutError:
+        recycle(pool)
+        return {"error": f"No result after {timeout_of(tool_def)}s, plugin workers restarted"}
+
+def note_lines(result):
+    """Plugin annotations with their (JSON string) keys back as line numbers."""
+    return {int(line): note for line, note in (result.get('annotations') or {}).items()}
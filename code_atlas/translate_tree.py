@@ -0,0 +1,243 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from database import get_db, merge_line_notes
+from batch_tools import note_file_id
+import c_tokenizer
+import encoding_detect
+import translation_memory
+import fuzzy_memory
+import translation_client
+
+# Whole-tree translation of Japanese comments and string literals, in three
+# phases that each pick up where an interrupted run stopped:
+#   1. collect:   tokenize every (new or changed) source file the scanner knows
+#                 about, in parallel, and record each segment against a table
+#                 of distinct texts;
+#   2. translate: send every distinct text that is not in the translation
+#                 memory to the API exactly once (the memory is the checkpoint);
+#   3. annotate:  write the translations back as line notes, in batched
+#                 transactions, marking each file done.
+# The same headers and error strings repeat across thousands of files, so
+# translating per distinct text instead of per file saves most of the calls.
+
+COLLECT_BATCH_SIZE = 200    # Files per transaction
+TRANSLATE_CHUNK = 1000      # Texts per translate_many call (and memory write)
+ANNOTATE_BATCH_SIZE = 100   # Files per transaction
+NOTE_KIND = 'auto_translate'
+
+def collect_file(item):
+    """Pool worker: (path, [(line, text)]) for one (path, indexed encoding); None if unreadable."""
+    path, encoding = item
+    try:
+        with open(path, 'rb') as f:
+            content = encoding_detect.decode(f.read(), encoding)
+    except OSError:
+        return path, None
+    return path, c_tokenizer.japanese_segments(content)
+
+# --- Phase 1 ---
+
+def _drop_stale(conn):
+    """Forgets files that were removed or changed since they were collected."""
+    stale = [row[0] for row in conn.execute("""
+        SELECT t.file_id FROM tree_translation_files t LEFT JOIN files f ON f.id = t.file_id
+        WHERE f.id IS NULL OR f.removed = 1 OR f.mtime IS NOT t.mtime
+    """)]
+    if not stale:
+        return 0
+    conn.executemany("DELETE FROM tree_translation_segments WHERE file_id = ?", ((i,) for i in stale))
+    conn.executemany("DELETE FROM tree_translation_files WHERE file_id = ?", ((i,) for i in stale))
+    conn.execute("""
+        DELETE FROM tree_translation_texts
+        WHERE id NOT IN (SELECT text_id FROM tree_translation_segments)
+    """)
+    conn.commit()
+    return len(stale)
+
+def pending_files(source_root, sub_path=''):
+    """(id, path, mtime, encoding) of the live source files below sub_path not collected yet."""
+    rel_root = os.path.relpath(source_root, start=os.getcwd())
+    prefix = os.path.join(rel_root, sub_path) if sub_path else rel_root
+    cur = get_db().execute("""
+        SELECT id, path, mtime, encoding FROM files
+        WHERE removed = 0 AND path >= ? AND path < ?
+          AND id NOT IN (SELECT file_id FROM tree_translation_files)
+        ORDER BY path
+    """, (prefix + os.sep, prefix + chr(ord(os.sep) + 1)))
+    return [row for row in cur if row['path'].lower().endswith(c_tokenizer.CODE_EXTENSIONS)]
+
+def _store_segments(conn, batch):
+    now = time.time()
+    for file_id, mtime, segments in batch:
+        conn.executemany("INSERT OR IGNORE INTO tree_translation_texts (text) VALUES (?)",
+                         ((text,) for _, text in segments))
+        conn.executemany("""
+            INSERT INTO tree_translation_segments (file_id, line_number, text_id)
+            SELECT ?, ?, id FROM tree_translation_texts WHERE text = ?
+        """, ((file_id, line, text) for line, text in segments))
+        # Nothing to annotate in files without Japanese: done already
+        conn.execute("""
+            INSERT OR REPLACE INTO tree_translation_files (file_id, mtime, segment_count, collected_at, annotated_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (file_id, mtime, len(segments), now, None if segments else now))
+    conn.commit()
+
+def collect(source_root, sub_path=''):
+    conn = get_db()
+    dropped = _drop_stale(conn)
+    if dropped:
+        print(f"Collect: {dropped} files changed or disappeared since the last run")
+    pending = pending_files(source_root, sub_path)
+    if not pending:
+        print("Collect: nothing new")
+        return
+    print(f"Collect: tokenizing {len(pending)} files with {os.cpu_count()} workers...")
+    rows = {row['path']: row for row in pending}
+    batch = []
+    done = found = 0
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for path, segments in executor.map(collect_file, [(path, row['encoding']) for path, row in rows.items()], chunksize=32):
+            done += 1
+            if segments is None:
+                print(f"Collect: could not read {path}")
+                continue
+            found += len(segments)
+            batch.append((rows[path]['id'], rows[path]['mtime'], segments))
+            if len(batch) >= COLLECT_BATCH_SIZE:
+                _store_segments(conn, batch)
+                batch = []
+                print(f"Collect: {done}/{len(pending)} files, {found} segments...", end='\r')
+    _store_segments(conn, batch)
+    print(f"\nCollect: {found} Japanese segments in {len(pending)} files")
+
+# --- Phase 2 ---
+
+def _per_file_estimate(conn):
+    """(texts, requests) the per-file translators would send: each file deduplicated on its own."""
+    texts = requests = 0
+    current, file_texts = None, []
+    cur = conn.execute("""
+        SELECT DISTINCT s.file_id, t.text FROM tree_translation_segments s
+        JOIN tree_translation_texts t ON t.id = s.text_id
+        ORDER BY s.file_id
+    """)
+    for file_id, text in cur:
+        if file_id != current:
+            texts += len(file_texts)
+            requests += len(translation_client.pack_batches(file_texts))
+            current, file_texts = file_id, []
+        file_texts.append(text)
+    texts += len(file_texts)
+    requests += len(translation_client.pack_batches(file_texts))
+    return texts, requests
+
+def translate():
+    """Translates every collected text missing from the memory. Returns the report lines."""
+    conn = get_db()
+    memory = fuzzy_memory.get_memory()
+    texts = [row[0] for row in conn.execute("SELECT text FROM tree_translation_texts ORDER BY id")]
+    known = 0
+    to_fetch = []
+    for i in range(0, len(texts), TRANSLATE_CHUNK):
+        chunk = texts[i:i + TRANSLATE_CHUNK]
+        # Variants reused here are stored, so phase 3 finds them exactly (and counts them once)
+        found = memory.lookup_many(chunk, store=True)
+        known += len(found)
+        to_fetch.extend(text for text in chunk if text not in found)
+    print(f"Translate: {len(texts)} distinct texts, {known} already in the translation memory (exact or fuzzy), {len(to_fetch)} to fetch")
+
+    client = translation_client.get_client()
+    requests_before = client.stats['requests']
+    try:
+        results, reused = fuzzy_memory.translate_missing(
+            memory, to_fetch, client.translate_many, chunk=TRANSLATE_CHUNK,
+            progress=lambda done, total: print(f"Translate: {done}/{total} texts...", end='\r')
+        )
+    except translation_client.TranslationUnavailable as e:
+        # What came back is in the memory already: annotate that, fetch the rest next run
+        print(f"\nTranslate: stopped, {e}; re-run to fetch the rest")
+        results, reused = memory.exact_lookup_many(to_fetch), 0
+        results.update((text, None) for text in to_fetch if text not in results)
+    failed = sum(1 for result in results.values() if result is None)
+    fetched = len(results) - reused - failed
+    memory.flush()
+    requests = client.stats['requests'] - requests_before
+
+    occurrences = conn.execute("SELECT count(*) FROM tree_translation_segments").fetchone()[0]
+    per_file_texts, per_file_requests = _per_file_estimate(conn)
+    return [
+        f"Segments:    {occurrences} in the tree, {len(texts)} distinct",
+        f"Per file:    {per_file_texts} texts in ~{per_file_requests} requests (each file deduplicated on its own)",
+        f"This run:    {fetched} texts fetched in {requests} requests ({known} from memory, {reused} variants of them reused, {failed} failed)",
+        f"Saved:       {per_file_texts - fetched - failed} texts, ~{max(0, per_file_requests - requests)} API requests",
+    ]
+
+# --- Phase 3 ---
+
+def annotate(source_root):
+    """Writes translation notes for every collected file not annotated yet."""
+    conn = get_db()
+    memory = fuzzy_memory.get_memory()
+    rel_root = os.path.relpath(source_root, start=os.getcwd())
+    pending = conn.execute("""
+        SELECT t.file_id, f.path FROM tree_translation_files t JOIN files f ON f.id = t.file_id
+        WHERE t.annotated_at IS NULL ORDER BY f.path
+    """).fetchall()
+    if not pending:
+        print("Annotate: nothing to do")
+        return 0, 0
+    print(f"Annotate: {len(pending)} files...")
+    annotated = incomplete = lines = 0
+    for i in range(0, len(pending), ANNOTATE_BATCH_SIZE):
+        batch = pending[i:i + ANNOTATE_BATCH_SIZE]
+        segments = {}
+        for row in batch:
+            segments[row['file_id']] = conn.execute("""
+                SELECT s.line_number, t.text FROM tree_translation_segments s
+                JOIN tree_translation_texts t ON t.id = s.text_id
+                WHERE s.file_id = ? ORDER BY s.line_number
+            """, (row['file_id'],)).fetchall()
+        # Phase 2 stored every usable translation, reused variants included
+        translations = memory.exact_lookup_many({text for rows in segments.values() for _, text in rows})
+
+        now = time.time()
+        for row in batch:
+            notes = {}
+            missing = False
+            for line, text in segments[row['file_id']]:
+                trans = translations.get(text)
+                if trans is None:
+                    missing = True
+                    continue
+                if trans == text or translation_memory.is_failure(trans):
+                    continue
+                note = f"Translated: {trans}"
+                notes[line] = f"{notes[line]}\n{note}" if line in notes else note
+            if notes:
+                tree_path = row['path'][len(rel_root) + 1:]
+                lines += merge_line_notes(note_file_id(conn, tree_path), notes, NOTE_KIND, commit=False)
+            if missing:
+                # Untranslated texts: retried (and the notes merged again, without duplicates) next run
+                incomplete += 1
+            else:
+                conn.execute("UPDATE tree_translation_files SET annotated_at = ? WHERE file_id = ?", (now, row['file_id']))
+                annotated += 1
+        conn.commit()
+        print(f"Annotate: {min(i + ANNOTATE_BATCH_SIZE, len(pending))}/{len(pending)} files...", end='\r')
+    memory.flush()
+    print(f"\nAnnotate: {lines} lines annotated in {annotated} files"
+          + (f", {incomplete} files waiting for failed translations" if incomplete else ""))
+    return annotated, incomplete
+
+def run(source_root, sub_path=''):
+    """The translate-tree command: all three phases, then the report."""
+    started = time.perf_counter()
+    collect(source_root, sub_path)
+    report = translate()
+    annotated, incomplete = annotate(source_root)
+    print("\n=== Summary ===")
+    print("\n".join(report))
+    print(f"Annotated:   {annotated} files" + (f" ({incomplete} incomplete, re-run to retry)" if incomplete else ""))
+    print(f"Time:        {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,99 @@
+import os
+
+from database import get_db
+
+# Directory listings served from the index instead of os.scandir.
+# The scanner keeps one dirs row per directory (same path form as files.path,
+# e.g. 'source-code/a/b') and links every file to its directory via files.dir_id.
+# Each dirs row carries its direct child counts, the total size of its files and
+# a version that is bumped whenever its listing could have changed; the version
+# is what the /api/tree ETag is made of.
+
+def _sort_key(entry):
+    return (0 if entry['type'] == 'dir' else 1, entry['name'].lower())
+
+def db_dir_path(rel_root, tree_path):
+    """'a/b' (relative to SOURCE_ROOT) -> 'source-code/a/b' as stored in the index."""
+    tree_path = tree_path.strip('/')
+    return os.path.join(rel_root, tree_path) if tree_path else rel_root
+
+def get_dir(rel_root, tree_path):
+    return get_db().execute(
+        "SELECT id, path, version FROM dirs WHERE path = ?", (db_dir_path(rel_root, tree_path),)
+    ).fetchone()
+
+def etag_for(dir_row):
+    return f"{dir_row['id']}-{dir_row['version']}"
+
+def list_dir(dir_row, tree_path):
+    """Entries of an indexed directory, dirs first, in the /api/tree format."""
+    conn = get_db()
+    tree_path = tree_path.strip('/')
+    entries = []
+    for row in conn.execute(
+        "SELECT name, dir_count, file_count, size FROM dirs WHERE parent_id = ?", (dir_row['id'],)
+    ):
+        entries.append({
+            "name": row['name'],
+            "path": os.path.join(tree_path, row['name']),
+            "type": "dir",
+            "children": row['dir_count'] + row['file_count'],
+            "size": row['size']
+        })
+    for row in conn.execute(
+        "SELECT filename, size FROM files WHERE dir_id = ? AND removed = 0", (dir_row['id'],)
+    ):
+        entries.append({
+            "name": row['filename'],
+            "path": os.path.join(tree_path, row['filename']),
+            "type": "file",
+            "size": row['size']
+        })
+    entries.sort(key=_sort_key)
+    return entries
+
+def scandir_listing(abs_path, tree_path):
+    """Fallback for directories the scanner has not seen yet."""
+    entries = []
+    try:
+        with os.scandir(abs_path) as it:
+            for entry in it:
+                entries.append({
+                    "name": entry.name,
+                    "path": os.path.join(tree_path, entry.name),
+                    "type": "dir" if entry.is_dir() else "file"
+                })
+    except OSError:
+        pass
+    entries.sort(key=_sort_key)
+    return entries
+
+def refresh_dirs(conn, dir_ids):
+    """
+    Recomputes the aggregates of the given directories and bumps their version,
+    plus the version of their parents (whose listings show those aggregates).
+    Does not commit.
+    """
+    dir_ids = {d for d in dir_ids if d is not None}
+    if not dir_ids:
+        return
+    params = [(d,) for d in dir_ids]
+    conn.executemany("""
+        UPDATE dirs SET
+            version = version + 1,
+            file_count = (SELECT count(*) FROM files WHERE dir_id = dirs.id AND removed = 0),
+            size = (SELECT coalesce(sum(size), 0) FROM files WHERE dir_id = dirs.id AND removed = 0),
+            dir_count = (SELECT count(*) FROM dirs AS d WHERE d.parent_id = dirs.id)
+        WHERE id = ?
+    """, params)
+    parents = set()
+    for i in range(0, len(params), 500):
+        chunk = [d for (d,) in params[i:i + 500]]
+        cur = conn.execute(
+            f"SELECT DISTINCT parent_id FROM dirs WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        )
+        parents.update(row[0] for row in cur if row[0] is not None)
+    conn.executemany(
+        "UPDATE dirs SET version = version + 1 WHERE id = ?",
+        [(p,) for p in parents - dir_ids]
+    )
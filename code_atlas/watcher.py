@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+# Optional live index updates driven by Linux inotify (via ctypes, no extra
+# dependency). Events are coalesced into a set of touched paths; once the tree
+# has been quiet for DEBOUNCE_SECONDS (or MAX_DELAY_SECONDS have passed) the
+# batch is handed to on_change(paths), which re-syncs just those paths.
+# A kernel queue overflow hands over the watched root instead, i.e. a full scan.
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# IN_MODIFY is left out on purpose: CLOSE_WRITE marks the end of a rewrite
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+DEBOUNCE_SECONDS = 0.5
+MAX_DELAY_SECONDS = 5.0
+
+_libc = None
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return _libc
+
+def is_supported():
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_load_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+class TreeWatcher:
+    """Recursive inotify watch on one directory tree, run on a daemon thread."""
+
+    def __init__(self, root, on_change):
+        self.root = os.path.abspath(root)
+        self.on_change = on_change
+        self.fd = -1
+        self.watches = {}       # wd -> directory path
+        self.pending = set()
+        self.first_event = None
+        self.last_event = None
+        self.watch_limit_hit = False
+
+    def start(self):
+        libc = _load_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        count = self._add_tree(self.root)
+        print(f"Watcher: watching {count} directories under {self.root}")
+        thread = threading.Thread(target=self._run, name='code-atlas-watcher', daemon=True)
+        thread.start()
+        return thread
+
+    def _add_watch(self, path):
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC and not self.watch_limit_hit:
+                self.watch_limit_hit = True
+                print("Watcher: inotify watch limit reached (fs.inotify.max_user_watches); "
+                      "changes in some directories will need a manual scan.")
+            return False
+        self.watches[wd] = path
+        return True
+
+    def _add_tree(self, top):
+        count = 0
+        pending = [top]
+        while pending:
+            current = pending.pop()
+            if not self._add_watch(current):
+                continue
+            count += 1
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+            except OSError:
+                continue
+        return count
+
+    def _drop_tree(self, top):
+        # A moved-away directory keeps its watches under the old paths
+        for wd, path in list(self.watches.items()):
+            if path == top or path.startswith(top + os.sep):
+                _libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost: fall back to a full rescan of the tree
+                self.pending.add(self.root)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if not name:
+                # Events on the watched directory itself; the parent's watch reports
+                # the same change by name, so only the bookkeeping is needed here
+                if mask & IN_MOVE_SELF:
+                    self._drop_tree(directory)
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            self.pending.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # New subtree: watch it too (its contents are synced with the path itself)
+                self._add_tree(path)
+
+        if self.pending:
+            now = time.monotonic()
+            self.last_event = now
+            if self.first_event is None:
+                self.first_event = now
+
+    def _flush_due(self):
+        return min(self.last_event + DEBOUNCE_SECONDS, self.first_event + MAX_DELAY_SECONDS)
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self.pending:
+                timeout = max(0.0, self._flush_due() - time.monotonic())
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if ready:
+                self._read_events()
+            if self.pending and time.monotonic() >= self._flush_due():
+                batch = self.pending
+                self.pending = set()
+                self.first_event = self.last_event = None
+                try:
+                    self.on_change(batch)
+                except Exception as e:
+                    # Keep watching; the next scan repairs whatever was missed
+                    print(f"Watcher: failed to apply {len(batch)} changes: {e}")
+
+def start_watching(root, on_change):
+    """Starts a TreeWatcher if inotify is available; returns it or None."""
+    if not is_supported():
+        print("Watcher: inotify is not available on this platform, live updates disabled.")
+        return None
+    watcher = TreeWatcher(root, on_change)
+    watcher.start()
+    return watcher
@@ -11,12 +11,15 @@ import glob
 from typing import List
 from multiprocessing import Pool
 import itertools
-from chardet.universaldetector import UniversalDetector
-
-detector = UniversalDetector()
 
 repo_root_dir: pathlib.Path = pathlib.Path(__file__).parent.absolute()
 
+sys.path.insert(0, str(repo_root_dir / "tools"))
+import encoding_detect
+
+# Encodings the CodeAtlas scan already detected ({} without an index)
+known_encodings = encoding_detect.indexed_encodings()
+
 dirs_to_format: List[str] = ["./source-code"]
 extensions_to_format: List[str] = [".c", ".h", ".cpp", ".s", ".S", ".jp", ".txt"]
 
@@ -61,30 +64,25 @@ def get_format_dirs() -> List[str]:
     return format_dirs
 
 def get_encoding_type(file_path) -> str:
-    detector.reset()
-    with open(file_path, "rb") as file:
-        for line in file:
-            detector.feed(line)
-    detector.close()
-    return detector.result['encoding']
+    return encoding_detect.lookup_or_detect(known_encodings, file_path)
 
 def convertFileWithDetection(file_path, read_encoding):
-    lines = []
+    if read_encoding in ("utf-8", "binary"):
+        return
     with open(file_path, 'rb') as source_file:
         file_content = source_file.read()
+    if read_encoding in (None, "ascii"):
+        # Only a sample was looked at: make sure the rest is ASCII too
+        read_encoding = encoding_detect.detect_bytes(file_content, limit=None)
+        if read_encoding in (None, "ascii", "utf-8", "binary"):
+            return  # Nothing to convert (or nothing we can)
     try:
-        decoded=file_content.decode("Shift-JIS")
-        with open(file_path, "w") as target_file:
-            target_file.write(decoded)
-        return
-    except UnicodeDecodeError:
-        pass
-    try:
-        decoded=file_content.decode("euc_jp")
-        with open(file_path, "w") as target_file:
-            target_file.write(decoded)
+        decoded=file_content.decode(read_encoding)
     except UnicodeDecodeError:
-        pass
+        print(f"{file_path}: not valid {encoding_detect.label(read_encoding)}, skipped")
+        return
+    with open(file_path, "w") as target_file:
+        target_file.write(decoded)
 
 
 
@@ -101,13 +99,11 @@ def reencode_directory(directory: str, extensions_to_format: List[str]) -> int:
     num_formatted: int = 0
     for ext in extensions_to_format:
             for file in pathlib.Path(directory).glob("*" + ext):
-                #encoding = get_encoding_type(file)
-                encoding = "ShiftJIS"
+                encoding = get_encoding_type(file)
                 convertFileWithDetection(file, encoding)
                 num_formatted += 1
             for file in pathlib.Path(directory).glob("Makefile"):
-                #encoding = get_encoding_type(file)
-                encoding = "ShiftJIS"
+                encoding = get_encoding_type(file)
                 convertFileWithDetection(file, encoding)
                 num_formatted += 1
             
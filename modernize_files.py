@@ -1,12 +1,14 @@
 
 import os
 import subprocess
-import chardet
 from pathlib import Path
 import sys
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+import encoding_detect
+
 SOURCE_DIR = Path("source-code")
 DOCS_DIR = Path("documents")
 MODERNIZE_LOG = DOCS_DIR / "modernization_log.md"
@@ -15,50 +17,30 @@ MODERNIZE_LOG = DOCS_DIR / "modernization_log.md"
 log_lock = threading.Lock()
 log_entries = []
 
+# Encodings the CodeAtlas scan already detected ({} without an index)
+known_encodings = {}
+
 def log_message(message):
     with log_lock:
         log_entries.append(message)
 
-def get_encoding(rawdata):
-    # Try Shift-JIS first as it's a priority
-    try:
-        rawdata.decode('shift_jis')
-        # Check if ASCII
-        try:
-            rawdata.decode('ascii')
-            return "ASCII"
-        except UnicodeDecodeError:
-            return "Shift-JIS"
-    except UnicodeDecodeError:
-        pass
-    
-    # Try EUC-JP
-    try:
-        rawdata.decode('euc-jp')
-        try:
-            rawdata.decode('ascii')
-            return "ASCII"
-        except UnicodeDecodeError:
-            return "EUC-JP"
-    except UnicodeDecodeError:
-        pass
-
-    # Use chardet for others, limit sample size
-    result = chardet.detect(rawdata[:20000])
-    return result['encoding']
+def get_encoding(file_path, rawdata):
+    # The index's answer if the file is unchanged since the scan, else the shared detector's
+    # (on all of rawdata: it is about to be converted, so a sample is not enough)
+    return encoding_detect.known_encoding(known_encodings, file_path) or encoding_detect.detect_bytes(rawdata, limit=None)
 
 def convert_to_utf8(file_path):
     try:
         with open(file_path, 'rb') as f:
             rawdata = f.read()
         
-        encoding = get_encoding(rawdata)
+        encoding = get_encoding(file_path, rawdata)
         
         if not encoding or encoding.lower() in ['ascii', 'utf-8', 'binary']:
             return None # No conversion needed or not possible
             
         # List of encodings to modernize
-        targets = ['shift_jis', 'shift_jis_2004', 'shift_jisx0213', 'euc-jp', 'iso-8859-1', 'macroman', 'shift_jisx0213']
+        targets = ['shift_jis', 'cp932', 'shift_jis_2004', 'shift_jisx0213', 'euc_jp', 'latin-1', 'mac-roman']
         
         if encoding.lower() not in targets:
             # If we are unsure, maybe skip?
@@ -69,7 +51,7 @@ def convert_to_utf8(file_path):
             content = rawdata.decode(encoding)
             with open(file_path, 'w', encoding='utf-8') as f:
                 f.write(content)
-            return encoding
+            return encoding_detect.label(encoding)
         except Exception as e:
             return f"Error converting from {encoding}: {e}"
             
@@ -143,6 +125,8 @@ def process_file(file_path, root):
     return results
 
 def process_directory(directory):
+    global known_encodings
+    known_encodings = encoding_detect.indexed_encodings()
     all_files = []
     print(f"Scanning files in {directory}...")
     for root, _, files in os.walk(directory):
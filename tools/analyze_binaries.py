@@ -1,10 +1,11 @@
 
 import os
-import subprocess
 from pathlib import Path
 from collections import Counter
 import sys
 
+import magic_detect
+
 SOURCE_DIR = Path("source-code")
 DOCS_DIR = Path("documents")
 REPORT_FILE = DOCS_DIR / "binary_analysis_report.md"
@@ -14,12 +15,9 @@ def is_binary_content(content):
         return True
     return False
 
-def get_file_type(file_path):
-    try:
-        result = subprocess.run(["file", "-b", str(file_path)], capture_output=True, text=True)
-        return result.stdout.strip()
-    except Exception as e:
-        return f"Error: {e}"
+def get_file_type(file_path, header=None):
+    # Signature table first; `file` only for what it can't name
+    return magic_detect.file_type(file_path, header)
 
 def analyze_binaries(directory):
     extension_counts = Counter()
@@ -46,9 +44,9 @@ def analyze_binaries(directory):
             # Skip if file is too small to likely be an interesting binary? No, check all.
             # Read header
             with open(file_path, 'rb') as f:
-                header = f.read(1024)
+                header = f.read(magic_detect.HEADER_BYTES)
                 
-            if is_binary_content(header):
+            if is_binary_content(header[:1024]):
                 binary_files_count += 1
                 
                 # Extension
@@ -58,7 +56,7 @@ def analyze_binaries(directory):
                 extension_counts[ext] += 1
                 
                 # File Type
-                ftype = get_file_type(file_path)
+                ftype = get_file_type(file_path, header)
                 # Generalize file type?
                 # e.g. "ELF 32-bit LSB executable, MIPS, N32 MIPS-III..." -> "ELF 32-bit LSB executable"
                 # For now keep raw to capture specific architecture details if user wants.
@@ -70,6 +68,7 @@ def analyze_binaries(directory):
             continue
 
     print(f"\nFinished. Found {binary_files_count} binary files.")
+    print(f"Identified {magic_detect.stats['signature']} by signature, {magic_detect.stats['file']} with the `file` command.")
     return extension_counts, file_type_counts, binary_files_count
 
 def generate_report(ext_counts, type_counts, total_binaries):
@@ -84,7 +83,7 @@ def generate_report(ext_counts, type_counts, total_binaries):
             f.write(f"| {ext} | {count} |\n")
         f.write("\n")
         
-        f.write("## Top File Types (via `file` command)\n")
+        f.write("## Top File Types (signature table, `file` command as fallback)\n")
         f.write("| File Type Description | Count |\n")
         f.write("| :--- | :--- |\n")
         for ftype, count in type_counts.most_common(20):
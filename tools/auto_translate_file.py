@@ -3,21 +3,12 @@ import os
 import json
 import re
 import argparse
-from deep_translator import GoogleTranslator
-from concurrent.futures import ThreadPoolExecutor
 import time
 
-def contains_japanese(text):
-    for char in text:
-        code = ord(char)
-        if (0x3040 <= code <= 0x309f) or \
-           (0x30a0 <= code <= 0x30ff) or \
-           (0x4e00 <= code <= 0x9fff):
-            return True
-    return False
-
-def get_line_number(content, index):
-    return content.count('\n', 0, index) + 1
+import encoding_detect
+import fuzzy_memory
+import translation_client
+from c_tokenizer import CODE_EXTENSIONS, contains_japanese, japanese_segments
 
 def parse_lines(content):
     """
@@ -82,14 +73,15 @@ def parse_sentences(content):
 
 def parse_and_process(file_path, strategy='sentence'):
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-            content = f.read()
+        # Shift-JIS / EUC-JP sources too, not just UTF-8
+        with open(file_path, 'rb') as f:
+            content = encoding_detect.decode(f.read())
     except Exception as e:
         return {"error": str(e)}
 
     # Determine mode based on extension or content?
     # Simple check for code extensions
-    is_code = file_path.lower().endswith(('.c', '.h', '.cpp', '.hpp', '.java', '.js', '.py', '.rs', '.go'))
+    is_code = file_path.lower().endswith(CODE_EXTENSIONS)
     
     if not is_code:
         if strategy == 'line':
@@ -97,100 +89,25 @@ def parse_and_process(file_path, strategy='sentence'):
         else:
             detected_items = parse_sentences(content)
     else:
-        length = len(content)
-        # We want to find Japanese segments and their line numbers
-        detected_items = [] # (line_num, text)
-    
-        i = 0
-        while i < length:
-            # String Literal
-            if content[i] == '"':
-                start_idx = i
-                i += 1
-                while i < length:
-                    if content[i] == '"':
-                         bc = 0
-                         j = i - 1
-                         while j >= start_idx and content[j] == '\\':
-                             bc += 1
-                             j -= 1
-                         if bc % 2 == 0:
-                             break
-                    i += 1
-                i += 1
-                text = content[start_idx+1:i-1] # content inside quotes
-                if contains_japanese(text):
-                    detected_items.append((get_line_number(content, start_idx), text))
-            
-            # Single line comment
-            elif content[i:i+2] == '//':
-                start_idx = i
-                end_idx = content.find('\n', i)
-                if end_idx == -1: end_idx = length
-                
-                text = content[start_idx+2:end_idx].strip()
-                if contains_japanese(text):
-                    detected_items.append((get_line_number(content, start_idx), text))
-                i = end_idx
-
-            # Block comment
-            elif content[i:i+2] == '/*':
-                start_idx = i
-                end_idx = content.find('*/', i + 2)
-                if end_idx == -1: end_idx = length
-                else: end_idx += 2
-                
-                text = content[start_idx+2:end_idx-2].strip()
-                
-                # Check strategy for block comments
-                if strategy == 'line':
-                    # Split into lines
-                    # We need to render the original lines to match line numbers
-                    raw_block = content[start_idx+2:end_idx-2]
-                    block_lines = raw_block.splitlines()
-                    current_line_num = get_line_number(content, start_idx)
-                    
-                    for bl in block_lines:
-                        # empty lines might increment line count
-                        # Actually get_line_number is expensive to call repeatedly?
-                        # No, we can just increment.
-                        # Wait, get_line_number counts \n.
-                        # We are iterating splitlines.
-                        if contains_japanese(bl):
-                            detected_items.append((current_line_num, bl.strip()))
-                        current_line_num += 1
-                else:
-                    if contains_japanese(text):
-                        detected_items.append((get_line_number(content, start_idx), text))
-                
-                i = end_idx
-                
-            else:
-                i += 1
+        # (line_num, text) for every Japanese string literal and comment
+        detected_items = japanese_segments(content, split_blocks=(strategy == 'line'))
 
     if not detected_items:
         return {"annotations": {}}
 
     # Deduplicate texts to save API calls
     unique_texts = list(set(item[1] for item in detected_items))
-    translations = {}
+    memory = fuzzy_memory.get_memory()
+    translations = memory.lookup_many(unique_texts)
+    to_fetch = [text for text in unique_texts if text not in translations]
     
-    # Translate concurrently
-    translator = GoogleTranslator(source='auto', target='en')
-    
-    def translate_single(text):
-        if not text.strip(): return (text, "")
+    if to_fetch:
         try:
-            res = translator.translate(text)
-            return (text, res)
-        except Exception as e:
-            return (text, f"[Trans Fail: {str(e)[:20]}]")
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        results = list(executor.map(translate_single, unique_texts))
-        
-    for text, res in results:
-        translations[text] = res
+            fetched, _ = fuzzy_memory.translate_missing(memory, to_fetch, translation_client.get_client().translate_many)
+        except translation_client.TranslationUnavailable as e:
+            memory.flush()
+            return {"error": f"Not translated: {e}"}
+        translations.update((text, res) for text, res in fetched.items() if res)
 
     # Build Result
     annotations = {}
@@ -205,8 +122,8 @@ def parse_and_process(file_path, strategy='sentence'):
                 else:
                     annotations[line] = note
 
-    return {"annotations": annotations}
-
+    # Plugin workers never reach atexit, so write the hit/miss counters now
+    memory.flush()
     return {"annotations": annotations}
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+import re
+from bisect import bisect_right
+
+# Shared C-family tokenizer for the translation tools. One regex pass finds
+# every string literal, char literal and comment; the text between them is
+# code. Line numbers come from a table of line start offsets (bisect), so
+# looking one up costs O(log lines) instead of recounting newlines from the
+# top of the file.
+
+JAPANESE_RE = re.compile('[\u3040-\u309f\u30a0-\u30ff\u4e00-\u9fff]')    # Hiragana, katakana, CJK
+
+# Escapes are taken as pairs so an escaped quote doesn't end a literal.
+# Unterminated strings and comments run to the end of the file; a char literal
+# never spans lines (a stray apostrophe must not swallow the rest of the file).
+TOKEN_RE = re.compile(r'''
+      (?P<string>  "[^"\\]*(?:\\.[^"\\]*)*"? )
+    | (?P<char>    '[^'\\\n]*(?:\\.[^'\\\n]*)*'? )
+    | (?P<line>    //[^\n]* )
+    | (?P<block>   /\*.*?(?:\*/|\Z) )
+''', re.S | re.X)
+
+# Files auto_translate_file.py (and the tree translation) tokenize as code
+CODE_EXTENSIONS = ('.c', '.h', '.cpp', '.hpp', '.java', '.js', '.py', '.rs', '.go')
+
+KINDS = {'string': 'string', 'char': 'char', 'line': 'comment_line', 'block': 'comment_block'}
+
+_NEWLINE_RE = re.compile('\n')
+
+def contains_japanese(text, start=0, end=None):
+    """True if text (or text[start:end], without slicing) has any kana or kanji."""
+    if end is None:
+        return JAPANESE_RE.search(text, start) is not None
+    return JAPANESE_RE.search(text, start, end) is not None
+
+class LineIndex:
+    """Offset -> 1-based line number, from a table of line start offsets."""
+
+    def __init__(self, content):
+        self.starts = [0]
+        self.starts.extend(m.end() for m in _NEWLINE_RE.finditer(content))
+
+    def line(self, index):
+        return bisect_right(self.starts, index)
+
+    def line_start(self, index):
+        """Offset of the first character on index's line."""
+        return self.starts[bisect_right(self.starts, index) - 1]
+
+def tokenize(content):
+    """
+    Yields (kind, start, end) covering the whole content in order. Kinds:
+    'code', 'string', 'char', 'comment_line', 'comment_block'.
+    """
+    pos = 0
+    for m in TOKEN_RE.finditer(content):
+        start, end = m.span()
+        if start > pos:
+            yield 'code', pos, start
+        yield KINDS[m.lastgroup], start, end
+        pos = end
+    if pos < len(content):
+        yield 'code', pos, len(content)
+
+def inner_span(content, kind, start, end):
+    """(start, end) of a token without its quotes or comment markers."""
+    if kind == 'string' or kind == 'char':
+        closed = end - start > 1 and content[end - 1] == content[start]
+        return start + 1, end - 1 if closed else end
+    if kind == 'comment_line':
+        return start + 2, end
+    if kind == 'comment_block':
+        return start + 2, end - 2 if content.endswith('*/', start + 2, end) else end
+    return start, end
+
+def japanese_segments(content, split_blocks=False):
+    """
+    (line, text) for every string literal and comment containing Japanese.
+    Comment text is stripped. With split_blocks, block comments give one item
+    per line that contains Japanese.
+    """
+    lines = None
+    items = []
+    for kind, start, end in tokenize(content):
+        if kind == 'code' or kind == 'char':
+            continue
+        body_start, body_end = inner_span(content, kind, start, end)
+        if not contains_japanese(content, body_start, body_end):
+            continue
+        if lines is None:
+            lines = LineIndex(content)
+        line = lines.line(start)
+        text = content[body_start:body_end]
+        if kind == 'string':
+            items.append((line, text))
+        elif kind == 'comment_block' and split_blocks:
+            for offset, block_line in enumerate(text.splitlines()):
+                if contains_japanese(block_line):
+                    items.append((line + offset, block_line.strip()))
+        else:
+            items.append((line, text.strip()))
+    return items
@@ -0,0 +1,213 @@
+import os
+import sys
+import codecs
+import sqlite3
+
+try:
+    from chardet import UniversalDetector
+except ImportError:  # Optional: only consulted for samples the cheap pass can't settle
+    UniversalDetector = None
+
+# One encoding detector for the indexer, the viewer and the conversion scripts.
+# The cheap pass reads a bounded sample (stopping early once it has seen enough
+# non-ASCII bytes) and tries strict decodes: NUL means binary, pure ASCII and
+# valid UTF-8 are answered straight away, and so is a sample that only one of
+# Shift-JIS / EUC-JP accepts. Only when both accept it (or neither does) are the
+# non-ASCII lines handed to chardet's statistical detector.
+# The scanner stores the result in files.encoding, so tools look it up there.
+
+SAMPLE_BYTES = 64 * 1024     # Most a detection reads
+BLOCK_BYTES = 8 * 1024
+ENOUGH_NON_ASCII = 1024      # Non-ASCII bytes after which the sample is conclusive
+SNIFF_BYTES = 8192           # NUL in this prefix means binary (as the scanner always did)
+JAPANESE = ('shift_jis', 'euc_jp')
+INDEX_DB = 'code_atlas.db'
+
+LABELS = {
+    'ascii': 'ASCII',
+    'utf-8': 'UTF-8',
+    'shift_jis': 'Shift-JIS',
+    'cp932': 'Shift-JIS',
+    'euc_jp': 'EUC-JP',
+    'binary': 'Binary',
+}
+
+_HIGH_BYTES = bytes(range(0x80, 0x100))
+
+def _decodes(data, encoding, final):
+    # Incremental decoder: a sample cut in the middle of a character is fine
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(data, final)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+def _statistical(data):
+    """chardet's verdict on the lines of data that have non-ASCII bytes; None without chardet."""
+    if UniversalDetector is None:
+        return None
+    detector = UniversalDetector()
+    for line in data.split(b'\n'):
+        if not line.isascii():
+            detector.feed(line + b'\n')
+            if detector.done:
+                break
+    detector.close()
+    encoding = detector.result['encoding']
+    try:
+        return codecs.lookup(encoding).name if encoding else None
+    except LookupError:
+        return None
+
+def detect_bytes(data, complete=True, limit=SAMPLE_BYTES):
+    """
+    Encoding of data ('ascii', 'utf-8', 'shift_jis', 'euc_jp', 'binary', ...,
+    or None). complete=False means data is only the start of the file; only the
+    first limit bytes are tried (None: all of them).
+    """
+    if b'\0' in data[:SNIFF_BYTES]:
+        return 'binary'
+    if limit is not None and len(data) > limit:
+        data, complete = data[:limit], False
+    if data.isascii():
+        return 'ascii'
+    if _decodes(data, 'utf-8', complete):
+        return 'utf-8'
+    fits = [enc for enc in JAPANESE if _decodes(data, enc, complete)]
+    if not fits and _decodes(data, 'cp932', complete):
+        fits = ['cp932']  # Shift-JIS plus the Windows extensions (NEC/IBM rows)
+    if len(fits) == 1:
+        return fits[0]
+    guess = _statistical(data)
+    if fits:
+        # Both decode: let chardet break the tie, Shift-JIS otherwise (by far the common case here)
+        return guess if guess in fits else fits[0]
+    return guess
+
+def read_sample(path):
+    """(sample, complete): the start of the file, no more than detection needs."""
+    blocks = []
+    size = non_ascii = 0
+    with open(path, 'rb') as f:
+        while size < SAMPLE_BYTES:
+            block = f.read(BLOCK_BYTES)
+            if not block:
+                return b''.join(blocks), True
+            blocks.append(block)
+            size += len(block)
+            if size <= SNIFF_BYTES and b'\0' in block:
+                break
+            non_ascii += len(block) - len(block.translate(None, _HIGH_BYTES))
+            if non_ascii >= ENOUGH_NON_ASCII:
+                break
+        # The sample might end exactly at EOF
+        complete = not f.read(1)
+    return b''.join(blocks), complete
+
+def detect_file(path):
+    """Encoding of the file at path (see detect_bytes); None if unreadable or unknown."""
+    try:
+        sample, complete = read_sample(path)
+    except OSError:
+        return None
+    return detect_bytes(sample, complete)
+
+def decode_detected(data, encoding=None):
+    """
+    (text, encoding) for data, decoded with encoding (e.g. the one stored in
+    the index) or a detected one. Never raises: if the bytes turn out not to
+    match (the sample was misleading, or the file changed), the whole of data
+    is detected again, and undecodable bytes become U+FFFD.
+    """
+    if encoding is None:
+        encoding = detect_bytes(data)
+    try:
+        text = data.decode('utf-8' if encoding in (None, 'binary', 'ascii') else encoding)
+        if encoding == 'ascii' and not text.isascii():
+            encoding = 'utf-8'  # ASCII sample, UTF-8 further on
+        return text, encoding
+    except (UnicodeDecodeError, LookupError):
+        pass
+    encoding = detect_bytes(data, limit=None)
+    try:
+        return data.decode('utf-8' if encoding in (None, 'binary', 'ascii') else encoding, errors='replace'), encoding
+    except LookupError:
+        return data.decode('utf-8', errors='replace'), None
+
+def decode(data, encoding=None):
+    """Text of data (see decode_detected)."""
+    return decode_detected(data, encoding)[0]
+
+def label(encoding):
+    """Display name for reports ('Shift-JIS', 'UTF-8', ...)."""
+    if encoding is None:
+        return 'Unknown'
+    return LABELS.get(encoding, encoding)
+
+# --- The index ---
+
+def indexed_encodings(db_path=INDEX_DB):
+    """{path: (size, mtime_ns, encoding)} from the CodeAtlas index; {} if there is none."""
+    conn = open_index(db_path)
+    if conn is None:
+        return {}
+    try:
+        rows = conn.execute(
+            "SELECT path, size, mtime, encoding FROM files WHERE encoding IS NOT NULL AND removed = 0"
+        ).fetchall()
+    except sqlite3.Error:
+        return {}
+    finally:
+        conn.close()
+    return {path: (size, mtime, encoding) for path, size, mtime, encoding in rows}
+
+def unchanged(size, mtime_ns, path):
+    """True if path still has the size and mtime it was indexed with."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return size == st.st_size and mtime_ns == st.st_mtime_ns
+
+def still_valid(entry, path):
+    """entry's encoding if path is unchanged since it was indexed, else None. entry is (size, mtime_ns, encoding)."""
+    return entry[2] if unchanged(entry[0], entry[1], path) else None
+
+def known_encoding(known, path):
+    """The indexed encoding of path if the file is unchanged since it was indexed, else None."""
+    entry = known.get(os.path.relpath(path))  # The index stores paths relative to the project root
+    return still_valid(entry, path) if entry else None
+
+def open_index(db_path=INDEX_DB):
+    """Read-only connection to the CodeAtlas index, or None if there is none."""
+    if not os.path.exists(db_path):
+        return None
+    try:
+        return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return None
+
+def indexed_encoding(conn, path):
+    """known_encoding() with one query per file instead of the whole table in memory."""
+    if conn is None:
+        return None
+    try:
+        entry = conn.execute("SELECT size, mtime, encoding FROM files WHERE path = ? AND removed = 0",
+                             (os.path.relpath(path),)).fetchone()
+    except sqlite3.Error:
+        return None
+    return still_valid(entry, path) if entry and entry[2] else None
+
+def lookup_or_detect(known, path):
+    """Indexed encoding of path when still valid, otherwise a fresh detection."""
+    return known_encoding(known, path) or detect_file(path)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python encoding_detect.py <file>...")
+        sys.exit(1)
+    known = indexed_encodings()
+    for path in sys.argv[1:]:
+        cached = known_encoding(known, path)
+        encoding = cached or detect_file(path)
+        print(f"{path}: {label(encoding)}" + (" (index)" if cached else ""))
@@ -1,67 +1,135 @@
-
 import sys
+import re
+import json
+import mmap
+import argparse
 
-def is_sjis_byte(b):
-    return (0x20 <= b <= 0x7E) or (0xA1 <= b <= 0xDF)
+# Finds Shift-JIS text runs in binaries. The file is memory-mapped and read in
+# chunks; each chunk is turned into a "could be SJIS" byte mask with one
+# bytes.translate, so long stretches of padding/code are skipped by C-level
+# finds, and only candidate regions go through the exact regex. Chunks that are
+# mostly candidates (dense data) are handed to the regex in one go instead.
 
-def is_sjis_lead(b):
-    return (0x81 <= b <= 0x9F) or (0xE0 <= b <= 0xEA) # Extended range?
+MIN_LENGTH = 4                                  # Bytes; shorter runs are mostly noise
+LEAD_RANGES = ((0x81, 0x9F), (0xE0, 0xEA))      # Double-byte lead bytes (0xEB-0xFC is vendor/user space)
+TRAIL_RANGES = ((0x40, 0x7E), (0x80, 0xFC))
+SINGLE_RANGES = ((0x20, 0x7E), (0xA1, 0xDF))    # ASCII + half-width kana
+CHUNK_SIZE = 16 * 1024 * 1024
 
-def is_sjis_trail(b):
-    return (0x40 <= b <= 0x7E) or (0x80 <= b <= 0xFC)
+_patterns = {}
 
-def extract_sjis(path):
-    with open(path, 'rb') as f:
-        data = f.read()
-    
-    found_strings = []
-    current_bytes = bytearray()
-    
-    i = 0
-    length = len(data)
-    
-    while i < length:
-        b = data[i]
-        
-        # Check double byte
-        if is_sjis_lead(b):
-            if i + 1 < length:
-                b2 = data[i+1]
-                if is_sjis_trail(b2):
-                    current_bytes.append(b)
-                    current_bytes.append(b2)
-                    i += 2
-                    continue
-        
-        # Check single byte (ASCII + Half-width Kana)
-        if is_sjis_byte(b):
-            current_bytes.append(b)
-            i += 1
-            continue
-            
-        # If we hit a non-SJIS byte, verify if we have a valid string accumulated
-        if len(current_bytes) > 0:
+def _byte_class(ranges):
+    return b'[' + b''.join(re.escape(bytes([lo])) + b'-' + re.escape(bytes([hi])) for lo, hi in ranges) + b']'
+
+def build_pattern(lead_ranges=LEAD_RANGES):
+    """
+    (regex for a maximal run of SJIS characters, candidate byte mask table).
+    Double-byte pairs are tried first; lead bytes are never single characters.
+    """
+    key = tuple(tuple(r) for r in lead_ranges)
+    if key not in _patterns:
+        lead, trail, single = _byte_class(key), _byte_class(TRAIL_RANGES), _byte_class(SINGLE_RANGES)
+        # The lookahead gives the engine a first-byte set to skip non-candidates with
+        starts = b'[' + single[1:-1] + lead[1:-1] + b']'
+        pattern = re.compile(b'(?=' + starts + b')(?:' + lead + trail + b'|' + single + b')+')
+        candidates = {b for lo, hi in key + TRAIL_RANGES + SINGLE_RANGES for b in range(lo, hi + 1)}
+        mask_table = bytes(1 if b in candidates else 0 for b in range(256))
+        _patterns[key] = (pattern, mask_table)
+    return _patterns[key]
+
+def parse_ranges(spec):
+    """'81-9F,E0-EA' -> ((0x81, 0x9F), (0xE0, 0xEA))"""
+    ranges = []
+    for part in spec.split(','):
+        lo, _, hi = part.strip().partition('-')
+        ranges.append((int(lo, 16), int(hi or lo, 16)))
+    return tuple(ranges)
+
+def _runs(pattern, data, start, end, min_length):
+    for m in pattern.finditer(data, start, end):
+        s, e = m.span()
+        if e - s >= min_length:
             try:
-                # Filter out strings that are just pure ASCII noise if needed, 
-                # but user wants headers too probably.
-                # Let's keep strings > 3 bytes.
-                if len(current_bytes) > 3:
-                     s = current_bytes.decode('shift_jis')
-                     # Filter out garbage that accidentally parsed as SJIS?
-                     # Common garbage: lots of punctuation or weird chars.
-                     # But real text includes punctuation.
-                     print(s)
-            except:
+                yield s, e - s, m.group().decode('shift_jis')
+            except UnicodeDecodeError:
+                # Pairs in the lead/trail ranges the codec has no character for: not text
                 pass
-            current_bytes = bytearray()
-        
-        i += 1
-        
-    # Flush last
-    if len(current_bytes) > 3:
+
+def iter_sjis_strings(path, min_length=MIN_LENGTH, lead_ranges=LEAD_RANGES):
+    """Yields (offset, byte_length, text) for every run of at least min_length bytes."""
+    pattern, mask_table = build_pattern(lead_ranges)
+    needle = b'\x01' * min_length
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return  # Empty file
         try:
-             print(current_bytes.decode('shift_jis'))
-        except: pass
+            size = len(data)
+            base = 0
+            while base < size:
+                mask = data[base:base + CHUNK_SIZE].translate(mask_table)
+                end = len(mask)
+                if base + end < size:
+                    # Stop at the last non-candidate byte so no run spans two chunks
+                    cut = mask.rfind(0)
+                    if cut > 0:
+                        end = cut
+
+                if mask.count(1, 0, end) * 2 > end:
+                    yield from _runs(pattern, data, base, base + end, min_length)
+                else:
+                    pos = 0
+                    while True:
+                        start = mask.find(needle, pos, end)
+                        if start < 0:
+                            break
+                        stop = mask.find(0, start + min_length, end)
+                        pos = stop if stop >= 0 else end
+                        region = data[base + start:base + pos]
+                        if region.isascii():
+                            yield base + start, pos - start, region.decode('ascii')
+                        else:
+                            yield from _runs(pattern, data, base + start, base + pos, min_length)
+                base += end
+        finally:
+            data.close()
+
+def extract_sjis(path, min_length=MIN_LENGTH, lead_ranges=LEAD_RANGES):
+    """Toolbelt plugin entry point."""
+    try:
+        strings = [
+            {"offset": offset, "length": length, "text": text}
+            for offset, length, text in iter_sjis_strings(path, min_length, lead_ranges)
+        ]
+    except OSError as e:
+        return {"error": str(e)}
+    output = "\n".join(f"0x{s['offset']:08x}  {s['text']}" for s in strings)
+    return {"output": output, "data": {"strings": strings}}
+
+def string_offsets(path, min_length=MIN_LENGTH, lead_ranges=LEAD_RANGES):
+    """Plugin entry point for the corpus string table: every distinct string with its offsets."""
+    offsets = {}
+    try:
+        for offset, _, text in iter_sjis_strings(path, min_length, lead_ranges):
+            offsets.setdefault(text, []).append(offset)
+    except OSError as e:
+        return {"error": str(e)}
+    return {"output": f"{len(offsets)} distinct strings", "data": {"offsets": offsets}}
 
 if __name__ == "__main__":
-    extract_sjis(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Extract Shift-JIS strings from a binary.')
+    parser.add_argument('file_path')
+    parser.add_argument('--min-length', type=int, default=MIN_LENGTH, help='Minimum run length in bytes')
+    parser.add_argument('--lead-ranges', type=parse_ranges, default=LEAD_RANGES,
+                        help='Double-byte lead byte ranges in hex, e.g. 81-9F,E0-FC')
+    parser.add_argument('--text', action='store_true', help='Print offset and text per line instead of JSON')
+    args = parser.parse_args()
+
+    if args.text:
+        for offset, _, text in iter_sjis_strings(args.file_path, args.min_length, args.lead_ranges):
+            print(f"0x{offset:08x}  {text}")
+    else:
+        result = extract_sjis(args.file_path, args.min_length, args.lead_ranges)
+        json.dump(result.get("data", result), sys.stdout)
+        print()
@@ -0,0 +1,308 @@
+import sys
+import os
+import re
+import atexit
+import math
+import argparse
+import threading
+
+import translation_memory
+from translation_memory import TranslationMemory, normalize, is_failure
+
+# Fuzzy reuse on top of the translation memory. Legacy comments often differ
+# only in a number, a register name or spacing ("割り込み 3 の処理" /
+# "割り込み 4 の処理"). Each source is reduced to a skeleton: the variable tokens
+# (numbers, hex, ASCII identifiers) become placeholders and whitespace is
+# dropped. A miss in the exact memory is looked up by skeleton: only a stored
+# source with the very same skeleton is reused, with the differing tokens
+# swapped into its translation. No network call. Matches whose tokens can't be
+# mapped onto the translation are not used.
+#
+# A near skeleton (one changed word: 開始 / 停止) is a different sentence, so
+# it is never reused, and lookups don't look for one. Only reports do (`python3
+# tools/fuzzy_memory.py query`, /api/translation_memory?text=): they score the
+# candidates by character trigram similarity (Dice) to show how close a miss came.
+
+FLOOR = 0.6                 # Near candidates below this are not even considered
+MAX_CANDIDATES = 20
+MAX_LENGTH = 300            # Longer skeletons are not fuzzy-matched (too many grams to look up)
+GRAM = 3
+
+VAR_RE = re.compile(r'0[xX][0-9A-Fa-f]+|\d+(?:\.\d+)?|[A-Za-z_][A-Za-z0-9_]*')
+_SPACE_RE = re.compile(r'\s+')
+PLACEHOLDER = '\x00'
+
+def skeleton(key):
+    """(skeleton, tokens) for a normalized source text."""
+    tokens = VAR_RE.findall(key)
+    return _SPACE_RE.sub('', VAR_RE.sub(PLACEHOLDER, key)), tokens
+
+def grams(skel):
+    padded = '\x02' + skel + '\x03'
+    return {padded[i:i + GRAM] for i in range(max(1, len(padded) - GRAM + 1))}
+
+def substitute(source_tokens, query_tokens, translation):
+    """
+    The translation of the stored source with its tokens replaced by the
+    query's, or None if the tokens don't line up (count, conflicting mapping,
+    or a token the translation doesn't contain).
+    """
+    if len(source_tokens) != len(query_tokens):
+        return None
+    mapping = {}
+    for old, new in zip(source_tokens, query_tokens):
+        if mapping.setdefault(old, new) != new:
+            return None
+    mapping = {old: new for old, new in mapping.items() if old != new}
+    if not mapping:
+        return translation
+    pattern = re.compile(
+        r'(?<![A-Za-z0-9_])(' + '|'.join(re.escape(old) for old in sorted(mapping, key=len, reverse=True)) + r')(?![A-Za-z0-9_])'
+    )
+    if {m.group(1) for m in pattern.finditer(translation)} != set(mapping):
+        return None
+    return pattern.sub(lambda m: mapping[m.group(1)], translation)
+
+def representatives(texts):
+    """(one text per skeleton, the others), in input order."""
+    seen = set()
+    first, rest = [], []
+    for text in texts:
+        skel = skeleton(normalize(text))[0]
+        (rest if skel in seen else first).append(text)
+        seen.add(skel)
+    return first, rest
+
+def translate_missing(memory, texts, translate_many, chunk=None, progress=None):
+    """
+    ({text: translation, None if it failed}, number reused) for texts the
+    memory doesn't have. One text per skeleton goes to translate_many first;
+    the others are then looked up again, so variants that differ only in
+    their tokens are filled in from those results instead of the API.
+    Results (reused ones too) are stored in the memory after every chunk.
+    """
+    first, rest = representatives(texts)
+    results = {}
+
+    def fetch(batch):
+        step = chunk or max(1, len(batch))
+        for i in range(0, len(batch), step):
+            part = translate_many(batch[i:i + step])
+            memory.store_many((text, result) for text, result in part.items() if result is not None)
+            results.update(part)
+            if progress:
+                progress(len(results), len(texts))
+
+    fetch(first)
+    reused = memory.lookup_many(rest, store=True) if rest else {}
+    results.update(reused)
+    fetch([text for text in rest if text not in reused])
+    return results, len(reused)
+
+class FuzzyTranslationMemory(TranslationMemory):
+    def __init__(self, path=translation_memory.DB_PATH, target_lang=translation_memory.TARGET_LANG):
+        self._fuzzy_hits = 0
+        self._fuzzy_misses = 0
+        super().__init__(path, target_lang)
+
+    def _init_db(self):
+        super()._init_db()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS fuzzy_sources (
+                key TEXT PRIMARY KEY,
+                skeleton TEXT NOT NULL,
+                gram_count INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS fuzzy_grams (
+                gram TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (gram, key)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fuzzy_sources_skeleton ON fuzzy_sources(skeleton)")
+        conn.commit()
+        self.sync()
+
+    def _index(self, keys):
+        conn = self._conn()
+        sources, postings = [], []
+        for key in keys:
+            skel, _ = skeleton(key)
+            key_grams = grams(skel)
+            sources.append((key, skel, len(key_grams)))
+            postings.extend((gram, key) for gram in key_grams)
+        conn.executemany("INSERT OR IGNORE INTO fuzzy_sources (key, skeleton, gram_count) VALUES (?, ?, ?)", sources)
+        conn.executemany("INSERT OR IGNORE INTO fuzzy_grams (gram, key) VALUES (?, ?)", postings)
+        conn.commit()
+
+    def sync(self):
+        """Indexes translations stored without going through this class (CSV imports, older runs)."""
+        keys = [row[0] for row in self._conn().execute("""
+            SELECT DISTINCT t.key FROM translations t
+            WHERE NOT EXISTS (SELECT 1 FROM fuzzy_sources s WHERE s.key = t.key)
+        """)]
+        for i in range(0, len(keys), 5000):
+            self._index(keys[i:i + 5000])
+        return len(keys)
+
+    def store_many(self, pairs):
+        pairs = list(pairs)
+        count = super().store_many(pairs)
+        if count:
+            self._index({normalize(source) for source, target in pairs if source.strip() and not is_failure(target)})
+        return count
+
+    def _candidates(self, key, skel, near=False):
+        """
+        [(similarity, source key)] for stored sources with skeleton skel, or
+        (near=True, if there are none) close to it, best first.
+        """
+        conn = self._conn()
+        found = [(1.0, row[0]) for row in conn.execute(
+            "SELECT key FROM fuzzy_sources WHERE skeleton = ? AND key != ? LIMIT ?", (skel, key, MAX_CANDIDATES)
+        )]
+        if found or not near:
+            return found
+        query_grams = list(grams(skel))
+        a = len(query_grams)
+        # Dice >= FLOOR needs at least this many shared grams
+        min_shared = math.ceil(FLOOR * a / (2 - FLOOR))
+        cur = conn.execute(f"""
+            SELECT g.key, g.shared, s.gram_count FROM (
+                SELECT key, count(*) AS shared FROM fuzzy_grams
+                WHERE gram IN ({','.join('?' * a)})
+                GROUP BY key HAVING shared >= ?
+            ) g JOIN fuzzy_sources s ON s.key = g.key
+            WHERE g.key != ?
+        """, query_grams + [min_shared, key])
+        scored = [(2 * shared / (a + count), source_key) for source_key, shared, count in cur]
+        scored = [item for item in scored if item[0] >= FLOOR]
+        scored.sort(reverse=True)
+        return scored[:MAX_CANDIDATES]
+
+    def fuzzy_lookup(self, text, near=False):
+        """
+        (translation, similarity, source) of the best usable match, or None.
+        Not counted. Only a similarity of 1.0 (same skeleton) may be used as a
+        translation; near=True also scores other skeletons, for reports (an
+        aggregate over the gram table, so not on the lookup path).
+        """
+        key = normalize(text)
+        skel, tokens = skeleton(key)
+        if not skel.strip(PLACEHOLDER) or len(skel) > MAX_LENGTH:
+            return None     # Nothing but variable tokens (no basis for reuse), or too long
+        conn = self._conn()
+        for similarity, source_key in self._candidates(key, skel, near):
+            row = conn.execute(
+                "SELECT source, target FROM translations WHERE key = ? AND lang = ?", (source_key, self.target_lang)
+            ).fetchone()
+            if row is None:
+                continue
+            source_skel, source_tokens = skeleton(source_key)
+            translation = substitute(source_tokens, tokens, row[1])
+            if translation is not None:
+                # Dice can reach 1.0 for different skeletons with the same grams
+                return translation, similarity if source_skel == skel else min(similarity, 0.99), row[0]
+        return None
+
+    def exact_lookup_many(self, texts):
+        """Exact matches only (not counted)."""
+        return super().lookup_many(texts)
+
+    def exact_lookup(self, text):
+        return self.exact_lookup_many([text]).get(text)
+
+    def lookup_many(self, texts, store=False):
+        """
+        Exact matches, then same-skeleton variants for the rest. store=True
+        saves the variants it filled in, so later lookups of them are exact
+        (and not counted as fuzzy hits again).
+        """
+        texts = list(texts)
+        found = super().lookup_many(texts)
+        reused = []
+        hits = misses = 0
+        for text in dict.fromkeys(texts):
+            if text in found or not text.strip():
+                continue
+            match = self.fuzzy_lookup(text)
+            if match is not None:
+                found[text] = match[0]
+                reused.append((text, match[0]))
+                hits += 1
+            else:
+                misses += 1
+        with self._lock:
+            self._fuzzy_hits += hits
+            self._fuzzy_misses += misses
+        if store and reused:
+            self.store_many(reused)
+        return found
+
+    def flush(self):
+        with self._lock:
+            counters = [('fuzzy_hits', self._fuzzy_hits), ('fuzzy_misses', self._fuzzy_misses)]
+            self._fuzzy_hits = self._fuzzy_misses = 0
+        counters = [item for item in counters if item[1]]
+        if counters:
+            conn = self._conn()
+            conn.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                counters
+            )
+            conn.commit()
+        super().flush()
+
+    def stats(self):
+        stats = super().stats()
+        counters = dict(self._conn().execute("SELECT name, value FROM counters WHERE name LIKE 'fuzzy%'"))
+        hits, misses = counters.get('fuzzy_hits', 0), counters.get('fuzzy_misses', 0)
+        lookups = hits + misses
+        stats['fuzzy'] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+        }
+        return stats
+
+_default = None
+_default_lock = threading.Lock()
+
+def get_memory():
+    """The process-wide fuzzy memory at translation_memory.DB_PATH (opened on first use)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = FuzzyTranslationMemory()
+            atexit.register(_default.flush)
+        return _default
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fuzzy translation memory.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stats', help='Exact and fuzzy hit rates')
+    p = sub.add_parser('query', help='Show the fuzzy match for a text, or the nearest miss')
+    p.add_argument('text')
+    args = parser.parse_args()
+
+    memory = get_memory()
+    if args.command == 'stats':
+        stats = memory.stats()
+        fuzzy = stats.pop('fuzzy')
+        print(stats)
+        print(f"Fuzzy: {fuzzy['hits']} hits, {fuzzy['misses']} misses, hit rate {fuzzy['hit_rate']}")
+    else:
+        exact = memory.exact_lookup(args.text)
+        if exact is not None:
+            print(f"Exact: {exact}")
+            sys.exit(0)
+        match = memory.fuzzy_lookup(args.text, near=True)
+        if match is None:
+            print("No match.")
+            sys.exit(1)
+        translation, similarity, source = match
+        verdict = "used" if similarity == 1.0 else "not used, the skeleton differs"
+        print(f"{similarity:.3f} ({verdict}) from {source!r}:\n{translation}")
@@ -0,0 +1,316 @@
+import sys
+import struct
+import subprocess
+from collections import Counter
+
+# In-process file type detection from a table of magic signatures, so a run
+# over hundreds of thousands of binaries doesn't fork `file` for each one.
+# Only the first HEADER_BYTES of a file are read. Descriptions follow `file -b`
+# where it has one, so reports stay comparable. Anything the table can't name
+# still goes to `file` (file_type()).
+
+HEADER_BYTES = 4096
+
+stats = Counter()   # 'signature' / 'file' hits of file_type(), for reports
+
+# --- ELF ---
+
+ELF_TYPES = {0: 'no file type', 1: 'relocatable', 2: 'executable', 3: 'shared object', 4: 'core file'}
+ELF_MACHINES = {
+    0: 'no machine', 2: 'SPARC', 3: 'Intel 80386', 4: 'Motorola m68k', 8: 'MIPS', 10: 'MIPS RS3000 LE',
+    18: 'SPARC32PLUS', 20: 'PowerPC', 21: '64-bit PowerPC', 36: 'NEC V800', 40: 'ARM',
+    42: 'Renesas SH', 43: 'SPARC V9', 46: 'Renesas H8/300', 50: 'IA-64', 62: 'x86-64',
+    88: 'Renesas M32R', 183: 'ARM aarch64', 243: 'RISC-V',
+}
+# e_flags >> 28 on MIPS
+MIPS_ARCHS = {0: 'MIPS-I', 1: 'MIPS-II', 2: 'MIPS-III', 3: 'MIPS-IV', 4: 'MIPS-V',
+              5: 'MIPS32', 6: 'MIPS64', 7: 'MIPS32 rel2', 8: 'MIPS64 rel2'}
+
+def _elf(h):
+    if len(h) < 52 or h[4] not in (1, 2) or h[5] not in (1, 2):
+        return None
+    bits = 32 if h[4] == 1 else 64
+    endian = '<' if h[5] == 1 else '>'
+    e_type, e_machine = struct.unpack_from(endian + 'HH', h, 16)
+    desc = (f"ELF {bits}-bit {'LSB' if endian == '<' else 'MSB'} "
+            f"{ELF_TYPES.get(e_type, f'type {e_type:#x}')}, "
+            f"{ELF_MACHINES.get(e_machine, f'machine {e_machine}')}")
+    if e_machine in (8, 10) and len(h) >= 64:
+        flags = struct.unpack_from(endian + 'I', h, 36 if bits == 32 else 48)[0]
+        desc += f", {MIPS_ARCHS.get(flags >> 28, 'unknown MIPS arch')}"
+    return desc
+
+# --- COFF / PE / Mach-O ---
+
+# (f_magic, byte order) -> (architecture, flavour)
+COFF_MACHINES = {
+    (0x014c, '<'): ('Intel 80386', 'COFF'),
+    (0x8664, '<'): ('Intel amd64', 'COFF'),
+    (0x0150, '>'): ('Motorola 68000', 'COFF'),
+    (0x0160, '>'): ('MIPSEB', 'ECOFF'),
+    (0x0162, '<'): ('MIPSEL', 'ECOFF'),
+    (0x0166, '<'): ('MIPSEL R4000', 'COFF'),
+    (0x01a2, '<'): ('Hitachi SH3', 'COFF'),
+    (0x01a6, '<'): ('Hitachi SH4', 'COFF'),
+    (0x01c0, '<'): ('ARM', 'COFF'),
+    (0x01f0, '<'): ('PowerPC', 'COFF'),
+}
+COFF_EXEC = 0x0002  # f_flags: no unresolved references
+
+def _coff(h):
+    # Two magic bytes are a weak signature: the header must also look sane
+    if len(h) < 20:
+        return None
+    for endian in ('<', '>'):
+        machine, nscns = struct.unpack_from(endian + 'HH', h, 0)
+        entry = COFF_MACHINES.get((machine, endian))
+        if entry is None:
+            continue
+        opthdr, flags = struct.unpack_from(endian + 'HH', h, 16)
+        if not 0 < nscns <= 96 or opthdr > 240 or opthdr % 4:
+            return None
+        arch, flavour = entry
+        return f"{arch} {flavour} {'executable' if flags & COFF_EXEC else 'object file'}"
+    return None
+
+def _pe(h):
+    if len(h) >= 0x40:
+        lfanew = struct.unpack_from('<I', h, 0x3c)[0]
+        if lfanew + 26 <= len(h) and h[lfanew:lfanew + 4] == b'PE\0\0':
+            machine = struct.unpack_from('<H', h, lfanew + 4)[0]
+            arch = COFF_MACHINES.get((machine, '<'), (f'machine {machine:#x}',))[0]
+            magic = struct.unpack_from('<H', h, lfanew + 24)[0]
+            return f"{'PE32+' if magic == 0x20b else 'PE32'} executable, {arch}"
+    return "MS-DOS executable"
+
+def _cafebabe(h):
+    # Java classes and Mach-O universal binaries share the magic; a fat header counts few architectures
+    if len(h) < 8:
+        return None
+    count = struct.unpack_from('>I', h, 4)[0]
+    if 0 < count < 20:
+        return f"Mach-O universal binary with {count} architectures"
+    return "compiled Java class data"
+
+# --- Images and audio ---
+
+def _png(h):
+    if len(h) >= 24 and h[12:16] == b'IHDR':
+        return "PNG image data, %d x %d" % struct.unpack_from('>II', h, 16)
+    return "PNG image data"
+
+def _gif(h):
+    if len(h) >= 10:
+        return f"GIF image data, version {h[3:6].decode('ascii')}, %d x %d" % struct.unpack_from('<HH', h, 6)
+    return "GIF image data"
+
+def _bmp(h):
+    if len(h) < 26 or struct.unpack_from('<I', h, 14)[0] not in (12, 40, 52, 56, 64, 108, 124):
+        return None
+    if struct.unpack_from('<I', h, 14)[0] == 12:
+        width, height = struct.unpack_from('<HH', h, 18)
+    else:
+        width, height = struct.unpack_from('<ii', h, 18)
+    return f"PC bitmap, {width} x {abs(height)}"
+
+def _riff(h):
+    if len(h) < 12:
+        return None
+    endian = 'little' if h[:4] == b'RIFF' else 'big'
+    form = h[8:12].decode('latin-1')
+    if form == 'WAVE':
+        desc = f"RIFF ({endian}-endian) data, WAVE audio"
+        if h[12:16] == b'fmt ' and len(h) >= 36:
+            channels, rate = struct.unpack_from('<HI' if endian == 'little' else '>HI', h, 22)
+            desc += f", {channels} channels, {rate} Hz"
+        return desc
+    if form == 'AVI ':
+        return f"RIFF ({endian}-endian) data, AVI"
+    return f"RIFF ({endian}-endian) data, {form.strip()}"
+
+IFF_FORMS = {b'AIFF': 'AIFF audio', b'AIFC': 'AIFF-C compressed audio', b'ILBM': 'ILBM interleaved image',
+             b'8SVX': '8SVX 8-bit sampled sound voice', b'SMUS': 'SMUS simple music'}
+
+def _iff(h):
+    if len(h) < 12:
+        return None
+    return f"IFF data, {IFF_FORMS.get(h[8:12], h[8:12].decode('latin-1'))}"
+
+def _tiff(h):
+    return f"TIFF image data, {'little' if h[:2] == b'II' else 'big'}-endian"
+
+# --- Archives ---
+
+def _tar(h):
+    return "POSIX tar archive" if h[257:262] == b'ustar' else None
+
+def _lha(h):
+    if len(h) >= 7 and h[2:5] == b'-lh' and h[6:7] == b'-':
+        return f"LHa archive data, method -lh{chr(h[5])}-"
+    return None
+
+def _stuffit(h):
+    return "StuffIt Archive" if h[10:14] == b'rLau' else None
+
+# --- Classic Mac ---
+
+# Creator codes of EGWORD (Ergosoft's Japanese word processor), any version
+EGWORD_CREATORS = (b'EGWD', b'EGW2', b'EGW3', b'EGWR')
+
+def _mac_file(kind, file_type, creator):
+    if creator in EGWORD_CREATORS:
+        return f"EGWORD document ({kind}, type '{file_type.decode('latin-1')}')"
+    return f"{kind}, type '{file_type.decode('latin-1')}', creator '{creator.decode('latin-1')}'"
+
+def _apple_single_double(h):
+    kind = "AppleDouble encoded Macintosh file" if h[3] == 0x07 else "AppleSingle encoded Macintosh file"
+    if len(h) < 26:
+        return kind
+    count = struct.unpack_from('>H', h, 24)[0]
+    for i in range(min(count, (len(h) - 26) // 12)):
+        entry_id, offset, length = struct.unpack_from('>III', h, 26 + 12 * i)
+        if entry_id == 9 and length >= 8 and offset + 8 <= len(h):  # Finder info
+            return _mac_file(kind, h[offset:offset + 4], h[offset + 4:offset + 8])
+    return kind
+
+def _macbinary(h):
+    # No magic: a 128-byte header with a Pascal file name and zero fill bytes
+    if len(h) < 128 or h[0] != 0 or not 1 <= h[1] <= 63 or h[74] != 0 or h[82] != 0:
+        return None
+    name = h[2:2 + h[1]]
+    if any(b < 0x20 for b in name) or not all(0x20 <= b < 0x7f for b in h[65:73]):
+        return None
+    return _mac_file("MacBinary", h[65:69], h[69:73])
+
+def _resource_fork(h):
+    if len(h) < 16:
+        return None
+    data_offset, map_offset, data_length, map_length = struct.unpack_from('>IIII', h, 0)
+    if data_offset == 0x100 and map_offset == data_offset + data_length and 28 <= map_length < 1 << 24:
+        return "Apple HFS/HFS+ resource fork"
+    return None
+
+def _egword_data(h):
+    # Bare EGWORD data fork (type/creator lost in the copy): big-endian chunks,
+    # a length, a 4-letter tag and a size, with the text in the 'TEXT' chunk
+    # (see inspect_egword.py). Only checked once every real signature failed.
+    if h[:2] != b'\0\0':
+        return None
+    index = h.find(b'TEXT', 4)
+    while index != -1:
+        if index + 8 <= len(h):
+            before, size = struct.unpack_from('>I', h, index - 4)[0], struct.unpack_from('>I', h, index + 4)[0]
+            if 0 < before < 0x1000 and 0 < size < 1 << 24:
+                return "EGWORD document (data fork)"
+        index = h.find(b'TEXT', index + 1)
+    return None
+
+# --- The table ---
+
+# (offset, magic, description or function(header) -> description / None), tried in order
+SIGNATURES = [
+    (0, b'\x7fELF', _elf),
+    (0, b'\xfe\xed\xfa\xce', "Mach-O 32-bit big-endian"),
+    (0, b'\xce\xfa\xed\xfe', "Mach-O 32-bit little-endian"),
+    (0, b'\xfe\xed\xfa\xcf', "Mach-O 64-bit big-endian"),
+    (0, b'\xcf\xfa\xed\xfe', "Mach-O 64-bit little-endian"),
+    (0, b'\xca\xfe\xba\xbe', _cafebabe),
+    (0, b'MZ', _pe),
+    (0, b'!<arch>\n', "current ar archive"),
+    # Images
+    (0, b'\x89PNG\r\n\x1a\n', _png),
+    (0, b'GIF87a', _gif),
+    (0, b'GIF89a', _gif),
+    (0, b'\xff\xd8\xff', "JPEG image data"),
+    (0, b'II*\0', _tiff),
+    (0, b'MM\0*', _tiff),
+    (0, b'8BPS', "Adobe Photoshop Image"),
+    (0, b'icns', "Mac OS X icon"),
+    (0, b'BM', _bmp),
+    # Audio and containers
+    (0, b'RIFF', _riff),
+    (0, b'RIFX', _riff),
+    (0, b'FORM', _iff),
+    (0, b'MThd', "Standard MIDI data"),
+    (0, b'OggS', "Ogg data"),
+    (0, b'fLaC', "FLAC audio bitstream data"),
+    (0, b'ID3', "Audio file with ID3 version 2"),
+    (0, b'.snd', "Sun/NeXT audio data"),
+    (0, b'VAGp', "PlayStation VAG ADPCM audio"),
+    # Archives
+    (0, b'PK\x03\x04', "Zip archive data"),
+    (0, b'PK\x05\x06', "Zip archive data (empty)"),
+    (0, b'\x1f\x8b', "gzip compressed data"),
+    (0, b'\x1f\x9d', "compress'd data 16 bits"),
+    (0, b'BZh', "bzip2 compressed data"),
+    (0, b'\xfd7zXZ\0', "XZ compressed data"),
+    (0, b"7z\xbc\xaf\x27\x1c", "7-zip archive data"),
+    (0, b'Rar!\x1a\x07', "RAR archive data"),
+    (0, b'MSCF\0\0\0\0', "Microsoft Cabinet archive data"),
+    (0, b'070707', "ASCII cpio archive (pre-SVR4 or odc)"),
+    (0, b'070701', "ASCII cpio archive (SVR4 with no CRC)"),
+    (0, b'070702', "ASCII cpio archive (SVR4 with CRC)"),
+    (0, b'StuffIt (c)1997', "StuffIt Archive (5.x)"),
+    (0, b'SIT!', _stuffit),
+    (257, b'ustar', _tar),
+    (0, b'%PDF-', "PDF document"),
+    (0, b'SQLite format 3\0', "SQLite 3.x database"),
+    # Classic Mac
+    (0, b'\x00\x05\x16\x00', _apple_single_double),
+    (0, b'\x00\x05\x16\x07', _apple_single_double),
+]
+
+# Checked only when no magic matched: signatures without magic bytes, weakest last
+FALLBACK_CHECKS = [_lha, _coff, _resource_fork, _macbinary, _egword_data]
+
+def identify(header):
+    """Description of the data starting with header, or None if the table doesn't know it."""
+    for offset, magic, describe in SIGNATURES:
+        if header.startswith(magic, offset):
+            desc = describe(header) if callable(describe) else describe
+            if desc:
+                return desc
+    for check in FALLBACK_CHECKS:
+        desc = check(header)
+        if desc:
+            return desc
+    return None
+
+def identify_file(path):
+    """identify() on the first HEADER_BYTES of a file; None if unknown or unreadable."""
+    try:
+        with open(path, 'rb') as f:
+            return identify(f.read(HEADER_BYTES))
+    except OSError:
+        return None
+
+def run_file_command(path):
+    try:
+        result = subprocess.run(["file", "-b", str(path)], capture_output=True, text=True)
+        return result.stdout.strip()
+    except Exception as e:
+        return f"Error running file command: {e}"
+
+def file_type(path, header=None):
+    """The file's type from the signature table, or from `file -b` if the table doesn't know it."""
+    desc = identify(header) if header is not None else identify_file(path)
+    if desc:
+        stats['signature'] += 1
+        return desc
+    stats['file'] += 1
+    return run_file_command(path)
+
+def file_info(path):
+    """Toolbelt plugin (File Info)."""
+    desc = identify_file(path)
+    source = "signature"
+    if desc is None:
+        desc, source = run_file_command(path), "file"
+    return {"output": desc, "data": {"type": desc, "source": source}}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python magic_detect.py <file>...")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        print(f"{path}: {file_type(path)}")
@@ -1,60 +1,50 @@
 
 import sys
 import os
+import io
 import time
-import csv
 import re
-import threading
-from concurrent.futures import ThreadPoolExecutor
-from deep_translator import GoogleTranslator
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-CACHE_FILE = "translation_cache.csv"
-TRANSLATION_CACHE = {}
-CACHE_LOCK = threading.Lock()
+import translation_memory
+import fuzzy_memory
+import translation_client
+import c_tokenizer
+from c_tokenizer import LineIndex, contains_japanese
 
-PROCESSED_COUNT = 0
-TOTAL_FILES = 0
-COUNTER_LOCK = threading.Lock()
+# Appends "//Translated: ..." lines after Japanese comments and strings in
+# .c/.h files, in place. A manifest (SQLite, keyed by absolute path) records the
+# size, mtime and SHA-1 each file had when it was last finished, so a re-run
+# skips unchanged files without reading them (stat matches) or without parsing
+# them (content hash matches). The manifest is committed every
+# CHECKPOINT_EVERY files, so an interrupted run resumes where it stopped.
+# Files are rewritten atomically (temp file + rename).
 
-API_LOCK = threading.Lock()
-LAST_API_CALL = 0
-MIN_DELAY = 2.0 # Seconds between API calls to be safe
+MANIFEST_PATH = "translate_manifest.db"
+REPORT_PATH = "translate_report.tsv"
+CHECKPOINT_EVERY = 25       # Finished files between manifest commits
+SLOWEST_SHOWN = 10
+WORKERS = 8
 
-def load_cache():
-    global TRANSLATION_CACHE
-    if not os.path.exists(CACHE_FILE):
-        return
-    
-    print(f"Loading cache from {CACHE_FILE}...")
-    try:
-        with open(CACHE_FILE, 'r', encoding='utf-8', newline='') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) >= 2:
-                    TRANSLATION_CACHE[row[0]] = row[1]
-    except Exception as e:
-        print(f"Error loading cache: {e}")
+INDENT_RE = re.compile(r'[^\t]')
 
 
-def save_cache_entry(original, translated):
-    global TRANSLATION_CACHE
-    with CACHE_LOCK:
-        if original in TRANSLATION_CACHE:
-            return
-        
-        TRANSLATION_CACHE[original] = translated
-        try:
-            with open(CACHE_FILE, 'a', encoding='utf-8', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([original, translated])
-        except Exception as e:
-            print(f"Error saving to cache: {e}")
+def load_cache():
+    """Brings an old translation_cache.csv into the translation memory, once."""
+    memory = fuzzy_memory.get_memory()
+    if os.path.exists(translation_memory.LEGACY_CSV) and memory.is_empty():
+        print(f"Importing {translation_memory.LEGACY_CSV} into {memory.path}...")
+        print(f"Imported {memory.import_csv(translation_memory.LEGACY_CSV)} translations.")
 
 
 def batch_translate(texts):
     """
-    Translates a list of texts using Google Translator.
-    Checks cache first.
+    Translates a list of texts through the shared translation client.
+    Checks the translation memory first.
     """
     if not texts:
         return []
@@ -63,10 +53,12 @@ def batch_translate(texts):
     to_fetch = []
     to_fetch_indices = []
     
-    # Check cache
+    # Check the translation memory (exact, then near-identical sources)
+    memory = fuzzy_memory.get_memory()
+    known = memory.lookup_many(texts)
     for i, text in enumerate(texts):
-        if text in TRANSLATION_CACHE:
-            results.append(TRANSLATION_CACHE[text])
+        if text in known:
+            results.append(known[text])
         else:
             results.append(None) # Placeholder
             to_fetch.append(text)
@@ -75,185 +67,55 @@ def batch_translate(texts):
     if not to_fetch:
         return results
         
-    # Translate remaining
+    # Translate remaining (batched and rate limited by the shared client; stored as they
+    # come in, and variants of a text that differ only in numbers/names reuse its result)
     print(f"Fetching {len(to_fetch)} translations from API...")
-    
+    fetched, _ = fuzzy_memory.translate_missing(memory, to_fetch, translation_client.get_client().translate_many)
     fetched_results = []
-    
-    chunk_size = 20
-    translator = GoogleTranslator(source='auto', target='en')
-    
-    for i in range(0, len(to_fetch), chunk_size):
-        chunk = to_fetch[i:i+chunk_size]
-        try:
-            # Rate limiting block
-            with API_LOCK:
-                global LAST_API_CALL
-                elapsed = time.time() - LAST_API_CALL
-                if elapsed < MIN_DELAY:
-                    time.sleep(MIN_DELAY - elapsed)
-                
-                try:
-                    translated = translator.translate_batch(chunk)
-                    fetched_results.extend(translated)
-                finally:
-                    LAST_API_CALL = time.time()
-                    
-        except Exception as e:
-            print(f"Batch translation error: {e}. Cooling down 30s...")
-            time.sleep(30)
-            print("Resuming with individual fallbacks...")
-            
-            for text in chunk:
-                # Rate limiting for individual fallback too
-                with API_LOCK:
-                    elapsed = time.time() - LAST_API_CALL
-                    if elapsed < MIN_DELAY:
-                        time.sleep(MIN_DELAY - elapsed)
-                        
-                    try:
-                        res = translator.translate(text)
-                        fetched_results.append(res)
-                    except Exception as ex:
-                        print(f"Failed to translate: {text[:20]}... {ex}")
-                        fetched_results.append("[Translation Failed]")
-                    finally:
-                         LAST_API_CALL = time.time()
+    for text in to_fetch:
+        if fetched.get(text) is None:
+            print(f"Failed to translate: {text[:20]}...")
+            fetched_results.append("[Translation Failed]")
+        else:
+            fetched_results.append(fetched[text])
 
-        
-    # Merge and Save
+    # Merge
     for i, res in enumerate(fetched_results):
-        original_idx = to_fetch_indices[i]
-        results[original_idx] = res
-        original_text = to_fetch[i]
-        if res and "[Translation Failed]" not in res:
-            save_cache_entry(original_text, res)
+        results[to_fetch_indices[i]] = res
             
     return results
 
-def contains_japanese(text):
-    for char in text:
-        code = ord(char)
-        if (0x3040 <= code <= 0x309f) or \
-           (0x30a0 <= code <= 0x30ff) or \
-           (0x4e00 <= code <= 0x9fff):
-            return True
-    return False
+def parse_and_process(file_path, content=None):
+    """Splits a file (or its already decoded content) into code, string literal and comment segments."""
+    if content is None:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
 
-def parse_and_process(file_path):
-    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-        content = f.read()
-
-    length = len(content)
-    segments = [] 
-    
-    i = 0
-    while i < length:
-        if content[i] == '"':
-            start_idx = i
-            i += 1
-            while i < length:
-                if content[i] == '"':
-                     bc = 0
-                     j = i - 1
-                     while j >= start_idx and content[j] == '\\':
-                         bc += 1
-                         j -= 1
-                     if bc % 2 == 0:
-                         break
-                i += 1
-            i += 1
-            segments.append({'type': 'string_literal', 'text': content[start_idx:i]})
-            
-        elif content[i] == "'":
-            start_idx = i
-            i += 1
-            while i < length:
-                if content[i] == "'":
-                     bc = 0
-                     j = i - 1
-                     while j >= start_idx and content[j] == '\\':
-                         bc += 1
-                         j -= 1
-                     if bc % 2 == 0:
-                         break
-                i += 1
-            i += 1
-            segments.append({'type': 'code', 'text': content[start_idx:i]})
-
-        elif content[i:i+2] == '//':
-            start_idx = i
-            end_idx = content.find('\n', i)
-            if end_idx == -1: end_idx = length
-            
-            raw = content[start_idx:end_idx]
-            content_text = raw[2:].strip()
-            
-            # Indentation
-            j = start_idx - 1
-            while j >= 0 and content[j] in ' \t': j -= 1
-            if j < 0 or content[j] == '\n': indentation = content[j+1:start_idx]
-            else:
-                last_nl = content.rfind('\n', 0, start_idx)
-                if last_nl == -1: line_prefix = content[0:start_idx]
-                else: line_prefix = content[last_nl+1:start_idx]
-                indentation = ""
-                for char in line_prefix:
-                    if char == '\t': indentation += '\t'
-                    else: indentation += ' '
-            
-            segments.append({
-                'type': 'comment_single',
-                'raw': raw,
-                'content_to_translate': content_text,
-                'indentation': indentation
-            })
-            i = end_idx
-
-        elif content[i:i+2] == '/*':
-            start_idx = i
-            end_idx = content.find('*/', i + 2)
-            if end_idx == -1: end_idx = length
-            else: end_idx += 2
-            
-            raw = content[start_idx:end_idx]
-            inner = raw[2:-2].strip()
-            
-            last_nl = content.rfind('\n', 0, start_idx)
-            if last_nl == -1: line_prefix = content[0:start_idx]
-            else: line_prefix = content[last_nl+1:start_idx]
-            indentation = ""
-            for char in line_prefix:
-                if char == '\t': indentation += '\t'
-                else: indentation += ' '
-                
+    lines = LineIndex(content)
+    segments = []
+    code = []       # Char literals are code here; runs are merged into one segment
+    for kind, start, end in c_tokenizer.tokenize(content):
+        if kind == 'code' or kind == 'char':
+            code.append(content[start:end])
+            continue
+        if code:
+            segments.append({'type': 'code', 'text': ''.join(code)})
+            code = []
+        if kind == 'string':
+            segments.append({'type': 'string_literal', 'text': content[start:end]})
+        else:
+            body_start, body_end = c_tokenizer.inner_span(content, kind, start, end)
+            # Indentation for the translation line: the comment's column, tabs kept
+            indentation = INDENT_RE.sub(' ', content[lines.line_start(start):start])
             segments.append({
-                'type': 'comment_block',
-                'raw': raw,
-                'content_to_translate': inner,
+                'type': 'comment_single' if kind == 'comment_line' else 'comment_block',
+                'raw': content[start:end],
+                'content_to_translate': content[body_start:body_end].strip(),
                 'indentation': indentation
             })
-            i = end_idx
-            
-        else:
-            segments.append({'type': 'code', 'text': content[i]})
-            i += 1
-
-    # Cleanup segments
-    consolidated = []
-    curr_code = []
-    for s in segments:
-        if s['type'] == 'code':
-            curr_code.append(s['text'])
-        else:
-            if curr_code:
-                consolidated.append({'type': 'code', 'text': "".join(curr_code)})
-                curr_code = []
-            consolidated.append(s)
-    if curr_code:
-        consolidated.append({'type': 'code', 'text': "".join(curr_code)})
-        
-    return consolidated
+    if code:
+        segments.append({'type': 'code', 'text': ''.join(code)})
+    return segments
 
 def is_already_translated(segments, idx):
     """
@@ -276,9 +138,16 @@ def is_already_translated(segments, idx):
             return False
     return False
 
-def process_file_content(file_path):
+def process_file_content(file_path, content=None, timings=None):
+    """
+    The file's new content, or None if there is nothing to add.
+    timings (a dict), if given, gets parse/translate times and item counts.
+    """
+    if timings is None:
+        timings = {}
+    started = time.perf_counter()
     print(f"  Parsing {file_path}...")
-    segments = parse_and_process(file_path)
+    segments = parse_and_process(file_path, content)
     
     candidates = []
     indices = []
@@ -304,11 +173,16 @@ def process_file_content(file_path):
             candidates.append(text)
             indices.append(i)
     
+    timings['parse'] = time.perf_counter() - started
+    timings['items'] = len(candidates)
     if not candidates:
         return None
         
     print(f"  Translating {len(candidates)} items...")
+    started = time.perf_counter()
     translations = batch_translate(candidates)
+    timings['translate'] = time.perf_counter() - started
+    timings['failed'] = sum(1 for t in translations if not t or "[Translation Failed]" in t)
     
     # Attach translations
     for i, trans in enumerate(translations):
@@ -381,50 +255,183 @@ def process_file_content(file_path):
 
 
 
-def safe_process_file(full_path):
-    global PROCESSED_COUNT
+# --- Manifest ---
+
+def open_manifest(path=MANIFEST_PATH):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS manifest (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha1 TEXT NOT NULL,
+            finished_at REAL
+        )
+    """)
+    conn.commit()
+    return conn
+
+def load_manifest(conn):
+    """path -> (size, mtime_ns, sha1)"""
+    return {row[0]: row[1:] for row in conn.execute("SELECT path, size, mtime_ns, sha1 FROM manifest")}
+
+def record(conn, path, size, mtime_ns, sha1):
+    conn.execute(
+        "INSERT OR REPLACE INTO manifest (path, size, mtime_ns, sha1, finished_at) VALUES (?, ?, ?, ?, ?)",
+        (path, size, mtime_ns, sha1, time.time())
+    )
+
+def atomic_write(path, data):
+    """Replaces path with data (bytes) so readers see the old or the new file, never a partial one."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.translate-')
     try:
-        new_content = process_file_content(full_path)
-        if new_content:
-            with open(full_path, 'w', encoding='utf-8') as f:
-                f.write(new_content)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# --- Driver ---
+
+def safe_process_file(full_path, known=None):
+    """
+    Translates one file unless the manifest entry `known` says it is unchanged.
+    Returns a result dict: status ('skipped', 'unchanged', 'no_change',
+    'translated', 'partial' or 'error'), timings, and what to record in the
+    manifest ('record', None when the file must be retried next run).
+    """
+    started = time.perf_counter()
+    result = {"path": full_path, "status": "error", "items": 0, "failed": 0,
+              "parse": 0.0, "translate": 0.0, "write": 0.0, "record": None}
+    try:
+        st = os.stat(full_path)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            result["status"] = "skipped"
+            return result
+
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        sha1 = hashlib.sha1(data).hexdigest()
+        if known and known[2] == sha1:
+            # Touched but not modified
+            result.update(status="unchanged", record=(st.st_size, st.st_mtime_ns, sha1))
+            return result
+
+        # Same decoding as reading in text mode (universal newlines)
+        content = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='replace').read()
+        new_content = process_file_content(full_path, content, result)
+        if new_content is None:
+            result["status"] = "no_change"
+        else:
+            started_write = time.perf_counter()
+            data = new_content.encode('utf-8')
+            atomic_write(full_path, data)
+            result["write"] = time.perf_counter() - started_write
+            st = os.stat(full_path)
+            sha1 = hashlib.sha1(data).hexdigest()
+            result["status"] = "partial" if result["failed"] else "translated"
+        if result["status"] != "partial":
+            # Files with failed translations are retried next run
+            result["record"] = (st.st_size, st.st_mtime_ns, sha1)
+    except translation_client.TranslationUnavailable:
+        raise   # Stops the run: every other file would wait out the same retries
     except Exception as e:
         print(f"Error processing {full_path}: {e}")
-        
-    with COUNTER_LOCK:
-        PROCESSED_COUNT += 1
-        if PROCESSED_COUNT % 100 == 0:
-            sys.stdout.write(f"Processed {PROCESSED_COUNT}/{TOTAL_FILES} files...\r")
-            sys.stdout.flush()
+        result["error"] = str(e)
+    finally:
+        result["total"] = time.perf_counter() - started
+    return result
 
+def write_report(results, report_path):
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write("path\tstatus\titems\tfailed\tparse_s\ttranslate_s\twrite_s\ttotal_s\n")
+        for r in results:
+            f.write(f"{r['path']}\t{r['status']}\t{r['items']}\t{r['failed']}\t"
+                    f"{r['parse']:.4f}\t{r['translate']:.4f}\t{r['write']:.4f}\t{r['total']:.4f}\n")
 
-def main(target_path):
+def print_report(results, elapsed, report_path):
+    counts = {}
+    for r in results:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    worked = [r for r in results if r['status'] not in ('skipped', 'unchanged')]
+    print("\n=== Summary ===")
+    print(f"Files:      {len(results)} ({', '.join(f'{n} {status}' for status, n in sorted(counts.items()))})")
+    print(f"Items:      {sum(r['items'] for r in results)} translated, {sum(r['failed'] for r in results)} failed")
+    print(f"Time:       {elapsed:.1f}s wall; parse {sum(r['parse'] for r in worked):.1f}s, "
+          f"translate {sum(r['translate'] for r in worked):.1f}s, write {sum(r['write'] for r in worked):.1f}s (summed over files)")
+    if worked:
+        print(f"Slowest files:")
+        for r in sorted(worked, key=lambda r: r['total'], reverse=True)[:SLOWEST_SHOWN]:
+            print(f"  {r['total']:7.2f}s  parse {r['parse']:.2f}s  translate {r['translate']:.2f}s  "
+                  f"write {r['write']:.2f}s  {r['items']} items  {r['path']}")
+    print(f"Per-file timings: {report_path}")
+
+def main(target_path, manifest_path=MANIFEST_PATH, report_path=REPORT_PATH, force=False, workers=WORKERS):
     load_cache()
     
     files_to_process = []
     if os.path.isfile(target_path):
-        files_to_process.append(target_path)
+        files_to_process.append(os.path.abspath(target_path))
     else:
         print(f"Scanning {target_path} for files...")
         for root, dirs, files in os.walk(target_path):
             for file in files:
                 if file.endswith('.c') or file.endswith('.h'):
-                    files_to_process.append(os.path.join(root, file))
+                    files_to_process.append(os.path.abspath(os.path.join(root, file)))
     
+    manifest = open_manifest(manifest_path)
+    known = {} if force else load_manifest(manifest)
     total = len(files_to_process)
-    global TOTAL_FILES
-    TOTAL_FILES = total
-    print(f"Found {total} files. Starting threaded processing (max 8 workers)...")
+    print(f"Found {total} files ({sum(1 for p in files_to_process if p in known)} in the manifest). "
+          f"Starting threaded processing (max {workers} workers)...")
     
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        executor.map(safe_process_file, files_to_process)
+    started = time.perf_counter()
+    results = []
+    since_checkpoint = 0
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(safe_process_file, path, known.get(path)) for path in files_to_process]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result['record']:
+                record(manifest, result['path'], *result['record'])
+                since_checkpoint += 1
+                if since_checkpoint >= CHECKPOINT_EVERY:
+                    manifest.commit()
+                    since_checkpoint = 0
+            if result['status'] not in ('skipped', 'unchanged'):
+                print(f"  Done {result['path']}: {result['status']}, {result['total']:.2f}s")
+            if len(results) % 100 == 0:
+                sys.stdout.write(f"Processed {len(results)}/{total} files...\r")
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        print("\nInterrupted; finished files are checkpointed, re-run to resume.")
+        executor.shutdown(wait=False, cancel_futures=True)
+    except translation_client.TranslationUnavailable as e:
+        print(f"\nStopped: {e}. Finished files are checkpointed, re-run to resume.")
+        executor.shutdown(wait=False, cancel_futures=True)
+    finally:
+        manifest.commit()
+        manifest.close()
+    executor.shutdown()
     
+    write_report(results, report_path)
+    print_report(results, time.perf_counter() - started, report_path)
     print("Processing complete.")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python translate_comments.py <path>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Append English translations after Japanese comments and strings in .c/.h files.')
+    parser.add_argument('path', help='File or directory to process')
+    parser.add_argument('--manifest', default=MANIFEST_PATH, help='Manifest of finished files')
+    parser.add_argument('--report', default=REPORT_PATH, help='Per-file timing report (TSV)')
+    parser.add_argument('--force', action='store_true', help='Ignore the manifest and re-check every file')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
     
-    main(sys.argv[1])
+    main(args.path, args.manifest, args.report, args.force, args.workers)
@@ -0,0 +1,299 @@
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared translation client for the translation tools.
+# Texts are packed into requests by character budget. Requests are paced by a
+# token bucket whose rate adapts AIMD-style: it creeps up while the API
+# answers and halves when it pushes back (errors, HTTP 429). A failed request
+# is retried after an exponential backoff with jitter, then its texts are
+# tried one by one. A batch that comes back with the wrong number of lines is
+# not the API pushing back: it is split into single texts straight away.
+#
+# Backends: Google via deep_translator (default), or any HTTP endpoint that
+# speaks {"q": [...]} -> {"translations": [...]}, selected with the
+# TRANSLATOR_URL environment variable. This file also contains such an
+# endpoint: a local rate-limited stand-in to benchmark against:
+#   python3 tools/translation_client.py serve --rate 5
+#   python3 tools/translation_client.py bench --url http://127.0.0.1:8765
+
+MAX_CHARS = 4500            # Google rejects requests over 5000 characters
+MAX_BATCH = 100             # Texts per request
+INITIAL_RATE = 2.0          # Requests per second
+MIN_RATE = 0.2
+MAX_RATE = 20.0
+RATE_STEP = 0.1             # Additive increase per successful request
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0          # Seconds; doubles per retry
+BACKOFF_CAP = 60.0
+WORKERS = 4                 # Requests in flight
+
+class RateLimitError(Exception):
+    pass
+
+class BatchMismatchError(ValueError):
+    """The API answered, but not with one translation per text. Retrying won't help."""
+
+class TranslationUnavailable(RuntimeError):
+    """The API kept failing (down, unreachable, rate-limiting) through every retry."""
+
+class TokenBucket:
+    """Blocking token bucket whose refill rate can be changed while in use."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+            self.capacity = max(1.0, rate)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def acquire(self, tokens=1.0):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+# --- Backends ---
+
+class GoogleBackend:
+    """deep_translator's Google endpoint; a batch is sent as newline-joined text."""
+
+    def __init__(self, source='auto', target='en'):
+        from deep_translator import GoogleTranslator
+        self.translator = GoogleTranslator(source=source, target=target)
+
+    def translate_batch(self, texts):
+        if len(texts) == 1:
+            return [self.translator.translate(texts[0])]
+        result = self.translator.translate("\n".join(texts))
+        lines = (result or '').split("\n")
+        if len(lines) != len(texts):
+            raise BatchMismatchError(f"batch came back with {len(lines)} lines for {len(texts)} texts")
+        return lines
+
+class HttpBackend:
+    def __init__(self, url, source='auto', target='en', timeout=60):
+        self.url = url
+        self.source = source
+        self.target = target
+        self.timeout = timeout
+
+    def translate_batch(self, texts):
+        body = json.dumps({"q": texts, "source": self.source, "target": self.target}).encode('utf-8')
+        req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as res:
+                translations = json.loads(res.read())['translations']
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                raise RateLimitError("429 Too Many Requests")
+            raise
+        if len(translations) != len(texts):
+            raise BatchMismatchError(f"batch came back with {len(translations)} translations for {len(texts)} texts")
+        return translations
+
+def default_backend():
+    url = os.environ.get('TRANSLATOR_URL')
+    return HttpBackend(url) if url else GoogleBackend()
+
+# --- Client ---
+
+def pack_batches(texts, max_chars=MAX_CHARS, max_batch=MAX_BATCH):
+    """Groups texts into requests under the character budget. Multi-line texts go alone."""
+    batches = []
+    current, size = [], 0
+    for text in texts:
+        if "\n" in text or len(text) >= max_chars:
+            batches.append([text])
+            continue
+        if current and (size + len(text) + 1 > max_chars or len(current) >= max_batch):
+            batches.append(current)
+            current, size = [], 0
+        current.append(text)
+        size += len(text) + 1
+    if current:
+        batches.append(current)
+    return batches
+
+class TranslationClient:
+    def __init__(self, backend=None, rate=INITIAL_RATE, workers=WORKERS, max_chars=MAX_CHARS, log=print):
+        self.backend = backend or default_backend()
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.max_chars = max_chars
+        self.log = log
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "texts": 0, "failed": 0}
+
+    def _adapt(self, ok):
+        with self.lock:
+            if ok:
+                rate = min(MAX_RATE, self.bucket.rate + RATE_STEP)
+            else:
+                rate = max(MIN_RATE, self.bucket.rate / 2)
+                self.stats['errors'] += 1
+        self.bucket.set_rate(rate)
+
+    def _send(self, batch):
+        """
+        One paced request with retries; raises TranslationUnavailable after
+        MAX_RETRIES failures. BatchMismatchError is raised at once, without backing off:
+        the request went through, it is the batch that doesn't work.
+        """
+        for attempt in range(MAX_RETRIES):
+            self.bucket.acquire()
+            with self.lock:
+                self.stats['requests'] += 1
+            try:
+                result = self.backend.translate_batch(batch)
+            except BatchMismatchError:
+                raise
+            except Exception as e:
+                self._adapt(False)
+                delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+                self.log(f"Translation request failed ({e}); retrying in {delay:.1f}s at {self.bucket.rate:.2f} req/s")
+                time.sleep(delay)
+                continue
+            self._adapt(True)
+            return result
+        raise TranslationUnavailable(f"translation API failed {MAX_RETRIES} times in a row")
+
+    def _translate_batch(self, batch):
+        """
+        [(text, translation or None)]. A batch the API mis-answers is sent again
+        text by text; TranslationUnavailable is passed on (retrying each text
+        would only multiply the wait).
+        """
+        try:
+            return list(zip(batch, self._send(batch)))
+        except BatchMismatchError as e:
+            if len(batch) == 1:
+                return [(batch[0], None)]
+            self.log(f"Translation request: {e}; sending its texts one by one")
+        # One text may be what upsets the API: fall back to single requests
+        results = []
+        for text in batch:
+            try:
+                results.append((text, self._send([text])[0]))
+            except BatchMismatchError:
+                results.append((text, None))
+        return results
+
+    def translate_many(self, texts):
+        """
+        {text: translation}; None for texts that could not be translated.
+        Raises TranslationUnavailable (dropping the batches not sent yet) if
+        the API is down.
+        """
+        unique = [t for t in dict.fromkeys(texts) if t.strip()]
+        translations = {t: "" for t in texts if not t.strip()}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._translate_batch, batch) for batch in pack_batches(unique, self.max_chars)]
+            try:
+                for future in futures:
+                    for text, translation in future.result():
+                        translations[text] = translation
+            except TranslationUnavailable:
+                executor.shutdown(cancel_futures=True)
+                raise
+        with self.lock:
+            self.stats['texts'] += len(unique)
+            self.stats['failed'] += sum(1 for t in unique if translations.get(t) is None)
+        return translations
+
+_default = None
+_default_lock = threading.Lock()
+
+def get_client():
+    """The process-wide client (one rate limiter per process)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = TranslationClient()
+        return _default
+
+# --- Local stand-in and benchmark ---
+
+def serve(port, rate, latency):
+    """Fake translator: uppercases, answers 429 above `rate` requests per second."""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    limiter = TokenBucket(rate)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with lock:
+                limiter._refill()
+                allowed = limiter.tokens >= 1
+                if allowed:
+                    limiter.tokens -= 1
+            if not allowed:
+                self.send_response(429)
+                self.end_headers()
+                return
+            time.sleep(latency)
+            data = json.dumps({"translations": [f"EN[{q.upper()}]" for q in body['q']]}).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    print(f"Stand-in translator on http://127.0.0.1:{port} ({rate} req/s, {latency}s latency)")
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+def bench(url, count, length):
+    texts = [f"テキスト{i} " + "あ" * random.randint(1, length) for i in range(count)]
+    client = TranslationClient(HttpBackend(url), log=lambda msg: None)
+    started = time.perf_counter()
+    translations = client.translate_many(texts)
+    elapsed = time.perf_counter() - started
+    ok = sum(1 for t in translations.values() if t)
+    print(f"{ok}/{count} texts in {elapsed:.1f}s ({ok / elapsed:.0f} texts/s), "
+          f"{client.stats['requests']} requests, {client.stats['errors']} rejected, "
+          f"final rate {client.bucket.rate:.2f} req/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Translation client tools.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('serve', help='Run a local rate-limited stand-in translator')
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--rate', type=float, default=5.0, help='Requests per second before answering 429')
+    p.add_argument('--latency', type=float, default=0.1)
+    p = sub.add_parser('bench', help='Translate generated texts through an HTTP translator')
+    p.add_argument('--url', default='http://127.0.0.1:8765')
+    p.add_argument('--texts', type=int, default=5000)
+    p.add_argument('--length', type=int, default=40, help='Max extra characters per text')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.port, args.rate, args.latency)
+    else:
+        bench(args.url, args.texts, args.length)
@@ -0,0 +1,196 @@
+import sys
+import os
+import atexit
+import re
+import csv
+import time
+import sqlite3
+import threading
+import unicodedata
+
+# Translation memory shared by the translation tools and the server: one
+# SQLite table keyed by the normalized source text, so a comment translated
+# once is never sent to the API again, whichever tool meets it next.
+# WAL mode lets any number of processes read while one writes. Hit/miss
+# counters are kept in memory and added to the DB in batches, so lookups
+# don't turn into writes.
+
+DB_PATH = "translation_memory.db"
+LEGACY_CSV = "translation_cache.csv"
+TARGET_LANG = "en"
+STATS_FLUSH_EVERY = 200     # Lookups between counter writes
+
+_SPACE_RE = re.compile(r'\s+')
+
+def normalize(text):
+    """Key for a source text: NFKC (full-width ASCII, half-width kana) and collapsed whitespace."""
+    return _SPACE_RE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+def is_failure(translation):
+    return not translation or '[Trans Fail' in translation or '[Translation Failed]' in translation
+
+class TranslationMemory:
+    def __init__(self, path=DB_PATH, target_lang=TARGET_LANG):
+        self.path = path
+        self.target_lang = target_lang
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = {}         # key -> hits not yet written
+        self._misses = 0
+        self._pending_lookups = 0
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                source TEXT NOT NULL,       -- As first seen, before normalization
+                target TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL,
+                last_hit REAL,
+                PRIMARY KEY (key, lang)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def lookup_many(self, texts):
+        """{text: translation} for the texts already in the memory."""
+        conn = self._conn()
+        keys = {}
+        for text in texts:
+            keys.setdefault(normalize(text), []).append(text)
+        found = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), 500):
+            chunk = key_list[i:i + 500]
+            cur = conn.execute(
+                f"SELECT key, target FROM translations WHERE lang = ? AND key IN ({','.join('?' * len(chunk))})",
+                [self.target_lang] + chunk
+            )
+            for key, target in cur:
+                for text in keys[key]:
+                    found[text] = target
+        hit_keys = [key for key in keys if keys[key][0] in found]
+        self._count(hit_keys, len(keys) - len(hit_keys))
+        return found
+
+    def lookup(self, text):
+        return self.lookup_many([text]).get(text)
+
+    def store_many(self, pairs):
+        """Adds (source, translation) pairs; failed translations are skipped."""
+        rows = [
+            (normalize(source), self.target_lang, source, target, time.time())
+            for source, target in pairs if source.strip() and not is_failure(target)
+        ]
+        if not rows:
+            return 0
+        conn = self._conn()
+        conn.executemany("""
+            INSERT INTO translations (key, lang, source, target, created_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (key, lang) DO UPDATE SET target = excluded.target
+        """, rows)
+        conn.commit()
+        return len(rows)
+
+    def store(self, source, target):
+        return self.store_many([(source, target)])
+
+    def _count(self, hit_keys, misses):
+        with self._lock:
+            for key in hit_keys:
+                self._hits[key] = self._hits.get(key, 0) + 1
+            self._misses += misses
+            self._pending_lookups += len(hit_keys) + misses
+            due = self._pending_lookups >= STATS_FLUSH_EVERY
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes the hit/miss counters collected since the last flush."""
+        with self._lock:
+            hits, misses = self._hits, self._misses
+            self._hits, self._misses, self._pending_lookups = {}, 0, 0
+        if not hits and not misses:
+            return
+        conn = self._conn()
+        now = time.time()
+        conn.executemany(
+            "UPDATE translations SET hits = hits + ?, last_hit = ? WHERE key = ? AND lang = ?",
+            [(count, now, key, self.target_lang) for key, count in hits.items()]
+        )
+        conn.executemany(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            [('hits', sum(hits.values())), ('misses', misses)]
+        )
+        conn.commit()
+
+    def stats(self):
+        self.flush()
+        conn = self._conn()
+        counters = dict(conn.execute("SELECT name, value FROM counters"))
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {
+            "entries": conn.execute("SELECT count(*) FROM translations WHERE lang = ?", (self.target_lang,)).fetchone()[0],
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None
+        }
+
+    def is_empty(self):
+        return self._conn().execute("SELECT 1 FROM translations LIMIT 1").fetchone() is None
+
+    def import_csv(self, csv_path=LEGACY_CSV):
+        """One-time import of the old translate_comments.py cache (original,translated rows)."""
+        pairs = []
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) >= 2:
+                    pairs.append((row[0], row[1]))
+        count = 0
+        for i in range(0, len(pairs), 5000):
+            count += self.store_many(pairs[i:i + 5000])
+        return count
+
+_default = None
+_default_lock = threading.Lock()
+
+def get_memory():
+    """The process-wide memory at DB_PATH (opened on first use)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = TranslationMemory()
+            atexit.register(_default.flush)
+        return _default
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('import', 'stats'):
+        print("Usage: python translation_memory.py import [translation_cache.csv] | stats")
+        sys.exit(1)
+    memory = get_memory()
+    if sys.argv[1] == 'import':
+        csv_path = sys.argv[2] if len(sys.argv) > 2 else LEGACY_CSV
+        if not os.path.exists(csv_path):
+            print(f"{csv_path} not found.")
+            sys.exit(1)
+        print(f"Imported {memory.import_csv(csv_path)} translations from {csv_path}.")
+    print(memory.stats())